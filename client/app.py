@@ -1,34 +1,46 @@
 from datetime import datetime
+import atexit
 import os
 
+from betterproto.lib.google.protobuf import FieldMask
 from flask import Flask, redirect, render_template, request, url_for
 from marshmallow import Schema, fields
-from grpclib.client import Channel
 
 import db
+from channel_pool import ChannelPool
 from db import RequestStatus
 
 app = Flask(__name__)
 
 SERVICE_HOST = os.getenv("APP_HOST", "127.0.0.1")
 SERVICE_PORT = os.getenv("APP_PORT", 50051)
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", 20))
+# get_boxes.html only renders these
+SUMMARY_FIELDS = FieldMask(paths=["id", "name"])
+
+# Long-lived connections shared by all views
+channel_pool = ChannelPool(host=SERVICE_HOST, port=SERVICE_PORT)
+atexit.register(channel_pool.close)
 
 
 class GetBoxesSchema(Schema):
+    # words to search for in names and descriptions
+    q = fields.Str()
     category = fields.Str()
     # ex: 2014-12-22T03:12:58.019077+00:00
     start_time = fields.DateTime()
     end_time = fields.DateTime()
+    min_price = fields.Int()
+    max_price = fields.Int()
+    page_token = fields.Str()
 
 
 @app.route("/box/<int:id>")
 async def get_box(id):
-    service_channel = Channel(host=SERVICE_HOST, port=SERVICE_PORT)
-    service = db.DatabaseServiceStub(service_channel)
+    service = channel_pool.stub()
 
     get_box_response = await service.get_box(id=id)
 
-    service_channel.close()
     if get_box_response.status == RequestStatus.OK:
         return render_template("get_box.html", box=get_box_response.box)
     else:
@@ -37,33 +49,77 @@ async def get_box(id):
 
 @app.route("/")
 async def get_boxes():
-    service_channel = Channel(host=SERVICE_HOST, port=SERVICE_PORT)
-    service = db.DatabaseServiceStub(service_channel)
+    service = channel_pool.stub()
 
     args = GetBoxesSchema().load(request.args)
-
-    if "category" in args:
-        get_boxes_response = await service.get_boxes_in_category(
-            category=args.get("category")
+    page = dict(
+        page_size=PAGE_SIZE,
+        page_token=args.get("page_token", ""),
+        field_mask=SUMMARY_FIELDS,
+    )
+
+    ranges = {
+        key: args[key]
+        for key in ("start_time", "end_time", "min_price", "max_price")
+        if key in args
+    }
+    if args.get("q", "").strip():
+        # the most relevant boxes, search results aren't paged
+        search_boxes_response = await service.search_boxes(
+            query=args["q"],
+            category=args.get("category", ""),
+            limit=PAGE_SIZE,
+            field_mask=SUMMARY_FIELDS,
         )
-    elif "start_time" in args and "end_time" in args:
+        return render_template(
+            "get_boxes.html",
+            boxes=[result.box for result in search_boxes_response.results],
+            query=args["q"],
+        )
+    if "category" in args or ranges:
+        # any combination of filters, e.g. a category created last week
         # ex datetime: 2014-12-22T03:12:58.019077+00:00
-        get_boxes_response = await service.get_boxes_in_time_range(
-            start_time=args.get("start_time"), end_time=args.get("end_time")
+        categories = [args["category"]] if "category" in args else []
+        get_boxes_response = await service.query_boxes(
+            categories=categories, **ranges, **page
         )
     else:
-        get_boxes_response = await service.get_boxes()
+        get_boxes_response = await service.get_boxes(**page)
+
+    # keep the filters, only the page token changes between pages
+    filters = {k: v for k, v in request.args.items() if k != "page_token"}
+    next_url = prev_url = None
+    if get_boxes_response.next_page_token:
+        next_url = url_for(
+            "get_boxes", page_token=get_boxes_response.next_page_token, **filters
+        )
+    if get_boxes_response.prev_page_token:
+        prev_url = url_for(
+            "get_boxes", page_token=get_boxes_response.prev_page_token, **filters
+        )
+    return render_template(
+        "get_boxes.html",
+        boxes=get_boxes_response.box,
+        next_url=next_url,
+        prev_url=prev_url,
+    )
+
+
+@app.route("/categories")
+async def get_categories():
+    service = channel_pool.stub()
+
+    # computed by the server, only one row per category comes over the wire
+    get_category_stats_response = await service.get_category_stats()
 
-    service_channel.close()
-    return render_template("get_boxes.html", boxes=get_boxes_response.box)
+    return render_template("categories.html", stats=get_category_stats_response.stats)
 
 
 @app.route("/create_box", methods=("GET", "POST"))
 async def create_box():
     err = None
     if request.method == "POST":
-        service_channel = Channel(host=SERVICE_HOST, port=SERVICE_PORT)
-        service = db.DatabaseServiceStub(service_channel)
+        service = channel_pool.stub()
 
         name = request.form["Name"]
         id = request.form["Id"]
@@ -83,7 +139,6 @@ async def create_box():
         )
 
         create_box_response = await service.create_box(box=box)
-        service_channel.close()
 
         if create_box_response.status == RequestStatus.OK:
             return redirect(url_for("get_boxes"))
@@ -95,8 +150,7 @@ async def create_box():
 
 @app.route("/update_box/<int:id>", methods=("GET", "POST"))
 async def update_box(id=None):
-    service_channel = Channel(host=SERVICE_HOST, port=SERVICE_PORT)
-    service = db.DatabaseServiceStub(service_channel)
+    service = channel_pool.stub()
     err = None
     if request.method == "POST":
         name = request.form["Name"]
@@ -116,7 +170,6 @@ async def update_box(id=None):
         )
 
         update_box_response = await service.update_box(box=box)
-        service_channel.close()
         if update_box_response.status == RequestStatus.OK:
             return redirect(url_for("get_box", id=id))
         else:
@@ -124,7 +177,6 @@ async def update_box(id=None):
 
     # GET method part
     get_box_response = await service.get_box(id=id)
-    service_channel.close()
 
     if get_box_response.status == RequestStatus.OK:
         return render_template("update_box.html", box=get_box_response.box, error=err)
@@ -134,12 +186,10 @@ async def update_box(id=None):
 
 @app.route("/box/<int:id>", methods=("POST",))
 async def delete_box(id):
-    service_channel = Channel(host=SERVICE_HOST, port=SERVICE_PORT)
-    service = db.DatabaseServiceStub(service_channel)
+    service = channel_pool.stub()
 
     delete_box_response = await service.delete_box(id=id)
 
-    service_channel.close()
     return redirect(url_for("get_boxes"))
 
 
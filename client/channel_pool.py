@@ -0,0 +1,141 @@
+import asyncio
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Any, List, Optional
+
+from grpclib.client import Channel
+from grpclib.config import Configuration
+
+import db
+from compression import CompressionCodec, client_compression
+
+log = logging.getLogger(__name__)
+
+GRPC_POOL_SIZE = int(os.getenv("GRPC_POOL_SIZE", 4))
+# Channels idle for longer than this are checked and reconnected if needed
+GRPC_POOL_HEALTH_INTERVAL = float(os.getenv("GRPC_POOL_HEALTH_INTERVAL", 30))
+# HTTP/2 pings on idle connections, so a dead peer is noticed early
+GRPC_POOL_KEEPALIVE = float(os.getenv("GRPC_POOL_KEEPALIVE", 60))
+
+
+class ChannelPool:
+    # grpclib channels belong to the event loop they were created on, but
+    # Flask runs every async view on a loop of its own. So the pool keeps its
+    # long-lived channels on a background thread with its own loop and the
+    # views hand their calls over to it
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        size: int = GRPC_POOL_SIZE,
+        health_interval: float = GRPC_POOL_HEALTH_INTERVAL,
+        keepalive: float = GRPC_POOL_KEEPALIVE,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.size = size
+        self.health_interval = health_interval
+        self.config = Configuration(
+            _keepalive_time=keepalive, _keepalive_permit_without_calls=True
+        )
+        # Only touched from the pool's own loop
+        self._channels: List[Optional[Channel]] = [None] * size
+        self._last_used = [0.0] * size
+        self._next = itertools.count()
+
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def stub(self) -> "PooledStub":
+        return PooledStub(self)
+
+    async def call(self, method: str, **kwargs) -> Any:
+        future = asyncio.run_coroutine_threadsafe(
+            self._call(method, kwargs), self._start()
+        )
+        return await asyncio.wrap_future(future)
+
+    def close(self) -> None:
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._close(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._run,
+                    args=(self._loop,),
+                    name="grpc-channel-pool",
+                    daemon=True,
+                ).start()
+            return self._loop
+
+    def _run(self, loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        health_check = loop.create_task(self._health_check())
+        loop.run_forever()
+        health_check.cancel()
+        loop.run_until_complete(asyncio.gather(health_check, return_exceptions=True))
+        loop.close()
+
+    def _channel(self, index: int) -> Channel:
+        channel = self._channels[index]
+        if channel is None:
+            # Connects lazily on the first call and again whenever the
+            # connection was lost
+            codec = CompressionCodec()
+            channel = Channel(
+                host=self.host, port=self.port, config=self.config, codec=codec
+            )
+            client_compression(channel, codec)
+            self._channels[index] = channel
+        return channel
+
+    async def _call(self, method: str, kwargs: dict) -> Any:
+        index = next(self._next) % self.size
+        self._last_used[index] = time.monotonic()
+        service = db.DatabaseServiceStub(self._channel(index))
+        return await getattr(service, method)(**kwargs)
+
+    async def _health_check(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            now = time.monotonic()
+            for index, channel in enumerate(self._channels):
+                if (
+                    channel is None
+                    or now - self._last_used[index] < self.health_interval
+                ):
+                    continue
+                # Reconnect in the background so the next view doesn't
+                # pay for the handshake
+                try:
+                    await channel.__connect__()
+                except OSError as exc:
+                    log.warning(f"Channel reconnect failed: index={index}, exc={exc}")
+
+    async def _close(self) -> None:
+        for index, channel in enumerate(self._channels):
+            if channel is not None:
+                channel.close()
+                self._channels[index] = None
+
+
+class PooledStub:
+    # Stands in for db.DatabaseServiceStub, every unary call is run on one
+    # of the pooled channels
+    def __init__(self, pool: ChannelPool) -> None:
+        self._pool = pool
+
+    def __getattr__(self, method: str):
+        async def call(**kwargs):
+            return await self._pool.call(method, **kwargs)
+
+        return call
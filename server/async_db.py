@@ -0,0 +1,198 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, List, Optional
+
+from consistency import ReadYourWrites
+from metrics import add_mongo_time
+from slow_queries import SlowQueryRecorder
+
+DB_EXECUTOR_WORKERS = int(os.environ.get("DB_EXECUTOR_WORKERS", 32))
+
+
+def get_executor(max_workers: Optional[int] = None) -> ThreadPoolExecutor:
+    # pymongo is thread safe and pools its own connections, so the number
+    # of workers bounds how many queries a single process has in flight
+    return ThreadPoolExecutor(
+        max_workers=max_workers or DB_EXECUTOR_WORKERS,
+        thread_name_prefix="mongo",
+    )
+
+
+class AsyncCollection:
+    # Wraps a pymongo Collection and runs every blocking call on a thread
+    # pool, so the grpclib event loop keeps serving other RPCs while
+    # a Mongo round-trip is in flight
+    def __init__(
+        self,
+        collection,
+        executor: ThreadPoolExecutor,
+        slow_queries: Optional[SlowQueryRecorder] = None,
+        consistency: Optional[ReadYourWrites] = None,
+    ) -> None:
+        self.collection = collection
+        self.executor = executor
+        self.slow_queries = slow_queries
+        self.consistency = consistency
+
+    def with_options(self, **kwargs) -> "AsyncCollection":
+        return AsyncCollection(
+            self.collection.with_options(**kwargs),
+            self.executor,
+            self.slow_queries,
+            self.consistency,
+        )
+
+    def _record(
+        self,
+        operation: str,
+        started: float,
+        returned: int,
+        args: tuple,
+        kwargs: dict,
+        explain: Optional[Callable[[], dict]] = None,
+    ) -> None:
+        # Runs on the executor, right after the query
+        if self.slow_queries is None:
+            return
+        self.slow_queries.record(
+            self.collection.name,
+            operation,
+            time.perf_counter() - started,
+            returned,
+            filter=args[0] if args else kwargs.get("filter"),
+            options={key: kwargs.get(key) for key in ("sort", "limit", "hint")},
+            explain=explain,
+            submit=self.executor.submit,
+        )
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(
+                self.executor, partial(func, *args, **kwargs)
+            )
+        finally:
+            add_mongo_time(time.perf_counter() - started)
+
+    async def call(self, func: Callable, *args, **kwargs) -> Any:
+        # A collection operation, in a causally consistent session if reads
+        # have to see earlier writes, func gets it as `session`
+        if self.consistency is not None:
+            return await self.run(self.consistency.call, func, *args, **kwargs)
+        return await self.run(func, *args, **kwargs)
+
+    async def find_one(self, *args, **kwargs) -> Optional[dict]:
+        def _find_one(**session):
+            started = time.perf_counter()
+            document = self.collection.find_one(*args, **kwargs, **session)
+            self._record(
+                "find_one",
+                started,
+                int(document is not None),
+                args,
+                kwargs,
+                lambda: self.collection.find(*args, **kwargs).limit(1).explain(),
+            )
+            return document
+
+        return await self.call(_find_one)
+
+    async def find(self, *args, **kwargs) -> List[dict]:
+        # Iterating the cursor is what does the network I/O,
+        # so it has to happen on the executor as well
+        def _find(**session):
+            started = time.perf_counter()
+            documents = list(self.collection.find(*args, **kwargs, **session))
+            self._record(
+                "find",
+                started,
+                len(documents),
+                args,
+                kwargs,
+                lambda: self.collection.find(*args, **kwargs).explain(),
+            )
+            return documents
+
+        return await self.call(_find)
+
+    async def find_batches(
+        self, *args, batch_size: int, **kwargs
+    ) -> AsyncIterator[List[dict]]:
+        # Yields the cursor one getMore batch at a time, the next batch is
+        # only fetched once the consumer asks for it
+        session = {}
+        if self.consistency is not None:
+            # The getMores have to run in the session the cursor started in
+            session["session"] = await self.run(self.consistency.start_session)
+        cursor = self.collection.find(*args, batch_size=batch_size, **kwargs, **session)
+
+        def _next_batch():
+            started = time.perf_counter()
+            batch = list(islice(cursor, batch_size))
+            self._record(
+                "find_batch",
+                started,
+                len(batch),
+                args,
+                kwargs,
+                lambda: self.collection.find(*args, **kwargs).explain(),
+            )
+            return batch
+
+        try:
+            while True:
+                batch = await self.run(_next_batch)
+                if batch:
+                    yield batch
+                if len(batch) < batch_size:
+                    break
+        finally:
+            # Don't wait for killCursors, the consumer may be gone already
+            self.executor.submit(self._close, cursor, session.get("session"))
+
+    def _close(self, cursor, session=None) -> None:
+        cursor.close()
+        if session is not None:
+            self.consistency.end_session(session)
+
+    async def aggregate(self, *args, **kwargs) -> List[dict]:
+        def _aggregate(**session):
+            started = time.perf_counter()
+            rows = list(self.collection.aggregate(*args, **kwargs, **session))
+            # Logged without a plan, explain output of a pipeline is per stage
+            self._record("aggregate", started, len(rows), ({"pipeline": args[0]},), {})
+            return rows
+
+        return await self.call(_aggregate)
+
+    async def find_one_and_update(self, *args, **kwargs) -> Optional[dict]:
+        return await self.call(self.collection.find_one_and_update, *args, **kwargs)
+
+    async def find_one_and_delete(self, *args, **kwargs) -> Optional[dict]:
+        return await self.call(self.collection.find_one_and_delete, *args, **kwargs)
+
+    async def insert_one(self, *args, **kwargs):
+        return await self.call(self.collection.insert_one, *args, **kwargs)
+
+    async def insert_many(self, *args, **kwargs):
+        return await self.call(self.collection.insert_many, *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await self.call(self.collection.update_one, *args, **kwargs)
+
+    async def delete_one(self, *args, **kwargs):
+        return await self.call(self.collection.delete_one, *args, **kwargs)
+
+    async def update_many(self, *args, **kwargs):
+        return await self.call(self.collection.update_many, *args, **kwargs)
+
+    async def delete_many(self, *args, **kwargs):
+        return await self.call(self.collection.delete_many, *args, **kwargs)
+
+    async def bulk_write(self, *args, **kwargs):
+        return await self.call(self.collection.bulk_write, *args, **kwargs)
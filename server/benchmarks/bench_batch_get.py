@@ -0,0 +1,92 @@
+# Compares one BatchGetBoxes call against the same number of sequential
+# GetBox calls, both over a loopback gRPC connection with the cache off.
+#
+#   PYTHONPATH=server/ python server/benchmarks/bench_batch_get.py --ids 10 50 200
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+
+from grpclib.client import Channel
+from grpclib.server import Server
+
+from cache import LRUCache
+from db import DatabaseServiceStub
+from db_manager import get_database
+from server import DatabaseService
+
+BENCHMARK_DB = "boxes_benchmark"
+
+
+def seed(boxes_db, count: int) -> None:
+    boxes_db.boxes.drop()
+    boxes_db.boxes.insert_many(
+        {
+            "_id": id,
+            "name": f"Box{id}",
+            "price": id % 100,
+            "description": "Benchmark box " * 8,
+            "category": f"CATEGORY_{id % 10}",
+            "quantity": id % 7,
+            "created_at": datetime.utcnow(),
+        }
+        for id in range(1, count + 1)
+    )
+
+
+async def timed(coro_factory, rounds: int) -> list:
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await coro_factory()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def main(args) -> None:
+    boxes_db = get_database().client[BENCHMARK_DB]
+    seed(boxes_db, max(args.ids))
+
+    service = DatabaseService(boxes_db=boxes_db, box_cache=LRUCache(maxsize=0))
+    server = Server([service])
+    await server.start(args.host, args.port)
+    channel = Channel(host=args.host, port=args.port)
+    stub = DatabaseServiceStub(channel)
+
+    print(
+        f"{'ids':>6} {'GetBox x N (ms)':>16} {'BatchGetBoxes (ms)':>19} {'speedup':>8}"
+    )
+    try:
+        for count in args.ids:
+            ids = list(range(1, count + 1))
+
+            async def sequential():
+                for id in ids:
+                    await stub.get_box(id=id)
+
+            async def batch():
+                await stub.batch_get_boxes(ids=ids)
+
+            sequential_ms = (
+                statistics.median(await timed(sequential, args.rounds)) * 1000
+            )
+            batch_ms = statistics.median(await timed(batch, args.rounds)) * 1000
+            print(
+                f"{count:>6} {sequential_ms:>16.2f} {batch_ms:>19.2f} "
+                f"{sequential_ms / batch_ms:>7.1f}x"
+            )
+    finally:
+        channel.close()
+        server.close()
+        await server.wait_closed()
+        boxes_db.client.drop_database(BENCHMARK_DB)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ids", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50061)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,102 @@
+# Compares the codec against the asdict() / Box(**data) conversions it
+# replaced, on documents shaped like the ones read from Mongo. The response
+# rows compare serializing a GetBoxesResponse built from decoded documents
+# against writing it straight from raw BSON.
+#
+#   PYTHONPATH=server/ python server/benchmarks/bench_codec.py --rows 100000
+import argparse
+import statistics
+import time
+from dataclasses import asdict
+from datetime import datetime, timezone
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+from codec import boxes_to_documents, documents_to_boxes
+from db import Box, GetBoxesResponse
+from wire import EncodedBoxesResponse, encode_boxes
+
+
+def box_to_dict(box_fields):
+    box_fields[1] = ("_id", box_fields[1][1])
+    return dict(box_fields)
+
+
+def legacy_encode(boxes):
+    return [asdict(box, dict_factory=box_to_dict) for box in boxes]
+
+
+def legacy_decode(documents):
+    boxes = []
+    for data in documents:
+        data = dict(data)
+        data["id"] = data.pop("_id")
+        # pymongo's naive datetimes are UTC, as document_to_box reads them
+        data["created_at"] = data["created_at"].replace(tzinfo=timezone.utc)
+        boxes.append(Box(**data))
+    return boxes
+
+
+def decoded_response(raw_documents):
+    documents = [bson.decode(document.raw) for document in raw_documents]
+    return bytes(GetBoxesResponse(box=documents_to_boxes(documents)))
+
+
+def encoded_response(raw_documents):
+    return bytes(EncodedBoxesResponse(encode_boxes(raw_documents)))
+
+
+def make_documents(count: int) -> list:
+    return [
+        {
+            "_id": id,
+            "name": f"Box{id}",
+            "price": id % 100,
+            "description": "Benchmark box " * 8,
+            "category": f"CATEGORY_{id % 10}",
+            "quantity": id % 7,
+            "created_at": datetime.utcnow(),
+        }
+        for id in range(1, count + 1)
+    ]
+
+
+def timed(func, arg, rounds: int) -> float:
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main(args) -> None:
+    documents = make_documents(args.rows)
+    boxes = legacy_decode(documents)
+    assert [bytes(box) for box in documents_to_boxes(documents)] == [
+        bytes(box) for box in boxes
+    ]
+    assert boxes_to_documents(boxes) == legacy_encode(boxes)
+    raw_documents = [RawBSONDocument(bson.encode(document)) for document in documents]
+    assert decoded_response(raw_documents) == encoded_response(raw_documents)
+
+    print(f"{'rows':>8} {'':>8} {'before (s)':>11} {'after (s)':>10} {'speedup':>8}")
+    for name, before, after, arg in (
+        ("decode", legacy_decode, documents_to_boxes, documents),
+        ("encode", legacy_encode, boxes_to_documents, boxes),
+        ("response", decoded_response, encoded_response, raw_documents),
+    ):
+        before_s = timed(before, arg, args.rounds)
+        after_s = timed(after, arg, args.rounds)
+        print(
+            f"{args.rows:>8} {name:>8} {before_s:>11.3f} {after_s:>10.3f} "
+            f"{before_s / after_s:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--rounds", type=int, default=3)
+    main(parser.parse_args())
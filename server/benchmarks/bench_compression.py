@@ -0,0 +1,146 @@
+# Compares GetBoxesInCategory responses of different sizes sent plain and
+# compressed with each encoding. The client talks to the server through a
+# proxy which counts the bytes the server sends, HTTP/2 framing included.
+#
+#   PYTHONPATH=server/ python server/benchmarks/bench_compression.py --sizes 1 100 1000
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+
+from grpclib.client import Channel
+from grpclib.server import Server
+
+from cache import LRUCache
+from compression import (
+    GRPC_COMPRESSION_LEVEL,
+    GRPC_COMPRESSION_MIN_SIZE,
+    CompressionCodec,
+    client_compression,
+    server_compression,
+)
+from db import DatabaseServiceStub
+from db_manager import get_database
+from server import DatabaseService
+
+BENCHMARK_DB = "boxes_benchmark"
+CATEGORY = "CATEGORY_BENCHMARK"
+
+
+def seed(boxes_db, count: int) -> None:
+    boxes_db.boxes.drop()
+    boxes_db.boxes.insert_many(
+        {
+            "_id": id,
+            "name": f"Box{id}",
+            "price": id % 100,
+            "description": "Benchmark box " * 8,
+            "category": CATEGORY,
+            "quantity": id % 7,
+            "created_at": datetime.utcnow(),
+        }
+        for id in range(1, count + 1)
+    )
+
+
+class CountingProxy:
+    # Forwards connections to the server and counts what comes back
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self.received = 0
+        self.connections = set()
+
+    async def pipe(self, reader, writer, count: bool) -> None:
+        try:
+            while data := await reader.read(65536):
+                if count:
+                    self.received += len(data)
+                writer.write(data)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def handle(self, client_reader, client_writer) -> None:
+        self.connections.add(asyncio.current_task())
+        server_reader, server_writer = await asyncio.open_connection(
+            self.host, self.port
+        )
+        await asyncio.gather(
+            self.pipe(client_reader, server_writer, count=False),
+            self.pipe(server_reader, client_writer, count=True),
+            return_exceptions=True,
+        )
+
+
+async def measure(stub, proxy: CountingProxy, size: int, rounds: int):
+    # Warm up, which also lets the channel learn what the server accepts
+    await stub.get_boxes_in_category(category=CATEGORY, page_size=size)
+    timings = []
+    received = proxy.received
+    for _ in range(rounds):
+        started = time.perf_counter()
+        response = await stub.get_boxes_in_category(category=CATEGORY, page_size=size)
+        timings.append(time.perf_counter() - started)
+        assert len(response.box) == size
+    return (proxy.received - received) / rounds, statistics.median(timings) * 1000
+
+
+async def main(args) -> None:
+    boxes_db = get_database().client[BENCHMARK_DB]
+    seed(boxes_db, max(args.sizes))
+
+    service = DatabaseService(boxes_db=boxes_db, box_cache=LRUCache(maxsize=0))
+    server_codec = CompressionCodec(
+        encodings=",".join(args.encodings), min_size=args.min_size, level=args.level
+    )
+    server = Server([service], codec=server_codec)
+    server_compression(server, server_codec)
+    await server.start(args.host, args.port)
+    proxy = CountingProxy(args.host, args.port)
+    proxy_server = await asyncio.start_server(proxy.handle, args.host, args.port + 1)
+
+    channels = {}
+    for encoding in ["plain"] + args.encodings:
+        codec = CompressionCodec(
+            encodings="" if encoding == "plain" else encoding, min_size=args.min_size
+        )
+        channels[encoding] = Channel(host=args.host, port=args.port + 1, codec=codec)
+        client_compression(channels[encoding], codec)
+
+    print(
+        f"{'boxes':>6} {'encoding':>9} {'bytes':>10} {'ratio':>6} {'latency (ms)':>13}"
+    )
+    try:
+        for size in args.sizes:
+            plain_bytes = None
+            for encoding, channel in channels.items():
+                received, latency = await measure(
+                    DatabaseServiceStub(channel), proxy, size, args.rounds
+                )
+                plain_bytes = plain_bytes or received
+                print(
+                    f"{size:>6} {encoding:>9} {received:>10.0f} "
+                    f"{plain_bytes / received:>5.1f}x {latency:>13.2f}"
+                )
+    finally:
+        for channel in channels.values():
+            channel.close()
+        proxy_server.close()
+        await asyncio.gather(*proxy.connections)
+        server.close()
+        await server.wait_closed()
+        boxes_db.client.drop_database(BENCHMARK_DB)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--encodings", nargs="+", default=["gzip", "deflate"])
+    parser.add_argument("--min-size", type=int, default=GRPC_COMPRESSION_MIN_SIZE)
+    parser.add_argument("--level", type=int, default=GRPC_COMPRESSION_LEVEL)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50061)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,388 @@
+# End-to-end load test: many concurrent DatabaseServiceStub clients drive a
+# weighted mix of RPCs against a server for a fixed time and report QPS and
+# latency percentiles, overall and per RPC, as JSON for comparing releases.
+#
+# By default a server process is started on a database of its own, seeded
+# through BulkCreateBoxes and dropped afterwards. With --target the load goes
+# to a running server instead, the boxes are seeded with ids from --first-id
+# and in LOADTEST_* categories and deleted again at the end.
+#
+#   PYTHONPATH=server/ python server/benchmarks/load_test.py --boxes 100000 \
+#       --clients 64 --duration 30 --mix get_box=60,get_boxes_in_category=20,\
+#   get_boxes_in_time_range=10,update_box=10 --output results.json
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from grpclib.client import Channel
+from grpclib.server import Server
+
+from db import Box, CreateBoxRequest, DatabaseServiceStub, RequestStatus
+
+BENCHMARK_DB = "boxes_loadtest"
+CATEGORY_PREFIX = "LOADTEST_"
+
+RPCS = [
+    "get_box",
+    "get_boxes",
+    "get_boxes_in_category",
+    "get_boxes_in_time_range",
+    "create_box",
+    "update_box",
+    "delete_box",
+]
+DEFAULT_MIX = (
+    "get_box=50,get_boxes=5,get_boxes_in_category=20,"
+    "get_boxes_in_time_range=10,create_box=5,update_box=5,delete_box=5"
+)
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in RPCS:
+            raise argparse.ArgumentTypeError(f"unknown RPC {name!r}, one of {RPCS}")
+        mix[name] = int(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs a positive weight")
+    return mix
+
+
+def serve(host: str, port: int, db_name: str, ready) -> None:
+    # Runs in a process of its own, so the clients' event loop doesn't
+    # compete with the server's
+    from db_manager import get_database
+    from indexes import sync_indexes
+    from server import DatabaseService
+
+    async def run():
+        boxes_db = get_database().client[db_name]
+        sync_indexes(boxes_db)
+        server = Server([DatabaseService(boxes_db=boxes_db)])
+        await server.start(host, port)
+        ready.set()
+        await server.wait_closed()
+
+    asyncio.run(run())
+
+
+def start_server(args) -> multiprocessing.Process:
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    process = context.Process(
+        target=serve,
+        args=(args.host, args.port, BENCHMARK_DB, ready),
+        daemon=True,
+    )
+    process.start()
+    if not ready.wait(60):
+        process.terminate()
+        raise RuntimeError("the server did not start")
+    return process
+
+
+class Dataset:
+    def __init__(self, args) -> None:
+        self.first_id = args.first_id
+        self.count = args.boxes
+        self.categories = [f"{CATEGORY_PREFIX}{n}" for n in range(args.categories)]
+        # created_at is spread evenly over the span, so a time range query
+        # of a given fraction of it matches that fraction of the boxes
+        self.end_time = datetime.now(timezone.utc)
+        self.span = timedelta(days=args.span_days)
+        self.start_time = self.end_time - self.span
+        self.range_fraction = args.range_fraction
+        # Ids of boxes created by the workload, delete_box takes them back
+        self.next_id = self.first_id + self.count
+        self.created: List[int] = []
+
+    def box(self, id: int) -> Box:
+        index = id - self.first_id
+        return Box(
+            id=id,
+            name=f"Box{id}",
+            price=index % 1000,
+            description="Load test box " * 8,
+            category=self.categories[index % len(self.categories)],
+            quantity=index % 50,
+            created_at=self.start_time + self.span * (index / max(self.count, 1)),
+        )
+
+    def random_id(self) -> int:
+        return self.first_id + random.randrange(self.count)
+
+    def random_range(self):
+        width = self.span * self.range_fraction
+        start = self.start_time + (self.span - width) * random.random()
+        return start, start + width
+
+
+async def seed(stub: DatabaseServiceStub, dataset: Dataset, batch: int) -> None:
+    for offset in range(0, dataset.count, batch):
+        ids = range(
+            dataset.first_id + offset,
+            dataset.first_id + min(offset + batch, dataset.count),
+        )
+        response = await stub.bulk_create_boxes(
+            request_iterator=[CreateBoxRequest(box=dataset.box(id)) for id in ids]
+        )
+        if response.status != RequestStatus.OK:
+            raise RuntimeError(
+                f"seeding failed: {response.failures[0].errmsg}"
+                if response.failures
+                else "seeding failed"
+            )
+
+
+async def clean_up(stub: DatabaseServiceStub, dataset: Dataset) -> None:
+    for category in dataset.categories:
+        await stub.delete_boxes_in_category(category=category)
+
+
+async def call(stub: DatabaseServiceStub, dataset: Dataset, rpc: str, page_size: int):
+    # Returns the RPC which was really made and its response status
+    if rpc == "delete_box" and not dataset.created:
+        # nothing of the workload's own left to delete yet
+        rpc = "create_box"
+
+    if rpc == "get_box":
+        response = await stub.get_box(id=dataset.random_id())
+    elif rpc == "get_boxes":
+        response = await stub.get_boxes(page_size=page_size)
+    elif rpc == "get_boxes_in_category":
+        response = await stub.get_boxes_in_category(
+            category=random.choice(dataset.categories), page_size=page_size
+        )
+    elif rpc == "get_boxes_in_time_range":
+        start_time, end_time = dataset.random_range()
+        response = await stub.get_boxes_in_time_range(
+            start_time=start_time, end_time=end_time, page_size=page_size
+        )
+    elif rpc == "create_box":
+        id = dataset.next_id
+        dataset.next_id += 1
+        response = await stub.create_box(box=dataset.box(id))
+        dataset.created.append(id)
+    elif rpc == "update_box":
+        box = dataset.box(dataset.random_id())
+        # a changed price, so the update really modifies the box
+        box.price = random.randrange(1000, 2000)
+        response = await stub.update_box(box=box)
+    else:
+        response = await stub.delete_box(id=dataset.created.pop())
+    return rpc, response.status
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {rpc: [] for rpc in RPCS}
+        self.errors: Dict[str, int] = {rpc: 0 for rpc in RPCS}
+        self.recording = False
+
+    def record(self, rpc: str, seconds: float, ok: bool) -> None:
+        if not self.recording:
+            return
+        self.latencies[rpc].append(seconds)
+        if not ok:
+            self.errors[rpc] += 1
+
+
+async def worker(
+    stub: DatabaseServiceStub,
+    dataset: Dataset,
+    mix: Dict[str, int],
+    page_size: int,
+    recorder: Recorder,
+    deadline: float,
+) -> None:
+    rpcs, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        rpc = random.choices(rpcs, weights)[0]
+        started = time.perf_counter()
+        try:
+            rpc, status = await call(stub, dataset, rpc, page_size)
+            ok = status == RequestStatus.OK
+        except Exception:
+            # transport errors and server exceptions count as failed calls
+            ok = False
+        recorder.record(rpc, time.perf_counter() - started, ok)
+
+
+def percentile(ordered: List[float], percent: float) -> float:
+    # nearest rank
+    if not ordered:
+        return 0.0
+    rank = max(int(round(percent / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(latencies: List[float], errors: int, duration: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "qps": round(len(ordered) / duration, 2),
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+            "p50": round(percentile(ordered, 50) * 1000, 3),
+            "p95": round(percentile(ordered, 95) * 1000, 3),
+            "p99": round(percentile(ordered, 99) * 1000, 3),
+            "max": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        },
+    }
+
+
+async def run(args) -> dict:
+    process = None
+    if args.target:
+        host, _, port = args.target.rpartition(":")
+    else:
+        host, port = args.host, args.port
+        process = start_server(args)
+
+    channels = [Channel(host=host, port=int(port)) for _ in range(args.channels)]
+    stubs = [
+        DatabaseServiceStub(channels[n % len(channels)]) for n in range(args.clients)
+    ]
+    dataset = Dataset(args)
+    recorder = Recorder()
+    started_at = datetime.now(timezone.utc)
+    try:
+        seeding_started = time.perf_counter()
+        await seed(stubs[0], dataset, args.seed_batch)
+        seeding_s = time.perf_counter() - seeding_started
+
+        deadline = time.perf_counter() + args.warmup + args.duration
+        workers = asyncio.gather(
+            *(
+                worker(stub, dataset, args.mix, args.page_size, recorder, deadline)
+                for stub in stubs
+            )
+        )
+        await asyncio.sleep(args.warmup)
+        recorder.recording = True
+        measured_from = time.perf_counter()
+        await workers
+        duration = time.perf_counter() - measured_from
+    finally:
+        if not args.keep:
+            await clean_up(stubs[0], dataset)
+        for channel in channels:
+            channel.close()
+        if process is not None:
+            process.terminate()
+            process.join()
+            if not args.keep:
+                from db_manager import get_database
+
+                get_database().client.drop_database(BENCHMARK_DB)
+
+    everything = [seconds for rpc in RPCS for seconds in recorder.latencies[rpc]]
+    return {
+        "label": args.label,
+        "started_at": started_at.isoformat(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "config": {
+            "target": args.target or "local",
+            "boxes": args.boxes,
+            "categories": args.categories,
+            "clients": args.clients,
+            "channels": args.channels,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "page_size": args.page_size,
+            "range_fraction": args.range_fraction,
+            "mix": args.mix,
+        },
+        "seeding_s": round(seeding_s, 3),
+        "duration_s": round(duration, 3),
+        "total": summarize(everything, sum(recorder.errors.values()), duration),
+        "rpcs": {
+            rpc: summarize(recorder.latencies[rpc], recorder.errors[rpc], duration)
+            for rpc in RPCS
+            if recorder.latencies[rpc]
+        },
+    }
+
+
+def print_summary(results: dict) -> None:
+    print(
+        f"{'rpc':<24} {'requests':>9} {'errors':>7} {'qps':>9} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}",
+        file=sys.stderr,
+    )
+    for name, row in [*results["rpcs"].items(), ("total", results["total"])]:
+        latency = row["latency_ms"]
+        print(
+            f"{name:<24} {row['requests']:>9} {row['errors']:>7} {row['qps']:>9.1f} "
+            f"{latency['p50']:>8.2f} {latency['p95']:>8.2f} {latency['p99']:>8.2f}",
+            file=sys.stderr,
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--boxes", type=int, default=10000, help="boxes to seed")
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument(
+        "--clients", type=int, default=32, help="concurrent stubs making calls"
+    )
+    parser.add_argument(
+        "--channels", type=int, default=4, help="connections the stubs share"
+    )
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument(
+        "--warmup", type=float, default=5, help="seconds of load not measured"
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=parse_mix(DEFAULT_MIX),
+        help=f"RPC weights, default {DEFAULT_MIX}",
+    )
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--span-days", type=float, default=30)
+    parser.add_argument(
+        "--range-fraction",
+        type=float,
+        default=0.01,
+        help="share of the boxes a time range query matches",
+    )
+    parser.add_argument("--seed-batch", type=int, default=1000)
+    parser.add_argument("--first-id", type=int, default=1000000000)
+    parser.add_argument("--random-seed", type=int, default=None)
+    parser.add_argument(
+        "--target", help="host:port of a running server, instead of starting one"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50071)
+    parser.add_argument("--label", default=os.environ.get("LOADTEST_LABEL", ""))
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument(
+        "--keep", action="store_true", help="leave the seeded boxes in place"
+    )
+    args = parser.parse_args()
+
+    random.seed(args.random_seed)
+    results = asyncio.run(run(args))
+    print_summary(results)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
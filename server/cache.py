@@ -0,0 +1,104 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from metrics import REGISTRY, Counter
+
+BOX_CACHE_SIZE = int(os.environ.get("BOX_CACHE_SIZE", 10000))
+BOX_CACHE_TTL = float(os.environ.get("BOX_CACHE_TTL", 60))
+
+CACHE_HITS = REGISTRY.register(
+    Counter("boxes_box_cache_hits_total", "Box cache lookups which found the box")
+)
+CACHE_MISSES = REGISTRY.register(
+    Counter(
+        "boxes_box_cache_misses_total",
+        "Box cache lookups which didn't find the box, expired ones included",
+    )
+)
+CACHE_EVICTIONS = REGISTRY.register(
+    Counter("boxes_box_cache_evictions_total", "Boxes evicted to make room")
+)
+CACHE_EXPIRATIONS = REGISTRY.register(
+    Counter("boxes_box_cache_expirations_total", "Boxes dropped once their TTL ran out")
+)
+
+
+class LRUCache:
+    # Least recently used entries are evicted once `maxsize` is reached and
+    # entries older than `ttl` seconds count as misses. maxsize=0 disables it.
+    # Only ever touched from the event loop thread, so there is no locking
+    def __init__(
+        self,
+        maxsize: int = BOX_CACHE_SIZE,
+        ttl: float = BOX_CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        # Bumped on every invalidation, see put()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            CACHE_MISSES.inc()
+            return None
+
+        value, expires_at = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            CACHE_EXPIRATIONS.inc()
+            CACHE_MISSES.inc()
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        CACHE_HITS.inc()
+        return value
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        # Read-through callers pass the generation they saw before going to
+        # the database. If anything was invalidated meanwhile, the value
+        # may predate that write and is not cached
+        if self.maxsize <= 0:
+            return
+        if generation is not None and generation != self.generation:
+            return
+
+        self._entries[key] = (value, self.clock() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            CACHE_EVICTIONS.inc()
+
+    def invalidate(self, key: Hashable) -> None:
+        self.generation += 1
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,84 @@
+import dataclasses
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from betterproto import PLACEHOLDER
+
+from db import Box
+
+# Box field name -> Mongo document field name
+DOCUMENT_FIELDS = {
+    field.name: "_id" if field.name == "id" else field.name
+    for field in dataclasses.fields(Box)
+}
+
+# (Box field, document field) pairs, in field order
+_ENCODE_TABLE = tuple(DOCUMENT_FIELDS.items())
+# (document field, Box field) pairs, in field order
+_DECODE_TABLE = tuple((document, field) for field, document in _ENCODE_TABLE)
+_FIELD_DEFAULTS = {field: Box()._get_field_default(field) for field in DOCUMENT_FIELDS}
+# What Box.__init__ stores for fields it wasn't given, PLACEHOLDER for the
+# ones betterproto resolves lazily and None for optional ones
+_UNSET_FIELDS = {field.name: field.default for field in dataclasses.fields(Box)}
+_ONEOF_GROUPS = {group: None for group in Box()._betterproto.oneof_field_by_group}
+# Timestamp fields, pymongo decodes them as naive UTC datetimes
+_DATETIME_FIELDS = tuple(
+    field.name for field in dataclasses.fields(Box) if field.type is datetime
+)
+
+
+def decode_table(paths: Optional[Sequence[str]] = None) -> Tuple[Tuple[str, str], ...]:
+    # Which document fields to copy into the Box, paths come from a field mask
+    if not paths:
+        return _DECODE_TABLE
+    return tuple((DOCUMENT_FIELDS[path], path) for path in paths)
+
+
+def box_to_document(box: Box) -> dict:
+    values = box.__dict__
+    document = {}
+    for field, document_field in _ENCODE_TABLE:
+        value = values[field]
+        document[document_field] = (
+            _FIELD_DEFAULTS[field] if value is PLACEHOLDER else value
+        )
+    return document
+
+
+def boxes_to_documents(boxes: Iterable[Box]) -> List[dict]:
+    return [box_to_document(box) for box in boxes]
+
+
+def document_to_box(
+    document: dict, paths: Optional[Sequence[str]] = None, table=None
+) -> Box:
+    # Fills the instance the way Box.__init__ and __post_init__ would,
+    # minus the per-field __setattr__ and bookkeeping. The document is
+    # not modified, so cached documents can be decoded as they are
+    values = dict(_UNSET_FIELDS)
+    for document_field, field in table or decode_table(paths):
+        if document_field in document:
+            values[field] = document[document_field]
+    # betterproto reads naive datetimes as local time, the wire encoder as UTC
+    for field in _DATETIME_FIELDS:
+        value = values[field]
+        if isinstance(value, datetime) and value.tzinfo is None:
+            values[field] = value.replace(tzinfo=timezone.utc)
+
+    box = Box.__new__(Box)
+    state = box.__dict__
+    state.update(values)
+    state["_serialized_on_wire"] = any(
+        value is not PLACEHOLDER and value is not None for value in values.values()
+    )
+    state["_unknown_fields"] = b""
+    state["_group_current"] = dict(_ONEOF_GROUPS)
+    return box
+
+
+def documents_to_boxes(
+    documents: Iterable[dict], paths: Optional[Sequence[str]] = None
+) -> List[Box]:
+    # Works on lists as well as on live cursors
+    table = decode_table(paths)
+    return [document_to_box(document, table=table) for document in documents]
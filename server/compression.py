@@ -0,0 +1,133 @@
+# gRPC message compression for the server and the client. They are
+# deployed separately and each ship a copy of this module, keep
+# server/compression.py and client/compression.py the same, see
+# test_compression.py
+import gzip
+import os
+import zlib
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+from grpclib.client import Channel
+from grpclib.encoding.proto import ProtoCodec
+from grpclib.events import (
+    RecvInitialMetadata,
+    RecvRequest,
+    SendInitialMetadata,
+    SendRequest,
+    listen,
+)
+from grpclib.server import Server
+
+# Encodings to offer in order of preference, empty turns compression off
+GRPC_COMPRESSION = os.environ.get("GRPC_COMPRESSION", "gzip,deflate")
+# Smaller messages, e.g. a single Box, are sent as they are
+GRPC_COMPRESSION_MIN_SIZE = int(os.environ.get("GRPC_COMPRESSION_MIN_SIZE", 1024))
+# 1 is the fastest and 9 the smallest
+GRPC_COMPRESSION_LEVEL = int(os.environ.get("GRPC_COMPRESSION_LEVEL", 1))
+
+# Both sides list the encodings they can decode in this metadata key
+ACCEPT_ENCODING = "boxes-accept-encoding"
+
+COMPRESSORS = {
+    "gzip": lambda data, level: gzip.compress(data, level, mtime=0),
+    "deflate": zlib.compress,
+}
+ENCODING_IDS = {"gzip": b"\x01", "deflate": b"\x02"}
+DECOMPRESSORS = {b"\x01": gzip.decompress, b"\x02": zlib.decompress}
+
+# grpclib refuses messages with the gRPC compressed flag set, so compressed
+# messages are marked in the payload instead: a 0 byte, which can't start
+# a protobuf message, then the encoding's id
+_MARKER = b"\x00"
+
+# What the server compresses the current RPC's responses with
+_response_encoding: ContextVar[Optional[str]] = ContextVar(
+    "response_encoding", default=None
+)
+
+
+def parse_encodings(value: str) -> Tuple[str, ...]:
+    encodings = (encoding.strip() for encoding in value.split(","))
+    return tuple(encoding for encoding in encodings if encoding in COMPRESSORS)
+
+
+class CompressionCodec(ProtoCodec):
+    # Compresses messages of min_size bytes or more with the first of
+    # `encodings` the peer accepts. The client sends what it accepts with
+    # every request and the server with its responses, so requests are only
+    # compressed once the server is known to decode them. Peers which don't
+    # send the metadata get plain messages
+    def __init__(
+        self,
+        encodings: Optional[str] = None,
+        min_size: int = GRPC_COMPRESSION_MIN_SIZE,
+        level: int = GRPC_COMPRESSION_LEVEL,
+    ) -> None:
+        self.encodings = parse_encodings(
+            GRPC_COMPRESSION if encodings is None else encodings
+        )
+        self.min_size = min_size
+        self.level = level
+        # On the client, what the requests are compressed with
+        self.request_encoding: Optional[str] = None
+
+    def negotiate(self, accepted: Optional[str]) -> Optional[str]:
+        if not accepted:
+            return None
+        peer = parse_encodings(accepted)
+        for encoding in self.encodings:
+            if encoding in peer:
+                return encoding
+        return None
+
+    def encode(self, message, message_type) -> bytes:
+        data = super().encode(message, message_type)
+        encoding = _response_encoding.get() or self.request_encoding
+        if encoding is None or len(data) < self.min_size:
+            return data
+        compressed = COMPRESSORS[encoding](data, self.level)
+        if len(compressed) + 2 >= len(data):
+            return data
+        return _MARKER + ENCODING_IDS[encoding] + compressed
+
+    def decode(self, data: bytes, message_type):
+        if data[:1] == _MARKER:
+            decompress = DECOMPRESSORS.get(data[1:2])
+            if decompress is None:
+                raise ValueError(f"Unknown message encoding: {data[1:2]!r}")
+            data = decompress(data[2:])
+        return super().decode(data, message_type)
+
+
+def server_compression(server: Server, codec: CompressionCodec) -> None:
+    # `codec` is the one the server was created with
+    if not codec.encodings:
+        return
+    accepted = ",".join(codec.encodings)
+
+    async def recv_request(event: RecvRequest) -> None:
+        # The handler runs in the same task, and so sees the encoding
+        _response_encoding.set(codec.negotiate(event.metadata.get(ACCEPT_ENCODING)))
+
+    async def send_initial_metadata(event: SendInitialMetadata) -> None:
+        event.metadata[ACCEPT_ENCODING] = accepted
+
+    listen(server, RecvRequest, recv_request)
+    listen(server, SendInitialMetadata, send_initial_metadata)
+
+
+def client_compression(channel: Channel, codec: CompressionCodec) -> None:
+    # `codec` is the one the channel was created with
+    if not codec.encodings:
+        return
+    accepted = ",".join(codec.encodings)
+
+    async def send_request(event: SendRequest) -> None:
+        event.metadata[ACCEPT_ENCODING] = accepted
+
+    async def recv_initial_metadata(event: RecvInitialMetadata) -> None:
+        codec.request_encoding = codec.negotiate(event.metadata.get(ACCEPT_ENCODING))
+
+    listen(channel, SendRequest, send_request)
+    listen(channel, RecvInitialMetadata, recv_initial_metadata)
@@ -0,0 +1,53 @@
+import threading
+from typing import Any, Callable, Optional
+
+from bson import Timestamp
+from pymongo.client_session import ClientSession
+
+
+class ReadYourWrites:
+    # Lets reads from secondaries see every write this process made before
+    # them. Each operation runs in a causally consistent session which is
+    # first advanced to the latest cluster and operation time any operation
+    # has seen, so a secondary waits until it has caught up with them.
+    # A client only reads its writes over connections to this process. The
+    # SO_REUSEPORT workers get a client's connections spread across them,
+    # e.g. the channels of the client's pool, so a read can reach a worker
+    # which hasn't seen the write
+    def __init__(self, client) -> None:
+        self.client = client
+        self.cluster_time: Optional[dict] = None
+        self.operation_time: Optional[Timestamp] = None
+        # Sessions are used on the executor threads
+        self._lock = threading.Lock()
+
+    def start_session(self) -> ClientSession:
+        session = self.client.start_session(causal_consistency=True)
+        with self._lock:
+            cluster_time, operation_time = self.cluster_time, self.operation_time
+        if cluster_time is not None:
+            session.advance_cluster_time(cluster_time)
+        if operation_time is not None:
+            session.advance_operation_time(operation_time)
+        return session
+
+    def end_session(self, session: ClientSession) -> None:
+        cluster_time, operation_time = session.cluster_time, session.operation_time
+        with self._lock:
+            if cluster_time is not None and (
+                self.cluster_time is None
+                or cluster_time["clusterTime"] > self.cluster_time["clusterTime"]
+            ):
+                self.cluster_time = cluster_time
+            if operation_time is not None and (
+                self.operation_time is None or operation_time > self.operation_time
+            ):
+                self.operation_time = operation_time
+        session.end_session()
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        session = self.start_session()
+        try:
+            return func(*args, session=session, **kwargs)
+        finally:
+            self.end_session(session)
@@ -3,7 +3,7 @@
 # plugin: python-betterproto
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, List
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Union
 
 import betterproto
 from betterproto.grpc.grpclib_server import ServiceBase
@@ -15,6 +15,21 @@ class RequestStatus(betterproto.Enum):
     ERROR = 1
 
 
+class QuerySort(betterproto.Enum):
+    # Ordered by the ranged field when there is one, else by id. Every order ends
+    # with id, so that pages are stable
+    SORT_AUTO = 0
+    SORT_BY_ID = 1
+    SORT_BY_CREATED_AT = 2
+    SORT_BY_PRICE = 3
+
+
+class HistogramBucket(betterproto.Enum):
+    BUCKET_DAY = 0
+    BUCKET_HOUR = 1
+    BUCKET_MINUTE = 2
+
+
 @dataclass(eq=False, repr=False)
 class Box(betterproto.Message):
     name: str = betterproto.string_field(1)
@@ -30,6 +45,9 @@ class Box(betterproto.Message):
 @dataclass(eq=False, repr=False)
 class GetBoxRequest(betterproto.Message):
     id: int = betterproto.int32_field(1)
+    field_mask: "betterproto_lib_google_protobuf.FieldMask" = betterproto.message_field(
+        2
+    )
 
 
 @dataclass(eq=False, repr=False)
@@ -40,13 +58,19 @@ class GetBoxResponse(betterproto.Message):
 
 @dataclass(eq=False, repr=False)
 class GetAllBoxesRequest(betterproto.Message):
-    pass
+    page_size: int = betterproto.int32_field(1)
+    page_token: str = betterproto.string_field(2)
+    field_mask: "betterproto_lib_google_protobuf.FieldMask" = betterproto.message_field(
+        3
+    )
 
 
 @dataclass(eq=False, repr=False)
 class GetBoxesResponse(betterproto.Message):
     box: List["Box"] = betterproto.message_field(1)
     status: "RequestStatus" = betterproto.enum_field(2)
+    next_page_token: str = betterproto.string_field(3)
+    prev_page_token: str = betterproto.string_field(4)
 
 
 @dataclass(eq=False, repr=False)
@@ -82,27 +106,269 @@ class DeleteBoxResponse(betterproto.Message):
 @dataclass(eq=False, repr=False)
 class GetBoxesInCategoryRequest(betterproto.Message):
     category: str = betterproto.string_field(1)
+    page_size: int = betterproto.int32_field(2)
+    page_token: str = betterproto.string_field(3)
+    field_mask: "betterproto_lib_google_protobuf.FieldMask" = betterproto.message_field(
+        4
+    )
 
 
 @dataclass(eq=False, repr=False)
 class GetBoxesInTimeRangeRequest(betterproto.Message):
     start_time: datetime = betterproto.message_field(1)
     end_time: datetime = betterproto.message_field(2)
+    page_size: int = betterproto.int32_field(3)
+    page_token: str = betterproto.string_field(4)
+    field_mask: "betterproto_lib_google_protobuf.FieldMask" = betterproto.message_field(
+        5
+    )
+
+
+@dataclass(eq=False, repr=False)
+class QueryBoxesRequest(betterproto.Message):
+    # Boxes in any of the categories, all boxes when empty
+    categories: List[str] = betterproto.string_field(1)
+    # Ranges are inclusive, a bound which is not set is open
+    start_time: Optional[datetime] = betterproto.message_field(
+        2, optional=True, group="_start_time"
+    )
+    end_time: Optional[datetime] = betterproto.message_field(
+        3, optional=True, group="_end_time"
+    )
+    min_price: Optional[int] = betterproto.int32_field(
+        4, optional=True, group="_min_price"
+    )
+    max_price: Optional[int] = betterproto.int32_field(
+        5, optional=True, group="_max_price"
+    )
+    sort: "QuerySort" = betterproto.enum_field(6)
+    # Results are always paged, 0 means the default page size
+    page_size: int = betterproto.int32_field(7)
+    page_token: str = betterproto.string_field(8)
+    field_mask: "betterproto_lib_google_protobuf.FieldMask" = betterproto.message_field(
+        9
+    )
+
+
+@dataclass(eq=False, repr=False)
+class BatchGetBoxesRequest(betterproto.Message):
+    ids: List[int] = betterproto.int32_field(1)
+    field_mask: "betterproto_lib_google_protobuf.FieldMask" = betterproto.message_field(
+        2
+    )
+
+
+@dataclass(eq=False, repr=False)
+class BatchGetBoxesResponse(betterproto.Message):
+    # One result per requested id in request order, ids which are not found have
+    # status ERROR
+    results: List["GetBoxResponse"] = betterproto.message_field(1)
+    status: "RequestStatus" = betterproto.enum_field(2)
+
+
+@dataclass(eq=False, repr=False)
+class BulkWriteFailure(betterproto.Message):
+    # Position of the box in the request stream
+    index: int = betterproto.int32_field(1)
+    id: int = betterproto.int32_field(2)
+    errmsg: str = betterproto.string_field(3)
+
+
+@dataclass(eq=False, repr=False)
+class BulkCreateBoxesResponse(betterproto.Message):
+    inserted_count: int = betterproto.int32_field(1)
+    failures: List["BulkWriteFailure"] = betterproto.message_field(2)
+    status: "RequestStatus" = betterproto.enum_field(3)
+
+
+@dataclass(eq=False, repr=False)
+class BulkUpdateBoxesRequest(betterproto.Message):
+    box: List["Box"] = betterproto.message_field(1)
+
+
+@dataclass(eq=False, repr=False)
+class UpdateBoxesInCategoryRequest(betterproto.Message):
+    category: str = betterproto.string_field(1)
+    # Only the fields listed in field_mask are set on the boxes
+    box: "Box" = betterproto.message_field(2)
+    field_mask: "betterproto_lib_google_protobuf.FieldMask" = betterproto.message_field(
+        3
+    )
+
+
+@dataclass(eq=False, repr=False)
+class BulkUpdateBoxesResponse(betterproto.Message):
+    matched_count: int = betterproto.int32_field(1)
+    modified_count: int = betterproto.int32_field(2)
+    status: "RequestStatus" = betterproto.enum_field(3)
+
+
+@dataclass(eq=False, repr=False)
+class BulkDeleteBoxesRequest(betterproto.Message):
+    ids: List[int] = betterproto.int32_field(1)
+
+
+@dataclass(eq=False, repr=False)
+class DeleteBoxesInCategoryRequest(betterproto.Message):
+    category: str = betterproto.string_field(1)
+
+
+@dataclass(eq=False, repr=False)
+class DeleteBoxesInTimeRangeRequest(betterproto.Message):
+    start_time: datetime = betterproto.message_field(1)
+    end_time: datetime = betterproto.message_field(2)
+
+
+@dataclass(eq=False, repr=False)
+class BulkDeleteBoxesResponse(betterproto.Message):
+    deleted_count: int = betterproto.int32_field(1)
+    status: "RequestStatus" = betterproto.enum_field(2)
+
+
+@dataclass(eq=False, repr=False)
+class GetCategoryStatsRequest(betterproto.Message):
+    # Stats for every category when empty
+    categories: List[str] = betterproto.string_field(1)
+
+
+@dataclass(eq=False, repr=False)
+class CategoryStats(betterproto.Message):
+    category: str = betterproto.string_field(1)
+    count: int = betterproto.int32_field(2)
+    total_quantity: int = betterproto.int64_field(3)
+    min_price: int = betterproto.int32_field(4)
+    max_price: int = betterproto.int32_field(5)
+    avg_price: float = betterproto.double_field(6)
+
+
+@dataclass(eq=False, repr=False)
+class GetCategoryStatsResponse(betterproto.Message):
+    # Ordered by category, requested categories without boxes have count 0
+    stats: List["CategoryStats"] = betterproto.message_field(1)
+    status: "RequestStatus" = betterproto.enum_field(2)
+
+
+@dataclass(eq=False, repr=False)
+class ListCategoriesRequest(betterproto.Message):
+    pass
+
+
+@dataclass(eq=False, repr=False)
+class CategoryCount(betterproto.Message):
+    category: str = betterproto.string_field(1)
+    count: int = betterproto.int32_field(2)
+
+
+@dataclass(eq=False, repr=False)
+class ListCategoriesResponse(betterproto.Message):
+    # Ordered by category
+    categories: List["CategoryCount"] = betterproto.message_field(1)
+    status: "RequestStatus" = betterproto.enum_field(2)
+
+
+@dataclass(eq=False, repr=False)
+class GetCategorySummaryRequest(betterproto.Message):
+    # Summaries of every category when empty
+    categories: List[str] = betterproto.string_field(1)
+
+
+@dataclass(eq=False, repr=False)
+class CategorySummary(betterproto.Message):
+    category: str = betterproto.string_field(1)
+    count: int = betterproto.int32_field(2)
+    total_quantity: int = betterproto.int64_field(3)
+    total_price: int = betterproto.int64_field(4)
+
+
+@dataclass(eq=False, repr=False)
+class GetCategorySummaryResponse(betterproto.Message):
+    # Ordered by category, requested categories without boxes have count 0
+    summaries: List["CategorySummary"] = betterproto.message_field(1)
+    status: "RequestStatus" = betterproto.enum_field(2)
+
+
+@dataclass(eq=False, repr=False)
+class GetCreationHistogramRequest(betterproto.Message):
+    start_time: datetime = betterproto.message_field(1)
+    end_time: datetime = betterproto.message_field(2)
+    bucket: "HistogramBucket" = betterproto.enum_field(3)
+    # Every category when empty
+    category: str = betterproto.string_field(4)
+
+
+@dataclass(eq=False, repr=False)
+class CreationBucket(betterproto.Message):
+    start_time: datetime = betterproto.message_field(1)
+    count: int = betterproto.int32_field(2)
+
+
+@dataclass(eq=False, repr=False)
+class GetCreationHistogramResponse(betterproto.Message):
+    # Buckets which start before end_time and end after start_time and have
+    # boxes, ordered by time. The first and the last may count boxes created just
+    # outside the range
+    buckets: List["CreationBucket"] = betterproto.message_field(1)
+    status: "RequestStatus" = betterproto.enum_field(2)
+
+
+@dataclass(eq=False, repr=False)
+class SearchBoxesRequest(betterproto.Message):
+    # Words to find in the name or description. Mongo $text syntax, so "quoted
+    # phrases" must all appear and -words must not
+    query: str = betterproto.string_field(1)
+    # Every category when empty
+    category: str = betterproto.string_field(2)
+    # 0 means the default limit, there is a maximum
+    limit: int = betterproto.int32_field(3)
+    field_mask: "betterproto_lib_google_protobuf.FieldMask" = betterproto.message_field(
+        4
+    )
+
+
+@dataclass(eq=False, repr=False)
+class SearchResult(betterproto.Message):
+    box: "Box" = betterproto.message_field(1)
+    # Matches in the name weigh more than in the description
+    score: float = betterproto.double_field(2)
+
+
+@dataclass(eq=False, repr=False)
+class SearchBoxesResponse(betterproto.Message):
+    # Most relevant first
+    results: List["SearchResult"] = betterproto.message_field(1)
+    status: "RequestStatus" = betterproto.enum_field(2)
 
 
 class DatabaseServiceStub(betterproto.ServiceStub):
-    async def get_box(self, *, id: int = 0) -> "GetBoxResponse":
+    async def get_box(
+        self,
+        *,
+        id: int = 0,
+        field_mask: "betterproto_lib_google_protobuf.FieldMask" = None
+    ) -> "GetBoxResponse":
 
         request = GetBoxRequest()
         request.id = id
+        if field_mask is not None:
+            request.field_mask = field_mask
 
         return await self._unary_unary(
             "/db.DatabaseService/GetBox", request, GetBoxResponse
         )
 
-    async def get_boxes(self) -> "GetBoxesResponse":
+    async def get_boxes(
+        self,
+        *,
+        page_size: int = 0,
+        page_token: str = "",
+        field_mask: "betterproto_lib_google_protobuf.FieldMask" = None
+    ) -> "GetBoxesResponse":
 
         request = GetAllBoxesRequest()
+        request.page_size = page_size
+        request.page_token = page_token
+        if field_mask is not None:
+            request.field_mask = field_mask
 
         return await self._unary_unary(
             "/db.DatabaseService/GetBoxes", request, GetBoxesResponse
@@ -137,17 +403,34 @@ class DatabaseServiceStub(betterproto.ServiceStub):
             "/db.DatabaseService/DeleteBox", request, DeleteBoxResponse
         )
 
-    async def get_boxes_in_category(self, *, category: str = "") -> "GetBoxesResponse":
+    async def get_boxes_in_category(
+        self,
+        *,
+        category: str = "",
+        page_size: int = 0,
+        page_token: str = "",
+        field_mask: "betterproto_lib_google_protobuf.FieldMask" = None
+    ) -> "GetBoxesResponse":
 
         request = GetBoxesInCategoryRequest()
         request.category = category
+        request.page_size = page_size
+        request.page_token = page_token
+        if field_mask is not None:
+            request.field_mask = field_mask
 
         return await self._unary_unary(
             "/db.DatabaseService/GetBoxesInCategory", request, GetBoxesResponse
         )
 
     async def get_boxes_in_time_range(
-        self, *, start_time: datetime = None, end_time: datetime = None
+        self,
+        *,
+        start_time: datetime = None,
+        end_time: datetime = None,
+        page_size: int = 0,
+        page_token: str = "",
+        field_mask: "betterproto_lib_google_protobuf.FieldMask" = None
     ) -> "GetBoxesResponse":
 
         request = GetBoxesInTimeRangeRequest()
@@ -155,17 +438,315 @@ class DatabaseServiceStub(betterproto.ServiceStub):
             request.start_time = start_time
         if end_time is not None:
             request.end_time = end_time
+        request.page_size = page_size
+        request.page_token = page_token
+        if field_mask is not None:
+            request.field_mask = field_mask
 
         return await self._unary_unary(
             "/db.DatabaseService/GetBoxesInTimeRange", request, GetBoxesResponse
         )
 
+    async def stream_boxes(
+        self,
+        *,
+        page_size: int = 0,
+        page_token: str = "",
+        field_mask: "betterproto_lib_google_protobuf.FieldMask" = None
+    ) -> AsyncIterator["GetBoxesResponse"]:
+
+        request = GetAllBoxesRequest()
+        request.page_size = page_size
+        request.page_token = page_token
+        if field_mask is not None:
+            request.field_mask = field_mask
+
+        async for response in self._unary_stream(
+            "/db.DatabaseService/StreamBoxes",
+            request,
+            GetBoxesResponse,
+        ):
+            yield response
+
+    async def stream_boxes_in_category(
+        self,
+        *,
+        category: str = "",
+        page_size: int = 0,
+        page_token: str = "",
+        field_mask: "betterproto_lib_google_protobuf.FieldMask" = None
+    ) -> AsyncIterator["GetBoxesResponse"]:
+
+        request = GetBoxesInCategoryRequest()
+        request.category = category
+        request.page_size = page_size
+        request.page_token = page_token
+        if field_mask is not None:
+            request.field_mask = field_mask
+
+        async for response in self._unary_stream(
+            "/db.DatabaseService/StreamBoxesInCategory",
+            request,
+            GetBoxesResponse,
+        ):
+            yield response
+
+    async def stream_boxes_in_time_range(
+        self,
+        *,
+        start_time: datetime = None,
+        end_time: datetime = None,
+        page_size: int = 0,
+        page_token: str = "",
+        field_mask: "betterproto_lib_google_protobuf.FieldMask" = None
+    ) -> AsyncIterator["GetBoxesResponse"]:
+
+        request = GetBoxesInTimeRangeRequest()
+        if start_time is not None:
+            request.start_time = start_time
+        if end_time is not None:
+            request.end_time = end_time
+        request.page_size = page_size
+        request.page_token = page_token
+        if field_mask is not None:
+            request.field_mask = field_mask
+
+        async for response in self._unary_stream(
+            "/db.DatabaseService/StreamBoxesInTimeRange",
+            request,
+            GetBoxesResponse,
+        ):
+            yield response
+
+    async def batch_get_boxes(
+        self,
+        *,
+        ids: Optional[List[int]] = None,
+        field_mask: "betterproto_lib_google_protobuf.FieldMask" = None
+    ) -> "BatchGetBoxesResponse":
+        ids = ids or []
+
+        request = BatchGetBoxesRequest()
+        request.ids = ids
+        if field_mask is not None:
+            request.field_mask = field_mask
+
+        return await self._unary_unary(
+            "/db.DatabaseService/BatchGetBoxes", request, BatchGetBoxesResponse
+        )
+
+    async def bulk_create_boxes(
+        self,
+        request_iterator: Union[
+            AsyncIterable["CreateBoxRequest"], Iterable["CreateBoxRequest"]
+        ],
+    ) -> "BulkCreateBoxesResponse":
+
+        return await self._stream_unary(
+            "/db.DatabaseService/BulkCreateBoxes",
+            request_iterator,
+            CreateBoxRequest,
+            BulkCreateBoxesResponse,
+        )
+
+    async def bulk_update_boxes(
+        self, *, box: Optional[List["Box"]] = None
+    ) -> "BulkUpdateBoxesResponse":
+        box = box or []
+
+        request = BulkUpdateBoxesRequest()
+        if box is not None:
+            request.box = box
+
+        return await self._unary_unary(
+            "/db.DatabaseService/BulkUpdateBoxes", request, BulkUpdateBoxesResponse
+        )
+
+    async def update_boxes_in_category(
+        self,
+        *,
+        category: str = "",
+        box: "Box" = None,
+        field_mask: "betterproto_lib_google_protobuf.FieldMask" = None
+    ) -> "BulkUpdateBoxesResponse":
+
+        request = UpdateBoxesInCategoryRequest()
+        request.category = category
+        if box is not None:
+            request.box = box
+        if field_mask is not None:
+            request.field_mask = field_mask
+
+        return await self._unary_unary(
+            "/db.DatabaseService/UpdateBoxesInCategory",
+            request,
+            BulkUpdateBoxesResponse,
+        )
+
+    async def bulk_delete_boxes(
+        self, *, ids: Optional[List[int]] = None
+    ) -> "BulkDeleteBoxesResponse":
+        ids = ids or []
+
+        request = BulkDeleteBoxesRequest()
+        request.ids = ids
+
+        return await self._unary_unary(
+            "/db.DatabaseService/BulkDeleteBoxes", request, BulkDeleteBoxesResponse
+        )
+
+    async def delete_boxes_in_category(
+        self, *, category: str = ""
+    ) -> "BulkDeleteBoxesResponse":
+
+        request = DeleteBoxesInCategoryRequest()
+        request.category = category
+
+        return await self._unary_unary(
+            "/db.DatabaseService/DeleteBoxesInCategory",
+            request,
+            BulkDeleteBoxesResponse,
+        )
+
+    async def delete_boxes_in_time_range(
+        self, *, start_time: datetime = None, end_time: datetime = None
+    ) -> "BulkDeleteBoxesResponse":
+
+        request = DeleteBoxesInTimeRangeRequest()
+        if start_time is not None:
+            request.start_time = start_time
+        if end_time is not None:
+            request.end_time = end_time
+
+        return await self._unary_unary(
+            "/db.DatabaseService/DeleteBoxesInTimeRange",
+            request,
+            BulkDeleteBoxesResponse,
+        )
+
+    async def query_boxes(
+        self,
+        *,
+        categories: Optional[List[str]] = None,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        min_price: Optional[int] = None,
+        max_price: Optional[int] = None,
+        sort: "QuerySort" = 0,
+        page_size: int = 0,
+        page_token: str = "",
+        field_mask: "betterproto_lib_google_protobuf.FieldMask" = None
+    ) -> "GetBoxesResponse":
+        categories = categories or []
+
+        request = QueryBoxesRequest()
+        request.categories = categories
+        if start_time is not None:
+            request.start_time = start_time
+        if end_time is not None:
+            request.end_time = end_time
+        request.min_price = min_price
+        request.max_price = max_price
+        request.sort = sort
+        request.page_size = page_size
+        request.page_token = page_token
+        if field_mask is not None:
+            request.field_mask = field_mask
+
+        return await self._unary_unary(
+            "/db.DatabaseService/QueryBoxes", request, GetBoxesResponse
+        )
+
+    async def get_category_stats(
+        self, *, categories: Optional[List[str]] = None
+    ) -> "GetCategoryStatsResponse":
+        categories = categories or []
+
+        request = GetCategoryStatsRequest()
+        request.categories = categories
+
+        return await self._unary_unary(
+            "/db.DatabaseService/GetCategoryStats", request, GetCategoryStatsResponse
+        )
+
+    async def list_categories(self) -> "ListCategoriesResponse":
+
+        request = ListCategoriesRequest()
+
+        return await self._unary_unary(
+            "/db.DatabaseService/ListCategories", request, ListCategoriesResponse
+        )
+
+    async def get_category_summary(
+        self, *, categories: Optional[List[str]] = None
+    ) -> "GetCategorySummaryResponse":
+        categories = categories or []
+
+        request = GetCategorySummaryRequest()
+        request.categories = categories
+
+        return await self._unary_unary(
+            "/db.DatabaseService/GetCategorySummary",
+            request,
+            GetCategorySummaryResponse,
+        )
+
+    async def get_creation_histogram(
+        self,
+        *,
+        start_time: datetime = None,
+        end_time: datetime = None,
+        bucket: "HistogramBucket" = 0,
+        category: str = ""
+    ) -> "GetCreationHistogramResponse":
+
+        request = GetCreationHistogramRequest()
+        if start_time is not None:
+            request.start_time = start_time
+        if end_time is not None:
+            request.end_time = end_time
+        request.bucket = bucket
+        request.category = category
+
+        return await self._unary_unary(
+            "/db.DatabaseService/GetCreationHistogram",
+            request,
+            GetCreationHistogramResponse,
+        )
+
+    async def search_boxes(
+        self,
+        *,
+        query: str = "",
+        category: str = "",
+        limit: int = 0,
+        field_mask: "betterproto_lib_google_protobuf.FieldMask" = None
+    ) -> "SearchBoxesResponse":
+
+        request = SearchBoxesRequest()
+        request.query = query
+        request.category = category
+        request.limit = limit
+        if field_mask is not None:
+            request.field_mask = field_mask
+
+        return await self._unary_unary(
+            "/db.DatabaseService/SearchBoxes", request, SearchBoxesResponse
+        )
+
 
 class DatabaseServiceBase(ServiceBase):
-    async def get_box(self, id: int) -> "GetBoxResponse":
+    async def get_box(
+        self, id: int, field_mask: "betterproto_lib_google_protobuf.FieldMask"
+    ) -> "GetBoxResponse":
         raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
 
-    async def get_boxes(self) -> "GetBoxesResponse":
+    async def get_boxes(
+        self,
+        page_size: int,
+        page_token: str,
+        field_mask: "betterproto_lib_google_protobuf.FieldMask",
+    ) -> "GetBoxesResponse":
         raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
 
     async def create_box(self, box: "Box") -> "CreateBoxResponse":
@@ -177,19 +758,143 @@ class DatabaseServiceBase(ServiceBase):
     async def delete_box(self, id: int) -> "DeleteBoxResponse":
         raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
 
-    async def get_boxes_in_category(self, category: str) -> "GetBoxesResponse":
+    async def get_boxes_in_category(
+        self,
+        category: str,
+        page_size: int,
+        page_token: str,
+        field_mask: "betterproto_lib_google_protobuf.FieldMask",
+    ) -> "GetBoxesResponse":
         raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
 
     async def get_boxes_in_time_range(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        page_size: int,
+        page_token: str,
+        field_mask: "betterproto_lib_google_protobuf.FieldMask",
+    ) -> "GetBoxesResponse":
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def stream_boxes(
+        self,
+        page_size: int,
+        page_token: str,
+        field_mask: "betterproto_lib_google_protobuf.FieldMask",
+    ) -> AsyncIterator["GetBoxesResponse"]:
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def stream_boxes_in_category(
+        self,
+        category: str,
+        page_size: int,
+        page_token: str,
+        field_mask: "betterproto_lib_google_protobuf.FieldMask",
+    ) -> AsyncIterator["GetBoxesResponse"]:
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def stream_boxes_in_time_range(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        page_size: int,
+        page_token: str,
+        field_mask: "betterproto_lib_google_protobuf.FieldMask",
+    ) -> AsyncIterator["GetBoxesResponse"]:
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def batch_get_boxes(
+        self,
+        ids: Optional[List[int]],
+        field_mask: "betterproto_lib_google_protobuf.FieldMask",
+    ) -> "BatchGetBoxesResponse":
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def bulk_create_boxes(
+        self, request_iterator: AsyncIterator["CreateBoxRequest"]
+    ) -> "BulkCreateBoxesResponse":
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def bulk_update_boxes(
+        self, box: Optional[List["Box"]]
+    ) -> "BulkUpdateBoxesResponse":
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def update_boxes_in_category(
+        self,
+        category: str,
+        box: "Box",
+        field_mask: "betterproto_lib_google_protobuf.FieldMask",
+    ) -> "BulkUpdateBoxesResponse":
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def bulk_delete_boxes(
+        self, ids: Optional[List[int]]
+    ) -> "BulkDeleteBoxesResponse":
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def delete_boxes_in_category(
+        self, category: str
+    ) -> "BulkDeleteBoxesResponse":
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def delete_boxes_in_time_range(
         self, start_time: datetime, end_time: datetime
+    ) -> "BulkDeleteBoxesResponse":
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def query_boxes(
+        self,
+        categories: Optional[List[str]],
+        start_time: Optional[datetime],
+        end_time: Optional[datetime],
+        min_price: Optional[int],
+        max_price: Optional[int],
+        sort: "QuerySort",
+        page_size: int,
+        page_token: str,
+        field_mask: "betterproto_lib_google_protobuf.FieldMask",
     ) -> "GetBoxesResponse":
         raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
 
+    async def get_category_stats(
+        self, categories: Optional[List[str]]
+    ) -> "GetCategoryStatsResponse":
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def list_categories(self) -> "ListCategoriesResponse":
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def get_category_summary(
+        self, categories: Optional[List[str]]
+    ) -> "GetCategorySummaryResponse":
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def get_creation_histogram(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        bucket: "HistogramBucket",
+        category: str,
+    ) -> "GetCreationHistogramResponse":
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
+    async def search_boxes(
+        self,
+        query: str,
+        category: str,
+        limit: int,
+        field_mask: "betterproto_lib_google_protobuf.FieldMask",
+    ) -> "SearchBoxesResponse":
+        raise grpclib.GRPCError(grpclib.const.Status.UNIMPLEMENTED)
+
     async def __rpc_get_box(self, stream: grpclib.server.Stream) -> None:
         request = await stream.recv_message()
 
         request_kwargs = {
             "id": request.id,
+            "field_mask": request.field_mask,
         }
 
         response = await self.get_box(**request_kwargs)
@@ -198,7 +903,11 @@ class DatabaseServiceBase(ServiceBase):
     async def __rpc_get_boxes(self, stream: grpclib.server.Stream) -> None:
         request = await stream.recv_message()
 
-        request_kwargs = {}
+        request_kwargs = {
+            "page_size": request.page_size,
+            "page_token": request.page_token,
+            "field_mask": request.field_mask,
+        }
 
         response = await self.get_boxes(**request_kwargs)
         await stream.send_message(response)
@@ -238,6 +947,9 @@ class DatabaseServiceBase(ServiceBase):
 
         request_kwargs = {
             "category": request.category,
+            "page_size": request.page_size,
+            "page_token": request.page_token,
+            "field_mask": request.field_mask,
         }
 
         response = await self.get_boxes_in_category(**request_kwargs)
@@ -251,11 +963,214 @@ class DatabaseServiceBase(ServiceBase):
         request_kwargs = {
             "start_time": request.start_time,
             "end_time": request.end_time,
+            "page_size": request.page_size,
+            "page_token": request.page_token,
+            "field_mask": request.field_mask,
         }
 
         response = await self.get_boxes_in_time_range(**request_kwargs)
         await stream.send_message(response)
 
+    async def __rpc_stream_boxes(self, stream: grpclib.server.Stream) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "page_size": request.page_size,
+            "page_token": request.page_token,
+            "field_mask": request.field_mask,
+        }
+
+        await self._call_rpc_handler_server_stream(
+            self.stream_boxes,
+            stream,
+            request_kwargs,
+        )
+
+    async def __rpc_stream_boxes_in_category(
+        self, stream: grpclib.server.Stream
+    ) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "category": request.category,
+            "page_size": request.page_size,
+            "page_token": request.page_token,
+            "field_mask": request.field_mask,
+        }
+
+        await self._call_rpc_handler_server_stream(
+            self.stream_boxes_in_category,
+            stream,
+            request_kwargs,
+        )
+
+    async def __rpc_stream_boxes_in_time_range(
+        self, stream: grpclib.server.Stream
+    ) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "start_time": request.start_time,
+            "end_time": request.end_time,
+            "page_size": request.page_size,
+            "page_token": request.page_token,
+            "field_mask": request.field_mask,
+        }
+
+        await self._call_rpc_handler_server_stream(
+            self.stream_boxes_in_time_range,
+            stream,
+            request_kwargs,
+        )
+
+    async def __rpc_batch_get_boxes(self, stream: grpclib.server.Stream) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "ids": request.ids,
+            "field_mask": request.field_mask,
+        }
+
+        response = await self.batch_get_boxes(**request_kwargs)
+        await stream.send_message(response)
+
+    async def __rpc_bulk_create_boxes(self, stream: grpclib.server.Stream) -> None:
+        request_kwargs = {"request_iterator": stream.__aiter__()}
+
+        response = await self.bulk_create_boxes(**request_kwargs)
+        await stream.send_message(response)
+
+    async def __rpc_bulk_update_boxes(self, stream: grpclib.server.Stream) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "box": request.box,
+        }
+
+        response = await self.bulk_update_boxes(**request_kwargs)
+        await stream.send_message(response)
+
+    async def __rpc_update_boxes_in_category(
+        self, stream: grpclib.server.Stream
+    ) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "category": request.category,
+            "box": request.box,
+            "field_mask": request.field_mask,
+        }
+
+        response = await self.update_boxes_in_category(**request_kwargs)
+        await stream.send_message(response)
+
+    async def __rpc_bulk_delete_boxes(self, stream: grpclib.server.Stream) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "ids": request.ids,
+        }
+
+        response = await self.bulk_delete_boxes(**request_kwargs)
+        await stream.send_message(response)
+
+    async def __rpc_delete_boxes_in_category(
+        self, stream: grpclib.server.Stream
+    ) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "category": request.category,
+        }
+
+        response = await self.delete_boxes_in_category(**request_kwargs)
+        await stream.send_message(response)
+
+    async def __rpc_delete_boxes_in_time_range(
+        self, stream: grpclib.server.Stream
+    ) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "start_time": request.start_time,
+            "end_time": request.end_time,
+        }
+
+        response = await self.delete_boxes_in_time_range(**request_kwargs)
+        await stream.send_message(response)
+
+    async def __rpc_query_boxes(self, stream: grpclib.server.Stream) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "categories": request.categories,
+            "start_time": request.start_time,
+            "end_time": request.end_time,
+            "min_price": request.min_price,
+            "max_price": request.max_price,
+            "sort": request.sort,
+            "page_size": request.page_size,
+            "page_token": request.page_token,
+            "field_mask": request.field_mask,
+        }
+
+        response = await self.query_boxes(**request_kwargs)
+        await stream.send_message(response)
+
+    async def __rpc_get_category_stats(self, stream: grpclib.server.Stream) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "categories": request.categories,
+        }
+
+        response = await self.get_category_stats(**request_kwargs)
+        await stream.send_message(response)
+
+    async def __rpc_list_categories(self, stream: grpclib.server.Stream) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {}
+
+        response = await self.list_categories(**request_kwargs)
+        await stream.send_message(response)
+
+    async def __rpc_get_category_summary(self, stream: grpclib.server.Stream) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "categories": request.categories,
+        }
+
+        response = await self.get_category_summary(**request_kwargs)
+        await stream.send_message(response)
+
+    async def __rpc_get_creation_histogram(self, stream: grpclib.server.Stream) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "start_time": request.start_time,
+            "end_time": request.end_time,
+            "bucket": request.bucket,
+            "category": request.category,
+        }
+
+        response = await self.get_creation_histogram(**request_kwargs)
+        await stream.send_message(response)
+
+    async def __rpc_search_boxes(self, stream: grpclib.server.Stream) -> None:
+        request = await stream.recv_message()
+
+        request_kwargs = {
+            "query": request.query,
+            "category": request.category,
+            "limit": request.limit,
+            "field_mask": request.field_mask,
+        }
+
+        response = await self.search_boxes(**request_kwargs)
+        await stream.send_message(response)
+
     def __mapping__(self) -> Dict[str, grpclib.const.Handler]:
         return {
             "/db.DatabaseService/GetBox": grpclib.const.Handler(
@@ -300,4 +1215,103 @@ class DatabaseServiceBase(ServiceBase):
                 GetBoxesInTimeRangeRequest,
                 GetBoxesResponse,
             ),
+            "/db.DatabaseService/StreamBoxes": grpclib.const.Handler(
+                self.__rpc_stream_boxes,
+                grpclib.const.Cardinality.UNARY_STREAM,
+                GetAllBoxesRequest,
+                GetBoxesResponse,
+            ),
+            "/db.DatabaseService/StreamBoxesInCategory": grpclib.const.Handler(
+                self.__rpc_stream_boxes_in_category,
+                grpclib.const.Cardinality.UNARY_STREAM,
+                GetBoxesInCategoryRequest,
+                GetBoxesResponse,
+            ),
+            "/db.DatabaseService/StreamBoxesInTimeRange": grpclib.const.Handler(
+                self.__rpc_stream_boxes_in_time_range,
+                grpclib.const.Cardinality.UNARY_STREAM,
+                GetBoxesInTimeRangeRequest,
+                GetBoxesResponse,
+            ),
+            "/db.DatabaseService/BatchGetBoxes": grpclib.const.Handler(
+                self.__rpc_batch_get_boxes,
+                grpclib.const.Cardinality.UNARY_UNARY,
+                BatchGetBoxesRequest,
+                BatchGetBoxesResponse,
+            ),
+            "/db.DatabaseService/BulkCreateBoxes": grpclib.const.Handler(
+                self.__rpc_bulk_create_boxes,
+                grpclib.const.Cardinality.STREAM_UNARY,
+                CreateBoxRequest,
+                BulkCreateBoxesResponse,
+            ),
+            "/db.DatabaseService/BulkUpdateBoxes": grpclib.const.Handler(
+                self.__rpc_bulk_update_boxes,
+                grpclib.const.Cardinality.UNARY_UNARY,
+                BulkUpdateBoxesRequest,
+                BulkUpdateBoxesResponse,
+            ),
+            "/db.DatabaseService/UpdateBoxesInCategory": grpclib.const.Handler(
+                self.__rpc_update_boxes_in_category,
+                grpclib.const.Cardinality.UNARY_UNARY,
+                UpdateBoxesInCategoryRequest,
+                BulkUpdateBoxesResponse,
+            ),
+            "/db.DatabaseService/BulkDeleteBoxes": grpclib.const.Handler(
+                self.__rpc_bulk_delete_boxes,
+                grpclib.const.Cardinality.UNARY_UNARY,
+                BulkDeleteBoxesRequest,
+                BulkDeleteBoxesResponse,
+            ),
+            "/db.DatabaseService/DeleteBoxesInCategory": grpclib.const.Handler(
+                self.__rpc_delete_boxes_in_category,
+                grpclib.const.Cardinality.UNARY_UNARY,
+                DeleteBoxesInCategoryRequest,
+                BulkDeleteBoxesResponse,
+            ),
+            "/db.DatabaseService/DeleteBoxesInTimeRange": grpclib.const.Handler(
+                self.__rpc_delete_boxes_in_time_range,
+                grpclib.const.Cardinality.UNARY_UNARY,
+                DeleteBoxesInTimeRangeRequest,
+                BulkDeleteBoxesResponse,
+            ),
+            "/db.DatabaseService/QueryBoxes": grpclib.const.Handler(
+                self.__rpc_query_boxes,
+                grpclib.const.Cardinality.UNARY_UNARY,
+                QueryBoxesRequest,
+                GetBoxesResponse,
+            ),
+            "/db.DatabaseService/GetCategoryStats": grpclib.const.Handler(
+                self.__rpc_get_category_stats,
+                grpclib.const.Cardinality.UNARY_UNARY,
+                GetCategoryStatsRequest,
+                GetCategoryStatsResponse,
+            ),
+            "/db.DatabaseService/ListCategories": grpclib.const.Handler(
+                self.__rpc_list_categories,
+                grpclib.const.Cardinality.UNARY_UNARY,
+                ListCategoriesRequest,
+                ListCategoriesResponse,
+            ),
+            "/db.DatabaseService/GetCategorySummary": grpclib.const.Handler(
+                self.__rpc_get_category_summary,
+                grpclib.const.Cardinality.UNARY_UNARY,
+                GetCategorySummaryRequest,
+                GetCategorySummaryResponse,
+            ),
+            "/db.DatabaseService/GetCreationHistogram": grpclib.const.Handler(
+                self.__rpc_get_creation_histogram,
+                grpclib.const.Cardinality.UNARY_UNARY,
+                GetCreationHistogramRequest,
+                GetCreationHistogramResponse,
+            ),
+            "/db.DatabaseService/SearchBoxes": grpclib.const.Handler(
+                self.__rpc_search_boxes,
+                grpclib.const.Cardinality.UNARY_UNARY,
+                SearchBoxesRequest,
+                SearchBoxesResponse,
+            ),
         }
+
+
+import betterproto.lib.google.protobuf as betterproto_lib_google_protobuf
@@ -1,33 +1,123 @@
 import os
+from typing import Optional
+from urllib.parse import quote_plus
+
 from pymongo import MongoClient
+from pymongo.read_preferences import (
+    Nearest,
+    Primary,
+    PrimaryPreferred,
+    Secondary,
+    SecondaryPreferred,
+    _ServerMode,
+)
+
+from pool_stats import PoolStats
 
 DB_USERNAME = os.environ.get("DB_USERNAME")
 DB_USER_PASSWORD = os.environ.get("DB_USER_PASSWORD")
 DB_HOST = os.environ.get("DB_HOST")
 DB_PORT = os.environ.get("DB_PORT")
+# A full connection string, e.g. for a replica set, instead of the above
+DB_URI = os.environ.get("DB_URI")
+
+
+def _int_env(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+# The client options below are only passed when set, otherwise the ones in
+# DB_URI or pymongo's defaults apply.
+# Connections per server, 100 by default. Queries run on the executor, so
+# more than DB_EXECUTOR_WORKERS of them are rarely in use at once
+DB_MAX_POOL_SIZE = _int_env("DB_MAX_POOL_SIZE")
+# Kept open even when idle, so a burst doesn't start with connecting
+DB_MIN_POOL_SIZE = _int_env("DB_MIN_POOL_SIZE")
+# Idle connections are closed after this long, 0 keeps them
+DB_MAX_IDLE_TIME_MS = _int_env("DB_MAX_IDLE_TIME_MS")
+# How long a query waits for a connection when the pool is exhausted
+# before it fails, 0 waits for as long as server selection may take
+DB_WAIT_QUEUE_TIMEOUT_MS = _int_env("DB_WAIT_QUEUE_TIMEOUT_MS")
+DB_CONNECT_TIMEOUT_MS = _int_env("DB_CONNECT_TIMEOUT_MS")
+# 0 waits for replies for as long as they take
+DB_SOCKET_TIMEOUT_MS = _int_env("DB_SOCKET_TIMEOUT_MS")
+DB_SERVER_SELECTION_TIMEOUT_MS = _int_env("DB_SERVER_SELECTION_TIMEOUT_MS")
+# Wire compression in order of preference, e.g. "zstd,snappy,zlib". The
+# server picks the first one it supports. zstd needs the zstandard package
+# and snappy python-snappy, pymongo skips them with a warning otherwise
+DB_COMPRESSORS = os.environ.get("DB_COMPRESSORS")
+# -1 is zlib's default, 1 the fastest and 9 the smallest
+DB_ZLIB_COMPRESSION_LEVEL = _int_env("DB_ZLIB_COMPRESSION_LEVEL")
+
+# Where the read RPCs go: primary, primaryPreferred, secondary,
+# secondaryPreferred or nearest. Writes always go to the primary
+READ_PREFERENCE = os.environ.get("READ_PREFERENCE", "primary")
+# Secondaries further behind the primary than this are not read from,
+# -1 for no bound. Mongo doesn't accept less than 90 seconds
+READ_MAX_STALENESS = int(os.environ.get("READ_MAX_STALENESS", -1))
+# 1 makes reads see the writes made before them, see consistency.py
+READ_YOUR_WRITES = bool(int(os.environ.get("READ_YOUR_WRITES", 0)))
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def get_read_preference(
+    mode: str = READ_PREFERENCE, max_staleness: int = READ_MAX_STALENESS
+) -> _ServerMode:
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference: {mode}")
+    if mode == "primary":
+        return Primary()
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+
+def client_options() -> dict:
+    options = {
+        "maxPoolSize": DB_MAX_POOL_SIZE,
+        "minPoolSize": DB_MIN_POOL_SIZE,
+        "connectTimeoutMS": DB_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": DB_SERVER_SELECTION_TIMEOUT_MS,
+        "compressors": DB_COMPRESSORS or None,
+        "zlibCompressionLevel": DB_ZLIB_COMPRESSION_LEVEL,
+    }
+    # pymongo doesn't take 0 for these, it means its default of no limit
+    if DB_MAX_IDLE_TIME_MS:
+        options["maxIdleTimeMS"] = DB_MAX_IDLE_TIME_MS
+    if DB_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = DB_WAIT_QUEUE_TIMEOUT_MS
+    if DB_SOCKET_TIMEOUT_MS:
+        options["socketTimeoutMS"] = DB_SOCKET_TIMEOUT_MS
+    return {key: value for key, value in options.items() if value is not None}
 
 
 def get_database():
 
-    if DB_USERNAME and DB_USER_PASSWORD and DB_HOST and DB_PORT:
+    if DB_URI:
+        CONNECTION_STRING = DB_URI
+    elif DB_USERNAME and DB_USER_PASSWORD and DB_HOST and DB_PORT:
         CONNECTION_STRING = (
-            f"mongodb://{DB_USERNAME}:{DB_USER_PASSWORD}@{DB_HOST}:{DB_PORT}"
+            f"mongodb://{quote_plus(DB_USERNAME)}:{quote_plus(DB_USER_PASSWORD)}"
+            f"@{DB_HOST}:{DB_PORT}"
         )
     else:
         # If no env variables are found then use local setup
         # with localhost:27017 which is default
         CONNECTION_STRING = None
 
-    # Create a connection using MongoClient
-    client = MongoClient(CONNECTION_STRING)
+    # Create a connection using MongoClient, the options from the
+    # environment win over the same ones in DB_URI
+    client = MongoClient(
+        CONNECTION_STRING, event_listeners=[PoolStats()], **client_options()
+    )
 
-    # Create the database and return it
+    # Create the database and return it, indexes are set up by
+    # indexes.sync_indexes()
     boxes_db = client.boxes
-    boxes_indexes_dict = boxes_db.boxes.index_information()
-    if "category_index" not in boxes_indexes_dict:
-        boxes_db.boxes.create_index("category", name="category_index")
-
-    if "created_at_index" not in boxes_indexes_dict:
-        boxes_db.boxes.create_index("created_at", name="created_at_index")
-
     return boxes_db
@@ -0,0 +1,199 @@
+import logging
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from pymongo import ASCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+log = logging.getLogger(__name__)
+
+
+class IndexSpec(NamedTuple):
+    name: str
+    keys: List[Tuple[str, Union[int, str]]]
+    unique: bool = False
+    # Partial index, only documents matching the filter are indexed
+    partial_filter: Optional[dict] = None
+    # TTL index, documents are removed this long after the date in `keys`
+    expire_after_seconds: Optional[int] = None
+    # Text index, the relevance weight of each TEXT key
+    weights: Optional[Dict[str, int]] = None
+
+    def model(self) -> IndexModel:
+        options = {"name": self.name, "background": True}
+        if self.unique:
+            options["unique"] = True
+        if self.partial_filter is not None:
+            options["partialFilterExpression"] = self.partial_filter
+        if self.expire_after_seconds is not None:
+            options["expireAfterSeconds"] = self.expire_after_seconds
+        if self.weights is not None:
+            options["weights"] = self.weights
+        return IndexModel(self.keys, **options)
+
+    def info_keys(self) -> List[Tuple[str, Union[int, str]]]:
+        # The keys the way Mongo lists them, the TEXT keys of a text index
+        # are replaced by _fts and _ftsx
+        keys = []
+        for key, direction in self.keys:
+            if direction != TEXT:
+                keys.append((key, direction))
+            elif ("_fts", TEXT) not in keys:
+                keys += [("_fts", TEXT), ("_ftsx", 1)]
+        return keys
+
+    def matches(self, info: dict) -> bool:
+        # `info` is an entry of Collection.index_information()
+        return (
+            [(key, direction) for key, direction in info["key"]] == self.info_keys()
+            and info.get("unique", False) == self.unique
+            and info.get("partialFilterExpression") == self.partial_filter
+            and info.get("expireAfterSeconds") == self.expire_after_seconds
+            and (self.weights is None or info.get("weights") == self.weights)
+        )
+
+
+# Every index the service relies on, by collection. The _id index is always
+# there and is not declared. Indexes which exist in the database but are
+# not listed here are only dropped when asked to, see manage_indexes.py
+INDEXES = {
+    "boxes": [
+        # Keyset pagination sort orders and the QueryBoxes plans, they
+        # follow the equality, sort, range rule, see planner.py. The
+        # category ones also serve plain category lookups
+        IndexSpec("category_id_index", [("category", ASCENDING), ("_id", ASCENDING)]),
+        IndexSpec(
+            "category_created_at_id_index",
+            [("category", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+        ),
+        IndexSpec(
+            "category_price_id_index",
+            [("category", ASCENDING), ("price", ASCENDING), ("_id", ASCENDING)],
+        ),
+        IndexSpec(
+            "created_at_id_index", [("created_at", ASCENDING), ("_id", ASCENDING)]
+        ),
+        IndexSpec("price_id_index", [("price", ASCENDING), ("_id", ASCENDING)]),
+        # SearchBoxes, a collection can only have one text index. A category
+        # prefix would make the category required in every search
+        IndexSpec(
+            "name_description_text_index",
+            [("name", TEXT), ("description", TEXT)],
+            weights={"name": 10, "description": 2},
+        ),
+    ],
+    # The histograms of one category and of all of them, see summary.py.
+    # Unique, so concurrent upserts of a new bucket can't both insert it
+    "creation_buckets": [
+        IndexSpec(
+            "unit_category_start_index",
+            [("unit", ASCENDING), ("category", ASCENDING), ("start", ASCENDING)],
+            unique=True,
+        ),
+        IndexSpec("unit_start_index", [("unit", ASCENDING), ("start", ASCENDING)]),
+    ],
+}
+
+CREATED = "created"
+EXISTS = "exists"
+CONFLICT = "conflict"
+UNDECLARED = "undeclared"
+DROPPED = "dropped"
+
+
+def sync_indexes(
+    db, indexes: Dict[str, List[IndexSpec]] = None, drop: bool = False
+) -> Dict[str, Dict[str, str]]:
+    # Creates the declared indexes which are missing. An index with a
+    # declared name but different keys or options is a conflict and left
+    # alone, as are undeclared ones, unless `drop` is set: then both are
+    # dropped and conflicting ones are built again as declared.
+    # Returns collection -> index name -> what happened to it
+    indexes = INDEXES if indexes is None else indexes
+    report = {}
+    for collection_name, specs in indexes.items():
+        collection = db[collection_name]
+        existing = collection.index_information()
+        declared = {spec.name: spec for spec in specs}
+        actions = report[collection_name] = {}
+
+        for name, info in existing.items():
+            if name == "_id_":
+                continue
+            if name not in declared:
+                actions[name] = UNDECLARED
+            elif not declared[name].matches(info):
+                actions[name] = CONFLICT
+            else:
+                actions[name] = EXISTS
+            if drop and actions[name] != EXISTS:
+                collection.drop_index(name)
+                log.info(f"Dropped index: collection={collection_name}, name={name}")
+                actions[name] = DROPPED
+
+        missing = [
+            spec
+            for spec in specs
+            if actions.get(spec.name) not in (EXISTS, CONFLICT, UNDECLARED)
+        ]
+        if missing:
+            # Builds don't block reads and writes of the collection
+            collection.create_indexes([spec.model() for spec in missing])
+            for spec in missing:
+                log.info(
+                    f"Created index: collection={collection_name}, name={spec.name}"
+                )
+                actions[spec.name] = CREATED
+
+        for name, action in actions.items():
+            if action in (CONFLICT, UNDECLARED):
+                log.warning(
+                    f"Index is {action}: collection={collection_name}, name={name}"
+                )
+    return report
+
+
+def sync_indexes_in_background(db) -> threading.Thread:
+    # Index builds can take a long time on a big collection, the server
+    # starts serving meanwhile and queries fall back to other plans
+    def build():
+        try:
+            sync_indexes(db)
+        except PyMongoError as exc:
+            log.error(f"Index build failed: exc={exc}")
+
+    thread = threading.Thread(target=build, name="index-build", daemon=True)
+    thread.start()
+    return thread
+
+
+def index_stats(
+    db, indexes: Dict[str, List[IndexSpec]] = None
+) -> Dict[str, List[dict]]:
+    # Per index usage since the counters were last reset, i.e. since the
+    # index was built or mongod restarted. Counters are per mongod, so on a
+    # replica set run it against every member
+    indexes = INDEXES if indexes is None else indexes
+    report = {}
+    for collection_name, specs in indexes.items():
+        declared = {spec.name for spec in specs} | {"_id_"}
+        try:
+            stats = list(db[collection_name].aggregate([{"$indexStats": {}}]))
+        except OperationFailure as exc:
+            log.error(f"$indexStats failed: collection={collection_name}, exc={exc}")
+            continue
+        report[collection_name] = sorted(
+            (
+                {
+                    "name": stat["name"],
+                    "key": dict(stat["key"]),
+                    "ops": stat["accesses"]["ops"],
+                    "since": stat["accesses"]["since"],
+                    "host": stat.get("host", ""),
+                    "declared": stat["name"] in declared,
+                }
+                for stat in stats
+            ),
+            key=lambda stat: stat["ops"],
+        )
+    return report
@@ -0,0 +1,52 @@
+# Index maintenance for the declared indexes in indexes.py
+#
+#   python manage_indexes.py sync [--drop]   build missing indexes, --drop also
+#                                            drops undeclared or changed ones
+#   python manage_indexes.py stats           per index usage from $indexStats
+import argparse
+import logging
+
+from dotenv import load_dotenv
+load_dotenv()
+from db_manager import get_database
+from indexes import index_stats, sync_indexes
+
+
+def print_sync(report: dict) -> None:
+    for collection_name, actions in report.items():
+        for name, action in sorted(actions.items()):
+            print(f"{collection_name:<12} {name:<32} {action}")
+
+
+def print_stats(report: dict) -> None:
+    print(f"{'collection':<12} {'index':<32} {'ops':>10}  {'since':<26} declared")
+    for collection_name, stats in report.items():
+        for stat in stats:
+            print(
+                f"{collection_name:<12} {stat['name']:<32} {stat['ops']:>10}  "
+                f"{stat['since'].isoformat():<26} {'yes' if stat['declared'] else 'NO'}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    sync = commands.add_parser("sync")
+    sync.add_argument(
+        "--drop",
+        action="store_true",
+        help="drop indexes which are not declared or differ from the declaration",
+    )
+    commands.add_parser("stats")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    boxes_db = get_database()
+    if args.command == "sync":
+        print_sync(sync_indexes(boxes_db, drop=args.drop))
+    else:
+        print_stats(index_stats(boxes_db))
+
+
+if __name__ == "__main__":
+    main()
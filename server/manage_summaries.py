@@ -0,0 +1,37 @@
+# Repairs the per-category summaries and creation buckets in summary.py,
+# e.g. after a failed summary update or when they were never built for an
+# existing collection
+#
+#   python manage_summaries.py rebuild                      every category
+#   python manage_summaries.py rebuild --category A --category B
+import argparse
+import logging
+
+from dotenv import load_dotenv
+load_dotenv()
+from db_manager import get_database
+from summary import rebuild_buckets, rebuild_summaries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild = commands.add_parser("rebuild")
+    rebuild.add_argument(
+        "--category",
+        action="append",
+        dest="categories",
+        help="only rebuild this category, may be repeated",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    boxes_db = get_database()
+    count = rebuild_summaries(boxes_db, args.categories)
+    print(f"Rebuilt {count} category summaries")
+    count = rebuild_buckets(boxes_db, args.categories)
+    print(f"Rebuilt {count} creation buckets")
+
+
+if __name__ == "__main__":
+    main()
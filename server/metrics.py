@@ -0,0 +1,304 @@
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from compression import CompressionCodec
+from db import RequestStatus
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+SIZE_BUCKETS = tuple(64 * 4**n for n in range(10))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # label values -> value
+        self.values: Dict[tuple, object] = {}
+        # Metrics are updated from the executor threads as well, e.g. by the
+        # pool listener, while the event loop renders them
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> List[Tuple[tuple, object]]:
+        with self._lock:
+            return sorted(self.values.items())
+
+    def samples(self) -> Iterator[Tuple[str, List[Tuple[str, str]], float]]:
+        # (name suffix, label pairs, value) in exposition order
+        for values, value in self.snapshot():
+            yield "", list(zip(self.labels, values)), value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self.values.get(labels, 0)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        # per bucket counts, the last one is +Inf, then the sum
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bucket] += 1
+            counts[-1] += value
+
+    def count(self, *labels: str) -> int:
+        counts = self.values.get(labels)
+        return sum(counts[:-1]) if counts else 0
+
+    def snapshot(self) -> List[Tuple[tuple, object]]:
+        with self._lock:
+            return sorted(
+                (values, list(counts)) for values, counts in self.values.items()
+            )
+
+    def samples(self) -> Iterator[Tuple[str, List[Tuple[str, str]], float]]:
+        for values, counts in self.snapshot():
+            pairs = list(zip(self.labels, values))
+            total = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                total += count
+                yield "_bucket", [*pairs, ("le", format_value(bound))], total
+            yield "_sum", pairs, counts[-1]
+            yield "_count", pairs, total
+
+
+def format_value(value) -> str:
+    if isinstance(value, str):
+        return value
+    if float(value).is_integer() and abs(value) < 2**53:
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        # Prometheus text exposition format 0.0.4
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, pairs, value in metric.samples():
+                labels = ",".join(f'{key}="{escape(str(v))}"' for key, v in pairs)
+                labels = f"{{{labels}}}" if labels else ""
+                lines.append(f"{metric.name}{suffix}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+RPC_REQUESTS = REGISTRY.register(
+    Counter("boxes_rpc_requests_total", "RPCs started", ["method"])
+)
+RPC_RESPONSES = REGISTRY.register(
+    Counter(
+        "boxes_rpc_responses_total",
+        "Response messages by RequestStatus, EXCEPTION for RPCs which raised",
+        ["method", "status"],
+    )
+)
+RPC_IN_FLIGHT = REGISTRY.register(
+    Gauge("boxes_rpc_in_flight", "RPCs being handled", ["method"])
+)
+RPC_LATENCY = REGISTRY.register(
+    Histogram("boxes_rpc_latency_seconds", "Time to handle an RPC", ["method"])
+)
+RPC_MONGO_TIME = REGISTRY.register(
+    Histogram(
+        "boxes_rpc_mongo_seconds",
+        "Time an RPC waited for Mongo, including the executor queue",
+        ["method"],
+    )
+)
+RPC_ENCODE_TIME = REGISTRY.register(
+    Histogram(
+        "boxes_rpc_encode_seconds",
+        "Time an RPC spent serializing its responses",
+        ["method"],
+    )
+)
+RPC_RESPONSE_SIZE = REGISTRY.register(
+    Histogram(
+        "boxes_rpc_response_bytes",
+        "Size of the serialized response messages",
+        ["method"],
+        buckets=SIZE_BUCKETS,
+    )
+)
+
+
+class RequestTimings:
+    __slots__ = ("method", "mongo_seconds", "encode_seconds")
+
+    def __init__(self, method: str) -> None:
+        self.method = method
+        self.mongo_seconds = 0.0
+        self.encode_seconds = 0.0
+
+
+# The RPC being handled by the current task. Tasks started while handling
+# it, e.g. a single-flight query, copy the context and report to it as well
+_current: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def add_mongo_time(seconds: float) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.mongo_seconds += seconds
+
+
+@contextmanager
+def encode_timer() -> Iterator[None]:
+    # For encoding done by the handler itself rather than by the codec
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current.get()
+        if timings is not None:
+            timings.encode_seconds += time.perf_counter() - started
+
+
+def instrument(
+    method: str, func: Callable[..., Awaitable[None]]
+) -> Callable[..., Awaitable[None]]:
+    # Wraps a grpclib handler, see DatabaseService.__mapping__
+    async def handler(stream) -> None:
+        timings = RequestTimings(method)
+        token = _current.set(timings)
+        RPC_REQUESTS.inc(method)
+        RPC_IN_FLIGHT.inc(method)
+        started = time.perf_counter()
+        try:
+            await func(stream)
+        except Exception:
+            RPC_RESPONSES.inc(method, "EXCEPTION")
+            raise
+        finally:
+            RPC_IN_FLIGHT.dec(method)
+            RPC_LATENCY.observe(time.perf_counter() - started, method)
+            RPC_MONGO_TIME.observe(timings.mongo_seconds, method)
+            RPC_ENCODE_TIME.observe(timings.encode_seconds, method)
+            _current.reset(token)
+
+    return handler
+
+
+class MetricsCodec(CompressionCodec):
+    # Responses are serialized by the codec while the handler sends them,
+    # so it still runs in the context of the RPC. The sizes are the
+    # compressed ones
+    def encode(self, message, message_type) -> bytes:
+        started = time.perf_counter()
+        data = super().encode(message, message_type)
+        timings = _current.get()
+        if timings is not None:
+            timings.encode_seconds += time.perf_counter() - started
+            RPC_RESPONSE_SIZE.observe(len(data), timings.method)
+            status = getattr(message, "status", None)
+            if status is not None:
+                RPC_RESPONSES.inc(timings.method, RequestStatus(status).name)
+        return data
+
+
+async def serve_metrics(
+    host: Optional[str], port: int, registry: Registry = REGISTRY
+) -> asyncio.AbstractServer:
+    # Just enough HTTP for a Prometheus scrape of GET /metrics
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            method, path = (request_line + ["", ""])[:2]
+            while (await reader.readline()).strip():
+                pass
+            if method == "GET" and path.split("?")[0] == "/metrics":
+                status, body = "200 OK", registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError as exc:
+            log.warning(f"Metrics request failed: exc={exc}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    log.info(f"Serving metrics: port={port}")
+    return server
@@ -0,0 +1,111 @@
+import os
+import base64
+import binascii
+from typing import List, Optional, Sequence, Tuple
+
+from bson import json_util
+from pymongo import ASCENDING, DESCENDING
+
+DEFAULT_PAGE_SIZE = int(os.environ.get("DEFAULT_PAGE_SIZE", 100))
+
+NEXT = "next"
+PREV = "prev"
+
+
+class InvalidPageToken(ValueError):
+    pass
+
+
+def encode_page_token(direction: str, values: Sequence) -> str:
+    payload = json_util.dumps({"d": direction, "k": list(values)})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_page_token(page_token: str) -> Tuple[str, list]:
+    try:
+        payload = json_util.loads(base64.urlsafe_b64decode(page_token.encode()))
+        direction, values = payload["d"], payload["k"]
+    except (binascii.Error, ValueError, TypeError, KeyError) as exc:
+        raise InvalidPageToken(page_token) from exc
+    if direction not in (NEXT, PREV) or not isinstance(values, list):
+        raise InvalidPageToken(page_token)
+    return direction, values
+
+
+def keyset_filter(keys: Sequence[str], values: Sequence, operator: str) -> dict:
+    # Rows strictly after (or before) `values` in the order of `keys`:
+    # (a > x) or (a == x and b > y) or ...
+    clauses = []
+    for position, key in enumerate(keys):
+        clause = dict(zip(keys[:position], values[:position]))
+        clause[key] = {operator: values[position]}
+        clauses.append(clause)
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$or": clauses}
+
+
+class KeysetPage:
+    # One page of a query ordered by `keys`, the last key must be unique.
+    # The position is kept in the page token as the sort key values of the
+    # first/last row, so every page is an index range scan whatever its depth
+    def __init__(self, keys: Sequence[str], page_size: int, page_token: str) -> None:
+        self.keys = list(keys)
+        self.page_size = page_size if page_size > 0 else DEFAULT_PAGE_SIZE
+        self.direction = NEXT
+        self.position: Optional[list] = None
+        if page_token:
+            self.direction, self.position = decode_page_token(page_token)
+            if len(self.position) != len(self.keys):
+                raise InvalidPageToken(page_token)
+
+    def sort(self, direction: str = NEXT) -> List[Tuple[str, int]]:
+        order = ASCENDING if direction == NEXT else DESCENDING
+        return [(key, order) for key in self.keys]
+
+    def filter(self, filter: dict, direction: Optional[str] = None) -> dict:
+        direction = direction or self.direction
+        if self.position is None:
+            return filter
+        operator = "$gt" if direction == NEXT else "$lt"
+        after = keyset_filter(self.keys, self.position, operator)
+        if not filter:
+            return after
+        return {"$and": [filter, after]}
+
+    def query(self, filter: dict) -> dict:
+        # One extra row tells whether there is anything past this page
+        return {
+            "filter": self.filter(filter),
+            "sort": self.sort(self.direction),
+            "limit": self.page_size + 1,
+        }
+
+    def token(self, direction: str, row: dict) -> str:
+        return encode_page_token(direction, [row[key] for key in self.keys])
+
+    def result(self, rows: List[dict]) -> Tuple[List[dict], str, str]:
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if self.direction == PREV:
+            rows.reverse()
+
+        next_page_token = prev_page_token = ""
+        if self.direction == NEXT:
+            if has_more:
+                next_page_token = self.token(NEXT, rows[-1])
+            if self.position is not None:
+                prev_page_token = (
+                    self.token(PREV, rows[0])
+                    if rows
+                    else encode_page_token(PREV, self.position)
+                )
+        else:
+            if has_more:
+                prev_page_token = self.token(PREV, rows[0])
+            next_page_token = (
+                self.token(NEXT, rows[-1])
+                if rows
+                else encode_page_token(NEXT, self.position)
+            )
+        return rows, next_page_token, prev_page_token
@@ -0,0 +1,84 @@
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Sequence
+
+from pymongo import ASCENDING
+
+from db import QuerySort
+
+# Plans follow the equality, sort, range rule: the category equality comes
+# first, then the sort keys, which also bound the range on the sorted field.
+# The compound indexes for every plan are declared in indexes.py
+SORT_KEYS = {
+    QuerySort.SORT_BY_ID: ["_id"],
+    QuerySort.SORT_BY_CREATED_AT: ["created_at", "_id"],
+    QuerySort.SORT_BY_PRICE: ["price", "_id"],
+}
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+class QueryPlan(NamedTuple):
+    filter: dict
+    # Sort keys, the page tokens hold their values
+    keys: List[str]
+    # Index the query is pinned to
+    hint: List[tuple]
+
+
+def range_filter(field: str, low, high) -> dict:
+    bounds = {}
+    if low is not None:
+        bounds["$gte"] = low
+    if high is not None:
+        bounds["$lte"] = high
+    return {field: bounds} if bounds else {}
+
+
+def plan_query(
+    categories: Sequence[str] = (),
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    sort: QuerySort = QuerySort.SORT_AUTO,
+) -> QueryPlan:
+    if start_time is not None and end_time is not None and start_time > end_time:
+        raise InvalidQuery(f"start_time={start_time} is after end_time={end_time}")
+    if min_price is not None and max_price is not None and min_price > max_price:
+        raise InvalidQuery(f"min_price={min_price} is above max_price={max_price}")
+
+    ranges = {
+        **range_filter("created_at", start_time, end_time),
+        **range_filter("price", min_price, max_price),
+    }
+    if sort == QuerySort.SORT_AUTO:
+        # Ordering by the ranged field turns the range into index bounds,
+        # otherwise every box of the categories would be scanned. With
+        # both ranges the time range wins, it is usually the narrower one
+        if "created_at" in ranges:
+            sort = QuerySort.SORT_BY_CREATED_AT
+        elif "price" in ranges:
+            sort = QuerySort.SORT_BY_PRICE
+        else:
+            sort = QuerySort.SORT_BY_ID
+    if sort not in SORT_KEYS:
+        raise InvalidQuery(f"sort={sort}")
+    keys = SORT_KEYS[sort]
+
+    filter = {}
+    hint = [(key, ASCENDING) for key in keys]
+    categories = sorted(set(categories))
+    if categories:
+        # A single category is an equality match, several of them are
+        # merged from one index range each, still in sort order
+        if len(categories) == 1:
+            filter["category"] = categories[0]
+        else:
+            filter["category"] = {"$in": categories}
+        hint.insert(0, ("category", ASCENDING))
+    # A range on a field which is not sorted on is checked on the fetched
+    # documents of the index range
+    filter.update(ranges)
+    return QueryPlan(filter, keys, hint)
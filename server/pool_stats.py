@@ -0,0 +1,124 @@
+import time
+import threading
+
+from pymongo import common
+from pymongo.monitoring import ConnectionPoolListener
+
+from metrics import REGISTRY, Counter, Gauge, Histogram
+
+# Utilization of a pool is boxes_mongo_pool_in_use / boxes_mongo_pool_max_size,
+# waiting queries mean it is exhausted
+POOL_MAX_SIZE = REGISTRY.register(
+    Gauge("boxes_mongo_pool_max_size", "Connection pool size limit", ["address"])
+)
+POOL_CONNECTIONS = REGISTRY.register(
+    Gauge("boxes_mongo_pool_connections", "Open connections", ["address"])
+)
+POOL_IN_USE = REGISTRY.register(
+    Gauge("boxes_mongo_pool_in_use", "Connections checked out", ["address"])
+)
+POOL_WAITING = REGISTRY.register(
+    Gauge(
+        "boxes_mongo_pool_waiting", "Operations waiting for a connection", ["address"]
+    )
+)
+POOL_WAIT_TIME = REGISTRY.register(
+    Histogram(
+        "boxes_mongo_pool_wait_seconds",
+        "Time to check out a connection, including connecting",
+        ["address"],
+    )
+)
+POOL_CHECKOUT_FAILURES = REGISTRY.register(
+    Counter(
+        "boxes_mongo_pool_checkout_failures_total",
+        "Connection check outs which failed",
+        ["address", "reason"],
+    )
+)
+POOL_CONNECTIONS_CLOSED = REGISTRY.register(
+    Counter(
+        "boxes_mongo_pool_connections_closed_total",
+        "Connections closed, e.g. idle, stale or after an error",
+        ["address", "reason"],
+    )
+)
+POOL_CLEARED = REGISTRY.register(
+    Counter(
+        "boxes_mongo_pool_cleared_total",
+        "Pools cleared after a network error or a failover",
+        ["address"],
+    )
+)
+
+
+def address_label(address) -> str:
+    host, port = address
+    return f"{host}:{port}"
+
+
+class PoolStats(ConnectionPoolListener):
+    # Keeps the pool metrics up to date from pymongo's connection pool
+    # events. They fire on the threads using the pool, i.e. the executor
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # Check outs start and end on the same thread
+        self._local = threading.local()
+
+    def pool_created(self, event) -> None:
+        with self._lock:
+            POOL_MAX_SIZE.set(
+                event.options.get("maxPoolSize", common.MAX_POOL_SIZE),
+                address_label(event.address),
+            )
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        with self._lock:
+            POOL_CLEARED.inc(address_label(event.address))
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_created(self, event) -> None:
+        with self._lock:
+            POOL_CONNECTIONS.inc(address_label(event.address))
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        address = address_label(event.address)
+        with self._lock:
+            POOL_CONNECTIONS.dec(address)
+            POOL_CONNECTIONS_CLOSED.inc(address, event.reason)
+
+    def connection_check_out_started(self, event) -> None:
+        self._local.started = time.perf_counter()
+        with self._lock:
+            POOL_WAITING.inc(address_label(event.address))
+
+    def _check_out_done(self, address: str) -> None:
+        waited = time.perf_counter() - getattr(
+            self._local, "started", time.perf_counter()
+        )
+        POOL_WAITING.dec(address)
+        POOL_WAIT_TIME.observe(waited, address)
+
+    def connection_check_out_failed(self, event) -> None:
+        address = address_label(event.address)
+        with self._lock:
+            self._check_out_done(address)
+            POOL_CHECKOUT_FAILURES.inc(address, event.reason)
+
+    def connection_checked_out(self, event) -> None:
+        address = address_label(event.address)
+        with self._lock:
+            self._check_out_done(address)
+            POOL_IN_USE.inc(address)
+
+    def connection_checked_in(self, event) -> None:
+        with self._lock:
+            POOL_IN_USE.dec(address_label(event.address))
@@ -0,0 +1,28 @@
+from typing import Iterable, List, Optional
+
+from codec import DOCUMENT_FIELDS
+
+
+class InvalidFieldMask(ValueError):
+    pass
+
+
+def mask_paths(field_mask) -> List[str]:
+    # An empty or missing mask means the whole box
+    paths = list(field_mask.paths) if field_mask else []
+    unknown = set(paths) - DOCUMENT_FIELDS.keys()
+    if unknown:
+        raise InvalidFieldMask(", ".join(sorted(unknown)))
+    return paths
+
+
+def mask_projection(paths: List[str], keys: Iterable[str] = ()) -> Optional[dict]:
+    # `keys` are document fields the server itself needs, e.g. the sort keys
+    # for page tokens. They are read but left out of the returned boxes
+    if not paths:
+        return None
+    projection = {DOCUMENT_FIELDS[path]: True for path in paths}
+    for key in keys:
+        projection[key] = True
+    projection.setdefault("_id", False)
+    return projection
@@ -0,0 +1,17 @@
+#!/usr/bin/env bash
+# Starts a local three node replica set for trying out the read routing,
+# then run the tests against it with
+#   TEST_REPLICA_SET_URI="mongodb://localhost:27021,localhost:27022,localhost:27023/?replicaSet=rs0" server/runtests.sh
+set -e
+DATA_DIR=${DATA_DIR:-/tmp/boxes-rs0}
+for port in 27021 27022 27023; do
+    mkdir -p "$DATA_DIR/$port"
+    mongod --replSet rs0 --port "$port" --bind_ip localhost \
+        --dbpath "$DATA_DIR/$port" --logpath "$DATA_DIR/$port.log" --fork
+done
+mongosh --port 27021 --quiet --eval '
+rs.initiate({_id: "rs0", members: [
+    {_id: 0, host: "localhost:27021", priority: 2},
+    {_id: 1, host: "localhost:27022"},
+    {_id: 2, host: "localhost:27023"},
+]})'
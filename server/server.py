@@ -1,7 +1,9 @@
 import os
+import signal
 import asyncio
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import cached_property
 
 from db import (
     DatabaseServiceBase,
@@ -12,110 +14,1114 @@ from db import (
     CreateBoxResponse,
     UpdateBoxResponse,
     DeleteBoxResponse,
+    BatchGetBoxesResponse,
+    BulkCreateBoxesResponse,
+    BulkWriteFailure,
+    CreateBoxRequest,
+    BulkUpdateBoxesResponse,
+    BulkDeleteBoxesResponse,
+    QuerySort,
+    CategoryStats,
+    GetCategoryStatsResponse,
+    CategoryCount,
+    ListCategoriesResponse,
+    CategorySummary,
+    GetCategorySummaryResponse,
+    HistogramBucket,
+    CreationBucket,
+    GetCreationHistogramResponse,
+    SearchResult,
+    SearchBoxesResponse,
 )
-from grpclib.server import Server
+from betterproto.lib.google.protobuf import FieldMask
+from grpclib.const import Handler
+from grpclib.server import Server, Stream
 from grpclib.utils import graceful_exit
-from typing import AsyncIterator
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-from dataclasses import asdict
-from pymongo.errors import DuplicateKeyError
+import bson
+from pymongo.read_preferences import Primary, _ServerMode
+from pymongo.errors import (
+    BulkWriteError,
+    DuplicateKeyError,
+    OperationFailure,
+    PyMongoError,
+)
 from dotenv import load_dotenv
 load_dotenv()
-from db_manager import get_database
+from db_manager import READ_YOUR_WRITES, get_database, get_read_preference
+from indexes import sync_indexes_in_background
+from async_db import AsyncCollection, get_executor
+from consistency import ReadYourWrites
+from cache import LRUCache
+from compression import server_compression
+from metrics import MetricsCodec, encode_timer, instrument, serve_metrics
+from slow_queries import SlowQueryRecorder
+from supervisor import Supervisor
+from singleflight import SingleFlight
+from pagination import DEFAULT_PAGE_SIZE, NEXT, InvalidPageToken, KeysetPage
+from planner import InvalidQuery, plan_query
+from stats import (
+    category_counts_pipeline,
+    category_stats_pipeline,
+    creation_histogram_pipeline,
+)
+from summary import (
+    BUCKET_COLLECTION,
+    SUMMARY_COLLECTION,
+    SUMMARY_PROJECTION,
+    SummaryDelta,
+    bucket_start,
+)
+from codec import DOCUMENT_FIELDS, box_to_document, document_to_box, documents_to_boxes
+from projection import InvalidFieldMask, mask_paths, mask_projection
+from wire import RAW_CODEC_OPTIONS, EncodedBoxesResponse, encode_boxes
 
 log = logging.getLogger(__name__)
 
 APP_HOST = os.environ.get("APP_HOST")
 APP_PORT = os.environ.get("APP_PORT")
+# Prometheus metrics are served on this port, 0 turns them off. Workers
+# serve them on a port each, counting up from it
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+# Processes sharing APP_PORT through SO_REUSEPORT, the kernel spreads the
+# connections across them. With 1 the server runs in this process
+APP_WORKERS = int(os.environ.get("APP_WORKERS", 1))
+# Every worker caches boxes of its own and only sees its own writes, so a
+# box written through one worker could be read stale from another for up
+# to BOX_CACHE_TTL. The cache is off with several workers unless this is 1
+BOX_CACHE_WITH_WORKERS = bool(int(os.environ.get("BOX_CACHE_WITH_WORKERS", 0)))
+# Seconds the workers get to finish their RPCs when stopped
+WORKER_SHUTDOWN_TIMEOUT = float(os.environ.get("WORKER_SHUTDOWN_TIMEOUT", 30))
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 100))
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", 1000))
+# Results of a SearchBoxes call without a limit, and the most it returns
+SEARCH_LIMIT = int(os.environ.get("SEARCH_LIMIT", 20))
+SEARCH_MAX_LIMIT = int(os.environ.get("SEARCH_MAX_LIMIT", 100))
+
+# Sort orders used for paging, both are backed by an index
+ID_ORDER = ["_id"]
+CREATED_AT_ORDER = ["created_at", "_id"]
+
 
-def box_to_dict(box_fields):
-    # Converts id field to _id
-    # This is sensetive to the position of the field
-    box_fields[1] = ("_id", box_fields[1][1])
+# Updates of a whole category only touch the summaries when they set one
+# of these
+SUMMARY_FIELDS = {"category", "quantity", "price", "created_at"}
+HISTOGRAM_UNITS = {
+    HistogramBucket.BUCKET_MINUTE: "minute",
+    HistogramBucket.BUCKET_HOUR: "hour",
+    HistogramBucket.BUCKET_DAY: "day",
+}
 
-    return dict(box_fields)
 
+def time_range_filter(start_time: datetime, end_time: datetime) -> dict:
+    return {"created_at": {"$gte": start_time, "$lte": end_time}}
 
-def dict_to_box(data):
-    if "_id" in data:
-        data["id"] = data.pop("_id")
-    return Box(**data)
+
+def is_modified(before: dict, values: dict) -> bool:
+    # Whether $set-ing `values` changed the stored document. The values are
+    # compared the way Mongo stores them, e.g. datetimes in milliseconds
+    stored = bson.decode(bson.encode(values))
+    return any(
+        key not in before or before[key] != value for key, value in stored.items()
+    )
 
 
 class DatabaseService(DatabaseServiceBase):
-    def __init__(self, boxes_db) -> None:
+    def __init__(
+        self,
+        boxes_db,
+        executor=None,
+        stream_chunk_size: int = STREAM_CHUNK_SIZE,
+        box_cache: LRUCache = None,
+        bulk_batch_size: int = BULK_BATCH_SIZE,
+        slow_queries: SlowQueryRecorder = None,
+        read_preference: _ServerMode = None,
+        read_your_writes: bool = READ_YOUR_WRITES,
+    ) -> None:
         self.boxes_db = boxes_db
+        self.executor = executor or get_executor()
+        self.stream_chunk_size = stream_chunk_size
+        self.bulk_batch_size = bulk_batch_size
+        self.slow_queries = (
+            SlowQueryRecorder() if slow_queries is None else slow_queries
+        )
+        self.consistency = ReadYourWrites(boxes_db.client) if read_your_writes else None
+        # Writes and the reads they depend on go to the primary
+        self.boxes = AsyncCollection(
+            boxes_db.boxes, self.executor, self.slow_queries, self.consistency
+        )
+        # The read RPCs go where the read preference says
+        if read_preference is None:
+            read_preference = get_read_preference()
+        if read_preference == Primary():
+            self.reads = self.boxes
+        else:
+            self.reads = self.boxes.with_options(read_preference=read_preference)
+        # Full box documents by id, every write below invalidates its id.
+        # Filled from a secondary which hasn't caught up with a write yet,
+        # it would serve the old box for the whole TTL. So with secondary
+        # reads it is off, unless the reads wait for this process's writes
+        if box_cache is None:
+            stale_reads = self.reads is not self.boxes and self.consistency is None
+            box_cache = LRUCache(maxsize=0) if stale_reads else LRUCache()
+        self.box_cache = box_cache
+        # Identical concurrent reads share one query and its decoded result
+        self.flights = SingleFlight()
         super().__init__()
 
-    async def get_box(self, id: int) -> "GetBoxResponse":
-        data = self.boxes_db.boxes.find_one({"_id": id})
+    @cached_property
+    def raw_boxes(self) -> AsyncCollection:
+        # Hands out undecoded documents for the wire encoded list responses
+        return self.reads.with_options(codec_options=RAW_CODEC_OPTIONS)
+
+    @cached_property
+    def summaries(self) -> AsyncCollection:
+        return AsyncCollection(
+            self.boxes_db[SUMMARY_COLLECTION],
+            self.executor,
+            self.slow_queries,
+            self.consistency,
+        )
+
+    @cached_property
+    def buckets(self) -> AsyncCollection:
+        return AsyncCollection(
+            self.boxes_db[BUCKET_COLLECTION],
+            self.executor,
+            self.slow_queries,
+            self.consistency,
+        )
+
+    def __mapping__(self) -> Dict[str, Handler]:
+        # The list RPCs write their boxes from raw BSON straight into the
+        # response instead of building Box objects first, see wire.py.
+        # Calling the methods directly still returns regular responses
+        mapping = super().__mapping__()
+        for name, func in (
+            ("GetBoxes", self._rpc_get_boxes),
+            ("GetBoxesInCategory", self._rpc_get_boxes_in_category),
+            ("GetBoxesInTimeRange", self._rpc_get_boxes_in_time_range),
+            ("StreamBoxes", self._rpc_stream_boxes),
+            ("StreamBoxesInCategory", self._rpc_stream_boxes_in_category),
+            ("StreamBoxesInTimeRange", self._rpc_stream_boxes_in_time_range),
+            ("QueryBoxes", self._rpc_query_boxes),
+        ):
+            path = f"/db.DatabaseService/{name}"
+            mapping[path] = mapping[path]._replace(func=func)
+        # Every RPC reports to metrics.py
+        return {
+            path: handler._replace(
+                func=instrument(path.rsplit("/", 1)[1], handler.func)
+            )
+            for path, handler in mapping.items()
+        }
+
+    def _invalidate(self, ids: List[int]) -> None:
+        for id in ids:
+            self.box_cache.invalidate(id)
+        self.flights.forget_all()
+
+    def _invalidate_all(self) -> None:
+        self.box_cache.clear()
+        self.flights.forget_all()
+
+    async def _update_summaries(self, delta: SummaryDelta) -> None:
+        await asyncio.gather(
+            self._write_summaries(self.summaries, delta.requests()),
+            self._write_summaries(self.buckets, delta.bucket_requests()),
+        )
+
+    @staticmethod
+    async def _write_summaries(collection: AsyncCollection, requests: list) -> None:
+        if not requests:
+            return
+        try:
+            await collection.bulk_write(requests, ordered=False)
+        except PyMongoError as exc:
+            # The boxes are written already, manage_summaries.py rebuilds them
+            log.error(
+                f"Summary update failed: collection={collection.collection.name}, "
+                f"exc={exc}"
+            )
+
+    async def _update_each(self, requests: List[Tuple[dict, dict]]) -> List[dict]:
+        # One find_one_and_update per (filter, update), a bulk write returns
+        # no pre-images and the summaries need the ones each write replaced.
+        # BULK_BATCH_SIZE run side by side. Returns the boxes as they were
+        # before, for the writes which matched
+        befores = []
+        for start in range(0, len(requests), BULK_BATCH_SIZE):
+            results = await asyncio.gather(
+                *(
+                    self.boxes.find_one_and_update(filter, update)
+                    for filter, update in requests[start : start + BULK_BATCH_SIZE]
+                )
+            )
+            befores += [before for before in results if before is not None]
+        return befores
+
+    async def _delete_each(self, filters: List[dict]) -> List[dict]:
+        # Like _update_each, the deleted boxes' summary fields
+        befores = []
+        for start in range(0, len(filters), BULK_BATCH_SIZE):
+            results = await asyncio.gather(
+                *(
+                    self.boxes.find_one_and_delete(
+                        filter, projection=SUMMARY_PROJECTION
+                    )
+                    for filter in filters[start : start + BULK_BATCH_SIZE]
+                )
+            )
+            befores += [before for before in results if before is not None]
+        return befores
+
+    async def _matching_ids(self, filter: dict) -> List[int]:
+        documents = await self.boxes.find(filter, {"_id": True})
+        return [document["_id"] for document in documents]
+
+    async def get_box(
+        self, id: int, field_mask: "FieldMask" = None
+    ) -> "GetBoxResponse":
+        try:
+            paths = mask_paths(field_mask)
+        except InvalidFieldMask as exc:
+            log.error(f"Invalid field mask: unknown fields={str(exc)}")
+            return GetBoxResponse(status=RequestStatus.ERROR)
+
+        data = self.box_cache.get(id)
+        if data is not None:
+            return GetBoxResponse(
+                box=document_to_box(data, paths), status=RequestStatus.OK
+            )
+
+        return await self.flights.do(
+            ("get_box", id, tuple(paths)), lambda: self._find_box(id, paths)
+        )
+
+    async def _find_box(self, id: int, paths: List[str]) -> "GetBoxResponse":
+        generation = self.box_cache.generation
+        if self.box_cache.maxsize:
+            # read the whole document so it can be cached for any mask
+            data = await self.reads.find_one({"_id": id})
+            if data is not None:
+                self.box_cache.put(id, dict(data), generation)
+        else:
+            data = await self.reads.find_one({"_id": id}, mask_projection(paths))
+
         status = RequestStatus.ERROR
-        if data:
-            data = dict_to_box(data)
+        # a projected document may legitimately be empty
+        if data is not None:
+            data = document_to_box(data, paths)
             status = RequestStatus.OK
         return GetBoxResponse(box=data, status=status)
 
-    async def get_boxes(self) -> "GetBoxesResponse":
-        boxes = self.boxes_db.boxes.find()
-        list_of_boxes = [dict_to_box(box) for box in boxes]
-        return GetBoxesResponse(box=list_of_boxes, status=RequestStatus.OK)
+    async def batch_get_boxes(
+        self, ids: List[int], field_mask: "FieldMask" = None
+    ) -> "BatchGetBoxesResponse":
+        try:
+            paths = mask_paths(field_mask)
+        except InvalidFieldMask as exc:
+            log.error(f"Invalid field mask: unknown fields={str(exc)}")
+            return BatchGetBoxesResponse(status=RequestStatus.ERROR)
+
+        documents = {}
+        missing = []
+        for id in dict.fromkeys(ids):
+            data = self.box_cache.get(id)
+            if data is None:
+                missing.append(id)
+            else:
+                documents[id] = data
+
+        if missing:
+            # One query for all the ids which are not cached
+            generation = self.box_cache.generation
+            projection = None
+            if not self.box_cache.maxsize:
+                projection = mask_projection(paths, ["_id"])
+            for data in await self.reads.find({"_id": {"$in": missing}}, projection):
+                if projection is None:
+                    self.box_cache.put(data["_id"], dict(data), generation)
+                documents[data["_id"]] = data
+
+        results = []
+        for id in ids:
+            data = documents.get(id)
+            if data is None:
+                results.append(GetBoxResponse(box=None, status=RequestStatus.ERROR))
+            else:
+                results.append(
+                    GetBoxResponse(
+                        box=document_to_box(data, paths), status=RequestStatus.OK
+                    )
+                )
+        return BatchGetBoxesResponse(results=results, status=RequestStatus.OK)
+
+    async def get_boxes(
+        self, page_size: int = 0, page_token: str = "", field_mask: "FieldMask" = None
+    ) -> "GetBoxesResponse":
+        return await self._get_boxes({}, ID_ORDER, page_size, page_token, field_mask)
 
     async def create_box(self, box: "Box") -> "CreateBoxResponse":
         if not box.created_at:
             box.created_at = datetime.utcnow()
-        data = asdict(box, dict_factory=box_to_dict)
+        data = box_to_document(box)
         status = RequestStatus.OK
         try:
-            _ = self.boxes_db.boxes.insert_one(data)
+            _ = await self.boxes.insert_one(data)
         except DuplicateKeyError as exc:
             log.error(
                 f"DuplicateKeyError exception: data={str(data)}, errmsg={str(exc.details)}"
             )
             status = RequestStatus.ERROR
+        else:
+            delta = SummaryDelta()
+            delta.add(data)
+            await self._update_summaries(delta)
+        self._invalidate([box.id])
         return CreateBoxResponse(status=status)
 
+    async def bulk_create_boxes(
+        self, request_iterator: AsyncIterator["CreateBoxRequest"]
+    ) -> "BulkCreateBoxesResponse":
+        response = BulkCreateBoxesResponse(status=RequestStatus.OK)
+        batch = []
+        received = 0
+        # While one batch is being written the next one is read off the stream
+        pending = None
+        try:
+            async for request in request_iterator:
+                box = request.box
+                if not box.created_at:
+                    box.created_at = datetime.utcnow()
+                batch.append(box_to_document(box))
+                received += 1
+                if len(batch) >= self.bulk_batch_size:
+                    if pending is not None:
+                        self._add_bulk_result(response, await pending)
+                    pending = asyncio.ensure_future(
+                        self._insert_batch(batch, received - len(batch))
+                    )
+                    batch = []
+            if pending is not None:
+                self._add_bulk_result(response, await pending)
+                pending = None
+            if batch:
+                self._add_bulk_result(
+                    response, await self._insert_batch(batch, received - len(batch))
+                )
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+        if response.failures:
+            log.error(
+                f"BulkCreateBoxes failures: received={received}, "
+                f"failed={len(response.failures)}"
+            )
+            response.status = RequestStatus.ERROR
+        return response
+
+    async def _insert_batch(self, documents: List[dict], offset: int):
+        # Unordered, so one bad box doesn't stop the rest of the batch
+        try:
+            result = await self.boxes.insert_many(documents, ordered=False)
+            inserted_count, failures = len(result.inserted_ids), []
+        except BulkWriteError as exc:
+            failures = [
+                BulkWriteFailure(
+                    index=offset + error["index"],
+                    id=error["op"].get("_id", 0),
+                    errmsg=error["errmsg"],
+                )
+                for error in exc.details["writeErrors"]
+            ]
+            inserted_count = exc.details["nInserted"]
+        finally:
+            self._invalidate([document["_id"] for document in documents])
+
+        failed = {failure.index - offset for failure in failures}
+        delta = SummaryDelta()
+        for index, document in enumerate(documents):
+            if index not in failed:
+                delta.add(document)
+        await self._update_summaries(delta)
+        return inserted_count, failures
+
+    @staticmethod
+    def _add_bulk_result(response: "BulkCreateBoxesResponse", result) -> None:
+        inserted_count, failures = result
+        response.inserted_count += inserted_count
+        response.failures.extend(failures)
+
     async def update_box(self, box: "Box") -> "UpdateBoxResponse":
-        new_box_dict = asdict(box, dict_factory=box_to_dict)
-        _update_result = self.boxes_db.boxes.update_one(
+        new_box_dict = box_to_document(box)
+        # The box as it was before, for the category summaries
+        before = await self.boxes.find_one_and_update(
             {"_id": box.id}, {"$set": new_box_dict}
         )
-        if _update_result.modified_count:
+        self._invalidate([box.id])
+        status = RequestStatus.ERROR
+        if before is not None:
+            delta = SummaryDelta()
+            delta.replace(before, new_box_dict)
+            await self._update_summaries(delta)
+            if is_modified(before, new_box_dict):
+                status = RequestStatus.OK
+        return UpdateBoxResponse(status=status)
+
+    async def delete_box(self, id: int) -> "DeleteBoxResponse":
+        before = await self.boxes.find_one_and_delete(
+            {"_id": id}, projection=SUMMARY_PROJECTION
+        )
+        self._invalidate([id])
+        status = RequestStatus.ERROR
+        if before is not None:
+            delta = SummaryDelta()
+            delta.remove(before)
+            await self._update_summaries(delta)
+            status = RequestStatus.OK
+        return DeleteBoxResponse(status=status)
+
+    async def bulk_update_boxes(self, box: List["Box"]) -> "BulkUpdateBoxesResponse":
+        if not box:
+            return BulkUpdateBoxesResponse(status=RequestStatus.ERROR)
+
+        # The last box of an id wins, each id is written once
+        documents = {item.id: box_to_document(item) for item in box}
+        befores = await self._update_each(
+            [({"_id": id}, {"$set": document}) for id, document in documents.items()]
+        )
+        self._invalidate(list(documents))
+
+        modified_count = 0
+        delta = SummaryDelta()
+        for before in befores:
+            document = documents[before["_id"]]
+            modified_count += is_modified(before, document)
+            delta.replace(before, document)
+        await self._update_summaries(delta)
+        return self._bulk_update_response(len(befores), modified_count)
+
+    async def update_boxes_in_category(
+        self, category: str, box: "Box", field_mask: "FieldMask"
+    ) -> "BulkUpdateBoxesResponse":
+        # Without a mask every field, including the id, would be overwritten
+        try:
+            paths = mask_paths(field_mask)
+        except InvalidFieldMask as exc:
+            log.error(f"Invalid field mask: unknown fields={str(exc)}")
+            return BulkUpdateBoxesResponse(status=RequestStatus.ERROR)
+        if not paths or "id" in paths:
+            log.error(f"Invalid field mask for a category update: paths={paths}")
+            return BulkUpdateBoxesResponse(status=RequestStatus.ERROR)
+
+        new_box_dict = box_to_document(box)
+        values = {
+            DOCUMENT_FIELDS[path]: new_box_dict[DOCUMENT_FIELDS[path]] for path in paths
+        }
+        filter = {"category": category}
+        if not SUMMARY_FIELDS.intersection(values):
+            # The summaries don't change, so one update will do
+            _update_result = await self.boxes.update_many(filter, {"$set": values})
+            # there is no telling which ids were touched
+            self._invalidate_all()
+            return self._bulk_update_response(
+                _update_result.matched_count, _update_result.modified_count
+            )
+
+        # Box by box like bulk_update_boxes, so the summaries get every
+        # pre-image. Boxes moved into the category after the ids are read
+        # are left alone and the ones moved out aren't written
+        ids = await self._matching_ids(filter)
+        befores = await self._update_each(
+            [({"_id": id, **filter}, {"$set": values}) for id in ids]
+        )
+        self._invalidate(ids)
+
+        modified_count = 0
+        delta = SummaryDelta()
+        for before in befores:
+            modified_count += is_modified(before, values)
+            delta.replace(before, values)
+        await self._update_summaries(delta)
+        return self._bulk_update_response(len(befores), modified_count)
+
+    @staticmethod
+    def _bulk_update_response(
+        matched_count: int, modified_count: int
+    ) -> "BulkUpdateBoxesResponse":
+        if matched_count:
             status = RequestStatus.OK
         else:
             status = RequestStatus.ERROR
-        return UpdateBoxResponse(status=status)
+        return BulkUpdateBoxesResponse(
+            matched_count=matched_count,
+            modified_count=modified_count,
+            status=status,
+        )
 
-    async def delete_box(self, id: int) -> "DeleteBoxResponse":
-        _delete_result = self.boxes_db.boxes.delete_one({"_id": id})
-        if _delete_result.deleted_count:
+    async def bulk_delete_boxes(self, ids: List[int]) -> "BulkDeleteBoxesResponse":
+        ids = list(set(ids))
+        befores = await self._delete_each([{"_id": id} for id in ids])
+        self._invalidate(ids)
+
+        delta = SummaryDelta()
+        for before in befores:
+            delta.remove(before)
+        await self._update_summaries(delta)
+        return self._bulk_delete_response(len(befores))
+
+    async def delete_boxes_in_category(
+        self, category: str
+    ) -> "BulkDeleteBoxesResponse":
+        filter = {"category": category}
+        return await self._delete_matching(filter)
+
+    async def delete_boxes_in_time_range(
+        self, start_time: datetime, end_time: datetime
+    ) -> "BulkDeleteBoxesResponse":
+        filter = time_range_filter(start_time, end_time)
+        return await self._delete_matching(filter)
+
+    async def _delete_matching(self, filter: dict) -> "BulkDeleteBoxesResponse":
+        # Box by box for the pre-images, like update_boxes_in_category
+        ids = await self._matching_ids(filter)
+        befores = await self._delete_each([{"_id": id, **filter} for id in ids])
+        self._invalidate(ids)
+
+        delta = SummaryDelta()
+        for before in befores:
+            delta.remove(before)
+        await self._update_summaries(delta)
+        return self._bulk_delete_response(len(befores))
+
+    @staticmethod
+    def _bulk_delete_response(deleted_count: int) -> "BulkDeleteBoxesResponse":
+        if deleted_count:
             status = RequestStatus.OK
         else:
             status = RequestStatus.ERROR
-        return DeleteBoxResponse(status=status)
+        return BulkDeleteBoxesResponse(deleted_count=deleted_count, status=status)
 
-    async def get_boxes_in_category(self, category: str) -> "GetBoxesResponse":
-        boxes = self.boxes_db.boxes.find({"category": category})
-        list_of_boxes = [dict_to_box(box) for box in boxes]
-        return GetBoxesResponse(box=list_of_boxes, status=RequestStatus.OK)
+    async def get_boxes_in_category(
+        self,
+        category: str,
+        page_size: int = 0,
+        page_token: str = "",
+        field_mask: "FieldMask" = None,
+    ) -> "GetBoxesResponse":
+        return await self._get_boxes(
+            {"category": category}, ID_ORDER, page_size, page_token, field_mask
+        )
 
     async def get_boxes_in_time_range(
-        self, start_time: datetime, end_time: datetime
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        page_size: int = 0,
+        page_token: str = "",
+        field_mask: "FieldMask" = None,
+    ) -> "GetBoxesResponse":
+        return await self._get_boxes(
+            time_range_filter(start_time, end_time),
+            CREATED_AT_ORDER,
+            page_size,
+            page_token,
+            field_mask,
+        )
+
+    async def _get_boxes(
+        self,
+        filter: dict,
+        keys: List[str],
+        page_size: int,
+        page_token: str,
+        field_mask: "FieldMask",
+        encoded: bool = False,
+        hint: List[tuple] = None,
+    ) -> "GetBoxesResponse":
+        # filters are always built the same way, so their repr tells queries
+        # apart. The hint follows from the filter and the keys
+        paths = tuple(field_mask.paths) if field_mask else ()
+        return await self.flights.do(
+            (repr(filter), tuple(keys), page_size, page_token, paths, encoded),
+            lambda: self._find_boxes(
+                filter, keys, page_size, page_token, field_mask, encoded, hint
+            ),
+        )
+
+    async def _find_boxes(
+        self,
+        filter: dict,
+        keys: List[str],
+        page_size: int,
+        page_token: str,
+        field_mask: "FieldMask",
+        encoded: bool = False,
+        hint: List[tuple] = None,
+    ) -> "GetBoxesResponse":
+        try:
+            paths = mask_paths(field_mask)
+        except InvalidFieldMask as exc:
+            log.error(f"Invalid field mask: unknown fields={str(exc)}")
+            return GetBoxesResponse(status=RequestStatus.ERROR)
+
+        collection = self.raw_boxes if encoded else self.reads
+        if not page_size and not page_token:
+            boxes = await self._find(
+                collection, filter, mask_projection(paths), hint=hint
+            )
+            return self._boxes_response(boxes, paths, encoded, status=RequestStatus.OK)
+
+        try:
+            page = KeysetPage(keys, page_size, page_token)
+        except InvalidPageToken:
+            log.error(f"Invalid page token: page_token={page_token}")
+            return GetBoxesResponse(status=RequestStatus.ERROR)
+
+        boxes = await self._find(
+            collection,
+            projection=mask_projection(paths, keys),
+            hint=hint,
+            **page.query(filter),
+        )
+        boxes, next_page_token, prev_page_token = page.result(boxes)
+        return self._boxes_response(
+            boxes,
+            paths,
+            encoded,
+            status=RequestStatus.OK,
+            next_page_token=next_page_token,
+            prev_page_token=prev_page_token,
+        )
+
+    async def query_boxes(
+        self,
+        categories: List[str] = None,
+        start_time: datetime = None,
+        end_time: datetime = None,
+        min_price: int = None,
+        max_price: int = None,
+        sort: "QuerySort" = QuerySort.SORT_AUTO,
+        page_size: int = 0,
+        page_token: str = "",
+        field_mask: "FieldMask" = None,
+    ) -> "GetBoxesResponse":
+        return await self._query_boxes(
+            categories,
+            start_time,
+            end_time,
+            min_price,
+            max_price,
+            sort,
+            page_size,
+            page_token,
+            field_mask,
+        )
+
+    async def _query_boxes(
+        self,
+        categories: List[str],
+        start_time: datetime,
+        end_time: datetime,
+        min_price: int,
+        max_price: int,
+        sort: "QuerySort",
+        page_size: int,
+        page_token: str,
+        field_mask: "FieldMask",
+        encoded: bool = False,
+    ) -> "GetBoxesResponse":
+        try:
+            plan = plan_query(
+                categories or [], start_time, end_time, min_price, max_price, sort
+            )
+        except InvalidQuery as exc:
+            log.error(f"Invalid query: {str(exc)}")
+            return GetBoxesResponse(status=RequestStatus.ERROR)
+
+        # Always paged, an unbounded query would sort the whole result
+        return await self._get_boxes(
+            plan.filter,
+            plan.keys,
+            page_size or DEFAULT_PAGE_SIZE,
+            page_token,
+            field_mask,
+            encoded=encoded,
+            hint=plan.hint,
+        )
+
+    async def get_category_stats(
+        self, categories: List[str] = None
+    ) -> "GetCategoryStatsResponse":
+        categories = sorted(set(categories or []))
+        return await self.flights.do(
+            ("get_category_stats", tuple(categories)),
+            lambda: self._category_stats(categories),
+        )
+
+    async def _category_stats(
+        self, categories: List[str]
+    ) -> "GetCategoryStatsResponse":
+        rows = await self.reads.aggregate(category_stats_pipeline(categories))
+        stats = {
+            row["_id"]: CategoryStats(
+                category=row["_id"],
+                count=row["count"],
+                total_quantity=row["total_quantity"],
+                min_price=row["min_price"] or 0,
+                max_price=row["max_price"] or 0,
+                avg_price=row["avg_price"] or 0.0,
+            )
+            for row in rows
+        }
+        for category in categories:
+            stats.setdefault(category, CategoryStats(category=category))
+        return GetCategoryStatsResponse(
+            stats=[stats[category] for category in sorted(stats)],
+            status=RequestStatus.OK,
+        )
+
+    async def list_categories(self) -> "ListCategoriesResponse":
+        return await self.flights.do(("list_categories",), self._list_categories)
+
+    async def _list_categories(self) -> "ListCategoriesResponse":
+        rows = await self.reads.aggregate(category_counts_pipeline())
+        return ListCategoriesResponse(
+            categories=[
+                CategoryCount(category=row["_id"], count=row["count"]) for row in rows
+            ],
+            status=RequestStatus.OK,
+        )
+
+    async def get_category_summary(
+        self, categories: List[str] = None
+    ) -> "GetCategorySummaryResponse":
+        # Reads the summaries kept up to date by the writes, one document
+        # per category instead of a scan of its boxes
+        categories = sorted(set(categories or []))
+        filter = {"_id": {"$in": categories}} if categories else {}
+        rows = await self.summaries.find(filter)
+        summaries = {
+            row["_id"]: CategorySummary(
+                category=row["_id"],
+                count=row["count"],
+                total_quantity=row["total_quantity"],
+                total_price=row["total_price"],
+            )
+            for row in rows
+            if row["count"]
+        }
+        for category in categories:
+            summaries.setdefault(category, CategorySummary(category=category))
+        return GetCategorySummaryResponse(
+            summaries=[summaries[category] for category in sorted(summaries)],
+            status=RequestStatus.OK,
+        )
+
+    async def get_creation_histogram(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        bucket: "HistogramBucket",
+        category: str,
+    ) -> "GetCreationHistogramResponse":
+        # Reads the creation buckets kept up to date by the writes instead
+        # of the boxes, see summary.py
+        unit = HISTOGRAM_UNITS.get(bucket)
+        if unit is None or start_time > end_time:
+            log.error(
+                f"Invalid histogram: bucket={bucket}, start_time={start_time}, "
+                f"end_time={end_time}"
+            )
+            return GetCreationHistogramResponse(status=RequestStatus.ERROR)
+
+        filter = {
+            "unit": unit,
+            "start": {"$gte": bucket_start(start_time, unit), "$lte": end_time},
+            "count": {"$gt": 0},
+        }
+        if category:
+            filter["category"] = category
+            rows = await self.buckets.find(
+                filter,
+                {"_id": False, "start": True, "count": True},
+                sort=[("start", 1)],
+            )
+        else:
+            rows = [
+                {"start": row["_id"], "count": row["count"]}
+                for row in await self.buckets.aggregate(
+                    creation_histogram_pipeline(filter)
+                )
+                if row["count"]
+            ]
+        return GetCreationHistogramResponse(
+            buckets=[
+                CreationBucket(
+                    # Mongo hands back naive UTC dates
+                    start_time=row["start"].replace(tzinfo=timezone.utc),
+                    count=row["count"],
+                )
+                for row in rows
+            ],
+            status=RequestStatus.OK,
+        )
+
+    async def search_boxes(
+        self, query: str, category: str, limit: int, field_mask: "FieldMask" = None
+    ) -> "SearchBoxesResponse":
+        try:
+            paths = mask_paths(field_mask)
+        except InvalidFieldMask as exc:
+            log.error(f"Invalid field mask: unknown fields={str(exc)}")
+            return SearchBoxesResponse(status=RequestStatus.ERROR)
+        if not query.strip():
+            log.error("Empty search query")
+            return SearchBoxesResponse(status=RequestStatus.ERROR)
+
+        # Served by the text index, category narrows the matches down
+        filter = {"$text": {"$search": query}}
+        if category:
+            filter["category"] = category
+        score = {"$meta": "textScore"}
+        try:
+            rows = await self.reads.find(
+                filter,
+                {**(mask_projection(paths) or {}), "score": score},
+                sort=[("score", score), ("_id", 1)],
+                limit=min(limit if limit > 0 else SEARCH_LIMIT, SEARCH_MAX_LIMIT),
+            )
+        except OperationFailure as exc:
+            # e.g. the text index is still being built
+            log.error(f"Search failed: query={query!r}, exc={exc}")
+            return SearchBoxesResponse(status=RequestStatus.ERROR)
+        return SearchBoxesResponse(
+            results=[
+                SearchResult(box=document_to_box(row, paths), score=row["score"])
+                for row in rows
+            ],
+            status=RequestStatus.OK,
+        )
+
+    @staticmethod
+    async def _find(
+        collection: AsyncCollection, *args, hint: List[tuple] = None, **kwargs
+    ) -> List[dict]:
+        if hint is None:
+            return await collection.find(*args, **kwargs)
+        try:
+            return await collection.find(*args, hint=hint, **kwargs)
+        except OperationFailure as exc:
+            # The index may still be building, let Mongo plan the query then
+            log.warning(f"Query hint not usable: hint={hint}, exc={exc}")
+            return await collection.find(*args, **kwargs)
+
+    async def _stream_boxes(
+        self,
+        filter: dict,
+        keys: List[str],
+        page_size: int,
+        page_token: str,
+        field_mask: "FieldMask",
+        encoded: bool = False,
+    ) -> AsyncIterator["GetBoxesResponse"]:
+        # Streams go in page order, so a page_token resumes a stream after
+        # the given box and page_size overrides the chunk size
+        try:
+            paths = mask_paths(field_mask)
+            page = KeysetPage(keys, page_size or self.stream_chunk_size, page_token)
+        except (InvalidFieldMask, InvalidPageToken) as exc:
+            log.error(f"Invalid stream request: {exc.__class__.__name__}={str(exc)}")
+            yield GetBoxesResponse(status=RequestStatus.ERROR)
+            return
+
+        # Every chunk is sent before the next one is read from the cursor,
+        # so a slow client holds back the query instead of piling up memory
+        collection = self.raw_boxes if encoded else self.reads
+        async for boxes in collection.find_batches(
+            page.filter(filter, NEXT),
+            mask_projection(paths),
+            sort=page.sort(NEXT),
+            batch_size=page.page_size,
+        ):
+            yield self._boxes_response(boxes, paths, encoded, status=RequestStatus.OK)
+
+    @staticmethod
+    def _boxes_response(
+        boxes: List[dict], paths: List[str], encoded: bool, **kwargs
     ) -> "GetBoxesResponse":
-        boxes = self.boxes_db.boxes.find(
-            {"created_at": {"$gte": start_time, "$lte": end_time}}
+        if encoded:
+            # The wire encoding happens here instead of in the codec
+            with encode_timer():
+                encoded_boxes = encode_boxes(boxes, paths)
+            return EncodedBoxesResponse(encoded_boxes, **kwargs)
+        return GetBoxesResponse(box=documents_to_boxes(boxes, paths), **kwargs)
+
+    async def stream_boxes(
+        self, page_size: int = 0, page_token: str = "", field_mask: "FieldMask" = None
+    ) -> AsyncIterator["GetBoxesResponse"]:
+        async for response in self._stream_boxes(
+            {}, ID_ORDER, page_size, page_token, field_mask
+        ):
+            yield response
+
+    async def stream_boxes_in_category(
+        self,
+        category: str,
+        page_size: int = 0,
+        page_token: str = "",
+        field_mask: "FieldMask" = None,
+    ) -> AsyncIterator["GetBoxesResponse"]:
+        async for response in self._stream_boxes(
+            {"category": category}, ID_ORDER, page_size, page_token, field_mask
+        ):
+            yield response
+
+    async def stream_boxes_in_time_range(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        page_size: int = 0,
+        page_token: str = "",
+        field_mask: "FieldMask" = None,
+    ) -> AsyncIterator["GetBoxesResponse"]:
+        async for response in self._stream_boxes(
+            time_range_filter(start_time, end_time),
+            CREATED_AT_ORDER,
+            page_size,
+            page_token,
+            field_mask,
+        ):
+            yield response
+
+    async def _rpc_get_boxes(self, stream: Stream) -> None:
+        request = await stream.recv_message()
+        response = await self._get_boxes(
+            {},
+            ID_ORDER,
+            request.page_size,
+            request.page_token,
+            request.field_mask,
+            encoded=True,
         )
-        list_of_boxes = [dict_to_box(box) for box in boxes]
-        return GetBoxesResponse(box=list_of_boxes, status=RequestStatus.OK)
+        await stream.send_message(response)
 
+    async def _rpc_get_boxes_in_category(self, stream: Stream) -> None:
+        request = await stream.recv_message()
+        response = await self._get_boxes(
+            {"category": request.category},
+            ID_ORDER,
+            request.page_size,
+            request.page_token,
+            request.field_mask,
+            encoded=True,
+        )
+        await stream.send_message(response)
 
-async def main():
+    async def _rpc_get_boxes_in_time_range(self, stream: Stream) -> None:
+        request = await stream.recv_message()
+        response = await self._get_boxes(
+            time_range_filter(request.start_time, request.end_time),
+            CREATED_AT_ORDER,
+            request.page_size,
+            request.page_token,
+            request.field_mask,
+            encoded=True,
+        )
+        await stream.send_message(response)
+
+    async def _rpc_stream_boxes(self, stream: Stream) -> None:
+        request = await stream.recv_message()
+        async for response in self._stream_boxes(
+            {},
+            ID_ORDER,
+            request.page_size,
+            request.page_token,
+            request.field_mask,
+            encoded=True,
+        ):
+            await stream.send_message(response)
+
+    async def _rpc_stream_boxes_in_category(self, stream: Stream) -> None:
+        request = await stream.recv_message()
+        async for response in self._stream_boxes(
+            {"category": request.category},
+            ID_ORDER,
+            request.page_size,
+            request.page_token,
+            request.field_mask,
+            encoded=True,
+        ):
+            await stream.send_message(response)
+
+    async def _rpc_stream_boxes_in_time_range(self, stream: Stream) -> None:
+        request = await stream.recv_message()
+        async for response in self._stream_boxes(
+            time_range_filter(request.start_time, request.end_time),
+            CREATED_AT_ORDER,
+            request.page_size,
+            request.page_token,
+            request.field_mask,
+            encoded=True,
+        ):
+            await stream.send_message(response)
+
+    async def _rpc_query_boxes(self, stream: Stream) -> None:
+        request = await stream.recv_message()
+        response = await self._query_boxes(
+            request.categories,
+            request.start_time,
+            request.end_time,
+            request.min_price,
+            request.max_price,
+            request.sort,
+            request.page_size,
+            request.page_token,
+            request.field_mask,
+            encoded=True,
+        )
+        await stream.send_message(response)
+
+
+async def main(worker: int = 0, reuse_port: bool = False):
     boxes_db = get_database()
-    server = Server([DatabaseService(boxes_db=boxes_db)])
-    with graceful_exit([server]):
-        await server.start(APP_HOST, APP_PORT)
+    executor = get_executor()
+    box_cache = None
+    if APP_WORKERS > 1 and not BOX_CACHE_WITH_WORKERS:
+        box_cache = LRUCache(maxsize=0)
+    codec = MetricsCodec()
+    server = Server(
+        [DatabaseService(boxes_db=boxes_db, executor=executor, box_cache=box_cache)],
+        codec=codec,
+    )
+    server_compression(server, codec)
+    if worker == 0:
+        sync_indexes_in_background(boxes_db)
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = await serve_metrics(APP_HOST, METRICS_PORT + worker)
+    # Workers are stopped by the supervisor with SIGTERM, a Ctrl-C reaches
+    # the whole process group and is left to the supervisor
+    signals = (signal.SIGTERM,) if reuse_port else (signal.SIGINT, signal.SIGTERM)
+    with graceful_exit([server], signals=signals):
+        await server.start(APP_HOST, APP_PORT, reuse_port=reuse_port)
         await server.wait_closed()
+    if metrics_server is not None:
+        metrics_server.close()
+    executor.shutdown()
+
+
+def run_worker(worker: int) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(main(worker, reuse_port=True))
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    if APP_WORKERS > 1:
+        Supervisor(run_worker, APP_WORKERS, WORKER_SHUTDOWN_TIMEOUT).run()
+    else:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(main())
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from metrics import REGISTRY, Counter
+
+SINGLEFLIGHT_CALLS = REGISTRY.register(
+    Counter("boxes_singleflight_calls_total", "Reads made through single-flight")
+)
+SINGLEFLIGHT_COALESCED = REGISTRY.register(
+    Counter(
+        "boxes_singleflight_coalesced_total",
+        "Reads which joined a read already in flight instead of querying",
+    )
+)
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one in-flight call and its
+    # result. Only ever touched from the event loop thread
+    def __init__(self) -> None:
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable]) -> Any:
+        self.calls += 1
+        SINGLEFLIGHT_CALLS.inc()
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(func())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda done: self._land(key, done))
+        else:
+            self.coalesced += 1
+            SINGLEFLIGHT_COALESCED.inc()
+        # A cancelled caller must not cancel the query for everybody else
+        return await asyncio.shield(flight)
+
+    def _land(self, key: Hashable, flight: asyncio.Future) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.cancelled():
+            # Mark the exception as retrieved in case every caller is gone
+            flight.exception()
+
+    def forget_all(self) -> None:
+        # Calls made from now on start a new flight. Used after writes, so
+        # nobody joins a read which may have started before the write
+        self._flights.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._flights),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
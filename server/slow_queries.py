@@ -0,0 +1,169 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from metrics import REGISTRY, Counter
+
+log = logging.getLogger(__name__)
+
+# Queries taking longer than this are logged, 0 turns the log off
+SLOW_QUERY_MS = int(os.environ.get("SLOW_QUERY_MS", 100))
+# Share of the slow queries which are explained, at most one per query
+# shape per interval, so a burst of slow queries costs a single explain
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get("SLOW_QUERY_EXPLAIN_RATE", 0.1))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get("SLOW_QUERY_EXPLAIN_INTERVAL", 60))
+# Longer filters are cut off in the log, e.g. a $in of many ids
+MAX_FILTER_LENGTH = 500
+
+SLOW_QUERIES = REGISTRY.register(
+    Counter(
+        "boxes_slow_queries_total",
+        "Mongo queries over SLOW_QUERY_MS",
+        ["collection", "operation"],
+    )
+)
+COLLECTION_SCANS = REGISTRY.register(
+    Counter(
+        "boxes_slow_query_collection_scans_total",
+        "Explained slow queries whose plan scans the whole collection",
+        ["collection"],
+    )
+)
+
+
+def query_shape(value):
+    # The filter with its values left out, queries of the same shape use
+    # the same plan
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)) and value and isinstance(value[0], dict):
+        return [query_shape(item) for item in value]
+    return 1
+
+
+def summarize_explain(explain: dict) -> dict:
+    # The winning plan as its stages from the top, the indexes it uses and
+    # how much it examined for what it returned
+    plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+    # The slot based engine of Mongo 5+ nests the classic plan
+    plan = plan.get("queryPlan", plan)
+    stages, indexes = [], []
+    pending = [plan]
+    while pending:
+        stage = pending.pop(0)
+        if not stage:
+            continue
+        stages.append(stage.get("stage", "?"))
+        if "indexName" in stage:
+            indexes.append(stage["indexName"])
+        pending.extend(stage.get("inputStages", []))
+        pending.append(stage.get("inputStage"))
+
+    stats = explain.get("executionStats", {})
+    return {
+        "plan": " > ".join(stages),
+        "indexes": indexes,
+        "collection_scan": "COLLSCAN" in stages,
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "returned": stats.get("nReturned"),
+        "millis": stats.get("executionTimeMillis"),
+    }
+
+
+class SlowQueryRecorder:
+    # Called by AsyncCollection on the executor threads after every query.
+    # A query under the threshold costs one comparison, a slow one a log
+    # line, and a sampled one an explain run in the background
+    def __init__(
+        self,
+        threshold_ms: int = SLOW_QUERY_MS,
+        explain_rate: float = SLOW_QUERY_EXPLAIN_RATE,
+        explain_interval: float = SLOW_QUERY_EXPLAIN_INTERVAL,
+        recent: int = 100,
+    ) -> None:
+        self.threshold = threshold_ms / 1000
+        self.explain_rate = explain_rate
+        self.explain_interval = explain_interval
+        # The latest slow queries, with their plan once it is explained
+        self.recent = deque(maxlen=recent)
+        self._explained_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        collection: str,
+        operation: str,
+        seconds: float,
+        returned: int,
+        filter: Optional[dict] = None,
+        options: Optional[dict] = None,
+        explain: Optional[Callable[[], dict]] = None,
+        submit: Optional[Callable] = None,
+    ) -> None:
+        if not self.threshold or seconds < self.threshold:
+            return
+
+        options = {key: value for key, value in (options or {}).items() if value}
+        shape = (
+            f"{collection}.{operation} {query_shape(filter or {})} "
+            f"sort={options.get('sort')}"
+        )
+        entry = {
+            "collection": collection,
+            "operation": operation,
+            "millis": round(seconds * 1000, 1),
+            "returned": returned,
+            "filter": str(filter)[:MAX_FILTER_LENGTH],
+            "options": options,
+            "shape": shape,
+            "explain": None,
+        }
+        SLOW_QUERIES.inc(collection, operation)
+        log.warning(
+            f"Slow query: collection={collection}, operation={operation}, "
+            f"millis={entry['millis']}, returned={returned}, "
+            f"filter={entry['filter']}, options={options}"
+        )
+
+        explain_now = False
+        with self._lock:
+            self.recent.append(entry)
+            if explain is not None and random.random() < self.explain_rate:
+                now = time.monotonic()
+                last = self._explained_at.get(shape)
+                if last is None or now - last >= self.explain_interval:
+                    self._explained_at[shape] = now
+                    explain_now = True
+        if explain_now and submit is None:
+            self._explain(entry, explain)
+        elif explain_now:
+            # Off the query's path, it runs the query once more
+            submit(self._explain, entry, explain)
+
+    def _explain(self, entry: dict, explain: Callable[[], dict]) -> None:
+        try:
+            summary = summarize_explain(explain())
+        except Exception as exc:
+            # On the executor nobody would see it otherwise
+            log.warning(f"Slow query explain failed: shape={entry['shape']}, exc={exc}")
+            return
+        entry["explain"] = summary
+        if summary["collection_scan"]:
+            COLLECTION_SCANS.inc(entry["collection"])
+        log.warning(
+            f"Slow query plan: shape={entry['shape']}, plan={summary['plan']}, "
+            f"indexes={summary['indexes']}, "
+            f"keys_examined={summary['keys_examined']}, "
+            f"docs_examined={summary['docs_examined']}, "
+            f"returned={summary['returned']}"
+        )
+
+    def slowest(self, count: int = 10) -> List[dict]:
+        with self._lock:
+            entries = list(self.recent)
+        return sorted(entries, key=lambda entry: entry["millis"], reverse=True)[:count]
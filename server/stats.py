@@ -0,0 +1,100 @@
+from typing import List, Sequence
+
+# The date parts kept by each creation histogram bucket, see summary.py
+BUCKET_PARTS = {
+    "minute": ("year", "month", "day", "hour", "minute"),
+    "hour": ("year", "month", "day", "hour"),
+    "day": ("year", "month", "day"),
+}
+# The expression reading each part of a date
+_PART_OPERATORS = {
+    "year": "$year",
+    "month": "$month",
+    "day": "$dayOfMonth",
+    "hour": "$hour",
+    "minute": "$minute",
+}
+
+# The category pipelines start by sorting on category, so Mongo walks a
+# category index in order instead of scanning the collection and sorting
+# the groups
+
+
+def category_stats_pipeline(categories: Sequence[str] = ()) -> List[dict]:
+    pipeline = []
+    if categories:
+        pipeline.append({"$match": {"category": {"$in": sorted(set(categories))}}})
+    pipeline += [
+        {"$sort": {"category": 1}},
+        {
+            "$group": {
+                "_id": "$category",
+                "count": {"$sum": 1},
+                "total_quantity": {"$sum": "$quantity"},
+                "min_price": {"$min": "$price"},
+                "max_price": {"$max": "$price"},
+                "avg_price": {"$avg": "$price"},
+            }
+        },
+        {"$sort": {"_id": 1}},
+    ]
+    return pipeline
+
+
+def category_counts_pipeline() -> List[dict]:
+    # Only reads the category, so the index covers it and no document
+    # is fetched
+    return [
+        {"$sort": {"category": 1}},
+        {"$project": {"_id": 0, "category": 1}},
+        {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def category_summary_pipeline(categories: Sequence[str] = ()) -> List[dict]:
+    # The totals kept in the category summaries, see summary.py
+    pipeline = []
+    if categories:
+        pipeline.append({"$match": {"category": {"$in": sorted(set(categories))}}})
+    pipeline += [
+        {"$sort": {"category": 1}},
+        {
+            "$group": {
+                "_id": "$category",
+                "count": {"$sum": 1},
+                "total_quantity": {"$sum": "$quantity"},
+                "total_price": {"$sum": "$price"},
+            }
+        },
+    ]
+    return pipeline
+
+
+def creation_buckets_pipeline(unit: str, categories: Sequence[str] = ()) -> List[dict]:
+    # The box counts kept in the creation buckets, see summary.py.
+    # $dateFromParts instead of $dateTrunc, which needs Mongo 5
+    match = {"created_at": {"$type": "date"}}
+    if categories:
+        match["category"] = {"$in": sorted(set(categories))}
+    start = {
+        part: {_PART_OPERATORS[part]: "$created_at"} for part in BUCKET_PARTS[unit]
+    }
+    return [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": {"category": "$category", "start": {"$dateFromParts": start}},
+                "count": {"$sum": 1},
+            }
+        },
+    ]
+
+
+def creation_histogram_pipeline(filter: dict) -> List[dict]:
+    # Adds up the buckets of every category
+    return [
+        {"$match": filter},
+        {"$group": {"_id": "$start", "count": {"$sum": "$count"}}},
+        {"$sort": {"_id": 1}},
+    ]
@@ -0,0 +1,162 @@
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from bson import ObjectId
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+
+from stats import BUCKET_PARTS, category_summary_pipeline, creation_buckets_pipeline
+
+log = logging.getLogger(__name__)
+
+# One document per category: {_id: category, count, total_quantity,
+# total_price}. Writes keep it up to date with $inc, so reading a category's
+# totals is a single _id lookup however big the category is
+SUMMARY_COLLECTION = "category_summaries"
+# Box counts by category and creation minute, hour and day: {unit,
+# category, start, count}. Kept up to date the same way, so a histogram
+# over a year by day reads a few hundred buckets instead of every box
+BUCKET_COLLECTION = "creation_buckets"
+BUCKET_UNITS = tuple(BUCKET_PARTS)
+# Buckets a rebuild reads and writes at a time
+REBUILD_CHUNK_SIZE = int(os.environ.get("REBUILD_CHUNK_SIZE", 1000))
+# The box fields the summaries and buckets depend on
+SUMMARY_PROJECTION = {
+    "category": True,
+    "quantity": True,
+    "price": True,
+    "created_at": True,
+}
+
+
+def bucket_start(created_at: datetime, unit: str) -> datetime:
+    # Naive UTC, the way dates come back from Mongo
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    if unit == "minute":
+        return created_at.replace(second=0, microsecond=0)
+    if unit == "hour":
+        return created_at.replace(minute=0, second=0, microsecond=0)
+    return created_at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class SummaryDelta:
+    # The $inc per category for a set of written boxes. Every box a write
+    # removed is subtracted, every box it added is added, so a box moving
+    # to another category shows up in both
+    def __init__(self) -> None:
+        self.changes: Dict[str, Dict[str, int]] = {}
+        # (unit, category, start) -> count
+        self.buckets: Dict[Tuple[str, str, datetime], int] = {}
+
+    def add_totals(self, category: str, totals: dict, sign: int = 1) -> None:
+        inc = self.changes.setdefault(
+            category, {"count": 0, "total_quantity": 0, "total_price": 0}
+        )
+        for key in inc:
+            inc[key] += sign * (totals.get(key) or 0)
+
+    def add_bucket(self, unit: str, category: str, start: datetime, count: int) -> None:
+        key = (unit, category, start)
+        self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def add(self, document: dict, sign: int = 1) -> None:
+        category = document.get("category") or ""
+        totals = {
+            "count": 1,
+            "total_quantity": document.get("quantity"),
+            "total_price": document.get("price"),
+        }
+        self.add_totals(category, totals, sign)
+        created_at = document.get("created_at")
+        if created_at is not None:
+            for unit in BUCKET_UNITS:
+                self.add_bucket(unit, category, bucket_start(created_at, unit), sign)
+
+    def remove(self, document: dict) -> None:
+        self.add(document, -1)
+
+    def replace(self, before: dict, after: dict) -> None:
+        self.remove(before)
+        self.add({**before, **after})
+
+    def requests(self) -> List[UpdateOne]:
+        return [
+            UpdateOne({"_id": category}, {"$inc": inc}, upsert=True)
+            for category, inc in self.changes.items()
+            if any(inc.values())
+        ]
+
+    def bucket_requests(self) -> List[UpdateOne]:
+        # Emptied buckets stay behind with a count of 0
+        return [
+            UpdateOne(
+                {"unit": unit, "category": category, "start": start},
+                {"$inc": {"count": count}},
+                upsert=True,
+            )
+            for (unit, category, start), count in self.buckets.items()
+            if count
+        ]
+
+
+def rebuild_summaries(db, categories: Optional[Sequence[str]] = None) -> int:
+    # Recomputes the summaries from the boxes, of the given categories or
+    # of all of them. Increments landing while the boxes are being read are
+    # lost, so run the full rebuild while writes are paused.
+    # Returns the number of summaries written
+    rows = list(db.boxes.aggregate(category_summary_pipeline(categories or ())))
+    requests = [ReplaceOne({"_id": row["_id"]}, row, upsert=True) for row in rows]
+    # Categories without boxes are left without a summary
+    stale = {"$nin": [row["_id"] for row in rows]}
+    if categories:
+        stale["$in"] = list(categories)
+    requests.append(DeleteMany({"_id": stale}))
+    db[SUMMARY_COLLECTION].bulk_write(requests, ordered=False)
+    log.info(f"Rebuilt category summaries: categories={categories}, count={len(rows)}")
+    return len(rows)
+
+
+def rebuild_buckets(db, categories: Optional[Sequence[str]] = None) -> int:
+    # Recomputes the creation buckets from the boxes, like
+    # rebuild_summaries. The buckets are upserted in chunks as they come
+    # out of the aggregation and marked with the run, the ones of the
+    # categories it didn't write are stale and deleted at the end.
+    # Returns the number of buckets written
+    collection = db[BUCKET_COLLECTION]
+    rebuild = ObjectId()
+    count = 0
+    requests = []
+    for unit in BUCKET_UNITS:
+        rows = db.boxes.aggregate(
+            creation_buckets_pipeline(unit, categories or ()),
+            batchSize=REBUILD_CHUNK_SIZE,
+        )
+        for row in rows:
+            bucket = {
+                "unit": unit,
+                "category": row["_id"].get("category") or "",
+                "start": row["_id"]["start"],
+            }
+            requests.append(
+                ReplaceOne(
+                    bucket,
+                    {**bucket, "count": row["count"], "rebuild": rebuild},
+                    upsert=True,
+                )
+            )
+            if len(requests) == REBUILD_CHUNK_SIZE:
+                collection.bulk_write(requests, ordered=False)
+                count += len(requests)
+                requests = []
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+        count += len(requests)
+
+    stale = {"rebuild": {"$ne": rebuild}}
+    if categories:
+        stale["category"] = {"$in": list(categories)}
+    collection.delete_many(stale)
+    log.info(f"Rebuilt creation buckets: categories={categories}, count={count}")
+    return count
@@ -0,0 +1,110 @@
+import os
+import time
+import signal
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+from typing import Callable, Dict
+
+log = logging.getLogger(__name__)
+
+# A worker which dies sooner than this after starting is restarted after
+# a pause, doubling up to RESTART_MAX_DELAY, so one that can't start
+# doesn't spin
+RESTART_MIN_UPTIME = float(os.environ.get("RESTART_MIN_UPTIME", 10))
+RESTART_MAX_DELAY = float(os.environ.get("RESTART_MAX_DELAY", 30))
+
+
+class Supervisor:
+    # Keeps `workers` processes running target(worker index). Workers are
+    # spawned, not forked, so each one sets up its own Mongo client and
+    # event loop. SIGTERM or SIGINT stop the supervisor, which passes
+    # SIGTERM on and gives the workers shutdown_timeout seconds to finish
+    def __init__(
+        self,
+        target: Callable[[int], None],
+        workers: int,
+        shutdown_timeout: float,
+        restart_min_uptime: float = RESTART_MIN_UPTIME,
+        restart_max_delay: float = RESTART_MAX_DELAY,
+    ) -> None:
+        self.target = target
+        self.workers = workers
+        self.shutdown_timeout = shutdown_timeout
+        self.restart_min_uptime = restart_min_uptime
+        self.restart_max_delay = restart_max_delay
+        self.context = multiprocessing.get_context("spawn")
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.started_at: Dict[int, float] = {}
+        self.delays: Dict[int, float] = {}
+        # worker -> when to start it again
+        self.restarts: Dict[int, float] = {}
+        self.stopping = False
+
+    def start_worker(self, worker: int) -> None:
+        process = self.context.Process(
+            target=self.target, args=(worker,), name=f"worker-{worker}"
+        )
+        process.start()
+        self.processes[worker] = process
+        self.started_at[worker] = time.monotonic()
+        log.info(f"Started worker: worker={worker}, pid={process.pid}")
+
+    def stop(self, signum: int, frame=None) -> None:
+        log.info(f"Stopping workers: signal={signal.Signals(signum).name}")
+        self.stopping = True
+
+    def check_workers(self) -> None:
+        now = time.monotonic()
+        for worker, process in self.processes.items():
+            if process.is_alive() or worker in self.restarts:
+                continue
+            if now - self.started_at[worker] >= self.restart_min_uptime:
+                delay = 0.0
+            else:
+                delay = min(
+                    max(self.delays.get(worker, 0) * 2, 1), self.restart_max_delay
+                )
+            self.delays[worker] = delay
+            self.restarts[worker] = now + delay
+            log.error(
+                f"Worker died: worker={worker}, pid={process.pid}, "
+                f"exitcode={process.exitcode}, restart_in={delay}"
+            )
+        for worker, restart_at in list(self.restarts.items()):
+            if restart_at <= now:
+                del self.restarts[worker]
+                self.start_worker(worker)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for worker in range(self.workers):
+            self.start_worker(worker)
+        while not self.stopping:
+            # Wakes up when a worker exits, and every second for the
+            # delayed restarts and the stop flag
+            wait(
+                [
+                    process.sentinel
+                    for process in self.processes.values()
+                    if process.is_alive()
+                ],
+                timeout=1,
+            )
+            if not self.stopping:
+                self.check_workers()
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for worker, process in self.processes.items():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                log.error(f"Killing worker: worker={worker}, pid={process.pid}")
+                process.kill()
+                process.join()
+        log.info("Workers stopped")
@@ -0,0 +1,22 @@
+import pytest
+from pymongo import MongoClient
+
+from server.indexes import sync_indexes
+from server.server import DatabaseService
+
+
+def get_test_database():
+    # Create a MongoClient connection using default localhost:27017
+    client = MongoClient()
+    # Create the database and return it
+    boxes_db = client.boxes
+    sync_indexes(boxes_db)
+    return boxes_db, client
+
+
+@pytest.fixture
+def box_service():
+    boxes_db, mongo_client = get_test_database()
+    service = DatabaseService(boxes_db=boxes_db)
+    yield service
+    mongo_client.drop_database(boxes_db)
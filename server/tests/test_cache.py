@@ -0,0 +1,84 @@
+from server.cache import (
+    CACHE_EVICTIONS,
+    CACHE_EXPIRATIONS,
+    CACHE_HITS,
+    CACHE_MISSES,
+    LRUCache,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.put(1, "Box1")
+    cache.put(2, "Box2")
+    # touch 1 so that 2 becomes the least recently used
+    assert cache.get(1) == "Box1"
+    cache.put(3, "Box3")
+
+    assert cache.get(2) is None
+    assert cache.get(1) == "Box1"
+    assert cache.get(3) == "Box3"
+    assert cache.stats() == {
+        "size": 2,
+        "hits": 3,
+        "misses": 1,
+        "evictions": 1,
+        "expirations": 0,
+    }
+
+
+def test_ttl_expiration():
+    clock = FakeClock()
+    cache = LRUCache(maxsize=2, ttl=10, clock=clock)
+    cache.put(1, "Box1")
+
+    clock.now = 9.9
+    assert cache.get(1) == "Box1"
+    clock.now = 10
+    assert cache.get(1) is None
+    assert len(cache) == 0
+    assert cache.expirations == 1
+
+
+def test_stale_read_is_not_cached():
+    cache = LRUCache(maxsize=2, ttl=60)
+    # a read starts, a write invalidates the key before the read comes back
+    generation = cache.generation
+    cache.invalidate(1)
+    cache.put(1, "old Box1", generation)
+    assert cache.get(1) is None
+
+    generation = cache.generation
+    cache.put(1, "new Box1", generation)
+    assert cache.get(1) == "new Box1"
+
+
+def test_disabled_cache():
+    cache = LRUCache(maxsize=0)
+    cache.put(1, "Box1")
+    assert cache.get(1) is None
+    assert len(cache) == 0
+
+
+def test_metrics():
+    counters = [CACHE_HITS, CACHE_MISSES, CACHE_EVICTIONS, CACHE_EXPIRATIONS]
+    before = [counter.value() for counter in counters]
+    clock = FakeClock()
+    cache = LRUCache(maxsize=1, ttl=10, clock=clock)
+    cache.put(1, "Box1")
+    assert cache.get(1) == "Box1"
+    cache.put(2, "Box2")
+    assert cache.get(1) is None
+    clock.now = 11
+    assert cache.get(2) is None
+
+    after = [counter.value() for counter in counters]
+    assert [a - b for a, b in zip(after, before)] == [1, 2, 1, 1]
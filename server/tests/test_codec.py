@@ -0,0 +1,84 @@
+from dataclasses import asdict
+from datetime import datetime, timezone
+
+from server.codec import (
+    box_to_document,
+    boxes_to_documents,
+    document_to_box,
+    documents_to_boxes,
+)
+from server.db import Box
+
+
+def make_box(id=1):
+    return Box(
+        id=id,
+        name=f"Box{id}",
+        price=10 * id,
+        description="Test box",
+        category="TEST",
+        quantity=id,
+        created_at=datetime(2022, 7, 1, 12, 30, tzinfo=timezone.utc),
+    )
+
+
+def test_box_to_document():
+    box = make_box()
+    document = box_to_document(box)
+
+    # same as the asdict() based conversion it replaced, id stored as _id
+    expected = asdict(box)
+    expected["_id"] = expected.pop("id")
+    assert document == expected
+
+
+def test_box_to_document_defaults():
+    document = box_to_document(Box(id=2))
+
+    assert document["_id"] == 2
+    assert document["name"] == ""
+    assert document["price"] == 0
+    assert document["created_at"] is None
+
+
+def test_document_round_trip():
+    boxes = [make_box(id) for id in range(1, 4)]
+    documents = boxes_to_documents(boxes)
+    decoded = documents_to_boxes(documents)
+
+    assert [bytes(box) for box in decoded] == [bytes(box) for box in boxes]
+    assert [box.to_dict() for box in decoded] == [box.to_dict() for box in boxes]
+
+
+def test_document_to_box_does_not_modify_document():
+    document = box_to_document(make_box())
+    before = dict(document)
+
+    box = document_to_box(document, ["id", "name"])
+
+    assert document == before
+    assert box.id == 1
+    assert box.name == "Box1"
+    # fields outside the mask are left unset
+    assert box.price == 0
+    assert box.created_at is None
+    assert bytes(box) == bytes(Box(id=1, name="Box1"))
+
+
+def test_document_to_box_ignores_unknown_fields():
+    document = box_to_document(make_box())
+    document["legacy_field"] = "ignored"
+
+    box = document_to_box(document)
+
+    assert bytes(box) == bytes(make_box())
+
+
+def test_document_to_box_partial_document():
+    # projected documents only carry some of the fields
+    box = document_to_box({"_id": 5, "category": "TEST"})
+
+    assert box.id == 5
+    assert box.category == "TEST"
+    assert box.name == ""
+    assert bytes(box) == bytes(Box(id=5, category="TEST"))
@@ -0,0 +1,131 @@
+import socket
+from pathlib import Path
+
+import pytest
+from grpclib.client import Channel
+from grpclib.server import Server
+
+from server.compression import CompressionCodec, client_compression
+from server.db import (
+    Box,
+    CreateBoxRequest,
+    DatabaseServiceStub,
+    GetBoxesResponse,
+    RequestStatus,
+)
+
+# the server's own modules, which it imports without the package
+from server.server import MetricsCodec, server_compression
+
+BOXES = GetBoxesResponse(
+    box=[Box(id=id, name=f"Box{id}", category="CATEGORY_A") for id in range(100)]
+)
+
+
+class RecordingCodec(CompressionCodec):
+    # Keeps the first two bytes of every message sent and received
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sent = []
+        self.received = []
+
+    def encode(self, message, message_type):
+        data = super().encode(message, message_type)
+        self.sent.append(data[:2])
+        return data
+
+    def decode(self, data, message_type):
+        self.received.append(data[:2])
+        return super().decode(data, message_type)
+
+
+def test_client_copy_is_the_same():
+    root = Path(__file__).resolve().parents[2]
+    server = (root / "server" / "compression.py").read_text()
+    assert (root / "client" / "compression.py").read_text() == server
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_codec():
+    codec = CompressionCodec(encodings="gzip,deflate", min_size=1024)
+    plain = bytes(BOXES)
+    assert codec.encode(BOXES, GetBoxesResponse) == plain
+
+    for encoding, marker in [("gzip", b"\x00\x01"), ("deflate", b"\x00\x02")]:
+        codec.request_encoding = encoding
+        data = codec.encode(BOXES, GetBoxesResponse)
+        assert data[:2] == marker
+        assert len(data) < len(plain) / 5
+        assert codec.decode(data, GetBoxesResponse) == BOXES
+        # small messages are sent as they are
+        small = GetBoxesResponse(box=BOXES.box[:1])
+        assert codec.encode(small, GetBoxesResponse) == bytes(small)
+
+    with pytest.raises(ValueError):
+        codec.decode(b"\x00\x09abc", GetBoxesResponse)
+
+
+def test_negotiate():
+    codec = CompressionCodec(encodings="gzip, deflate, brotli")
+    assert codec.encodings == ("gzip", "deflate")
+    assert codec.negotiate("deflate,gzip") == "gzip"
+    assert codec.negotiate("br, deflate") == "deflate"
+    assert codec.negotiate("br") is None
+    assert codec.negotiate(None) is None
+    assert CompressionCodec(encodings="").encodings == ()
+
+
+@pytest.mark.asyncio
+async def test_compressed_rpcs(box_service):
+    port = free_port()
+    server_codec = MetricsCodec(encodings="gzip,deflate", min_size=1024)
+    server = Server([box_service], codec=server_codec)
+    server_compression(server, server_codec)
+    await server.start("127.0.0.1", port)
+
+    codec = RecordingCodec(encodings="deflate", min_size=1024)
+    channel = Channel("127.0.0.1", port, codec=codec)
+    client_compression(channel, codec)
+    plain_codec = RecordingCodec(encodings="")
+    plain_channel = Channel("127.0.0.1", port, codec=plain_codec)
+    client_compression(plain_channel, plain_codec)
+    try:
+        stub = DatabaseServiceStub(channel)
+        # nothing is compressed before the server said it accepts it
+        assert codec.request_encoding is None
+        response = await stub.bulk_create_boxes(
+            CreateBoxRequest(box=Box(id=id, name=f"Box{id}", category="CATEGORY_A"))
+            for id in range(1, 201)
+        )
+        assert response.status == RequestStatus.OK
+        assert codec.request_encoding == "deflate"
+
+        response = await stub.get_box(id=1)
+        assert response.box.name == "Box1"
+        assert codec.received[-1][:1] != b"\x00"
+
+        response = await stub.get_boxes(page_size=200)
+        assert len(response.box) == 200
+        assert codec.received[-1] == b"\x00\x02"
+
+        # the ids make a large request, which the server decodes
+        response = await stub.batch_get_boxes(ids=list(range(1, 1001)))
+        assert len(response.results) == 1000
+        assert response.results[199].box.name == "Box200"
+        assert codec.sent[-1] == b"\x00\x02"
+
+        # clients which don't ask for compression don't get it
+        plain_stub = DatabaseServiceStub(plain_channel)
+        response = await plain_stub.get_boxes(page_size=200)
+        assert len(response.box) == 200
+        assert plain_codec.received[-1][:1] != b"\x00"
+    finally:
+        channel.close()
+        plain_channel.close()
+        server.close()
+        await server.wait_closed()
@@ -0,0 +1,97 @@
+import pytest
+from bson import Timestamp
+
+from server.async_db import AsyncCollection, get_executor
+from server.consistency import ReadYourWrites
+
+
+class FakeSession:
+    # Reports the times the server would send back after `operation_time`
+    def __init__(self, client):
+        self.client = client
+        self.cluster_time = None
+        self.operation_time = None
+        self.ended = False
+
+    def advance_cluster_time(self, cluster_time):
+        self.cluster_time = cluster_time
+
+    def advance_operation_time(self, operation_time):
+        self.operation_time = operation_time
+
+    def end_session(self):
+        self.ended = True
+
+
+class FakeClient:
+    def __init__(self):
+        self.sessions = []
+
+    def start_session(self, causal_consistency):
+        assert causal_consistency
+        session = FakeSession(self)
+        self.sessions.append(session)
+        return session
+
+
+class FakeCollection:
+    name = "boxes"
+
+    def __init__(self):
+        self.time = 0
+        self.calls = []
+
+    def insert_one(self, document, session=None):
+        # a write moves the cluster time on
+        self.time += 1
+        self.calls.append(("insert_one", session.operation_time))
+        session.operation_time = Timestamp(self.time, 0)
+        session.cluster_time = {"clusterTime": Timestamp(self.time, 0)}
+
+    def find_one(self, filter, session=None):
+        self.calls.append(("find_one", session.operation_time))
+        return {"_id": filter["_id"]}
+
+
+def test_sessions_advance_to_the_latest_write():
+    client = FakeClient()
+    consistency = ReadYourWrites(client)
+
+    session = consistency.start_session()
+    assert session.operation_time is None
+    session.operation_time = Timestamp(5, 1)
+    session.cluster_time = {"clusterTime": Timestamp(5, 1)}
+    consistency.end_session(session)
+    assert session.ended
+
+    # an older session ending later doesn't move the clock back
+    old = FakeSession(client)
+    old.operation_time = Timestamp(3, 0)
+    old.cluster_time = {"clusterTime": Timestamp(3, 0)}
+    consistency.end_session(old)
+
+    session = consistency.start_session()
+    assert session.operation_time == Timestamp(5, 1)
+    assert session.cluster_time == {"clusterTime": Timestamp(5, 1)}
+
+
+@pytest.mark.asyncio
+async def test_collection_operations_run_in_sessions():
+    collection = FakeCollection()
+    boxes = AsyncCollection(
+        collection, get_executor(), consistency=ReadYourWrites(FakeClient())
+    )
+    assert await boxes.find_one({"_id": 1}) == {"_id": 1}
+    await boxes.insert_one({"_id": 2})
+    assert await boxes.find_one({"_id": 2}) == {"_id": 2}
+    await boxes.insert_one({"_id": 3})
+    await boxes.find_one({"_id": 3})
+    assert collection.calls == [
+        ("find_one", None),
+        ("insert_one", None),
+        # reads wait for the writes before them
+        ("find_one", Timestamp(1, 0)),
+        ("insert_one", Timestamp(1, 0)),
+        ("find_one", Timestamp(2, 0)),
+    ]
+    assert all(session.ended for session in boxes.consistency.client.sessions)
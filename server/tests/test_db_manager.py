@@ -0,0 +1,81 @@
+from pymongo import monitoring
+
+from server import db_manager
+from server.pool_stats import (
+    POOL_CHECKOUT_FAILURES,
+    POOL_CONNECTIONS,
+    POOL_CONNECTIONS_CLOSED,
+    POOL_IN_USE,
+    POOL_MAX_SIZE,
+    POOL_WAIT_TIME,
+    POOL_WAITING,
+    PoolStats,
+)
+
+ADDRESS = ("pool-test", 27017)
+LABEL = "pool-test:27017"
+
+
+def test_client_options(monkeypatch):
+    # unset options are left to DB_URI and pymongo
+    options = db_manager.client_options()
+    assert "maxPoolSize" not in options
+    assert "serverSelectionTimeoutMS" not in options
+    assert "compressors" not in options
+    assert "waitQueueTimeoutMS" not in options
+
+    monkeypatch.setattr(db_manager, "DB_MAX_POOL_SIZE", 50)
+    monkeypatch.setattr(db_manager, "DB_MIN_POOL_SIZE", 10)
+    monkeypatch.setattr(db_manager, "DB_WAIT_QUEUE_TIMEOUT_MS", 500)
+    monkeypatch.setattr(db_manager, "DB_COMPRESSORS", "zstd,zlib")
+    monkeypatch.setattr(db_manager, "DB_ZLIB_COMPRESSION_LEVEL", 1)
+    options = db_manager.client_options()
+    assert options["maxPoolSize"] == 50
+    assert options["minPoolSize"] == 10
+    assert options["waitQueueTimeoutMS"] == 500
+    assert options["compressors"] == "zstd,zlib"
+    assert options["zlibCompressionLevel"] == 1
+
+
+def test_pool_stats():
+    stats = PoolStats()
+    stats.pool_created(monitoring.PoolCreatedEvent(ADDRESS, {"maxPoolSize": 5}))
+    assert POOL_MAX_SIZE.value(LABEL) == 5
+
+    for connection_id in (1, 2):
+        stats.connection_check_out_started(
+            monitoring.ConnectionCheckOutStartedEvent(ADDRESS)
+        )
+        assert POOL_WAITING.value(LABEL) == 1
+        stats.connection_created(
+            monitoring.ConnectionCreatedEvent(ADDRESS, connection_id)
+        )
+        stats.connection_checked_out(
+            monitoring.ConnectionCheckedOutEvent(ADDRESS, connection_id)
+        )
+    assert POOL_CONNECTIONS.value(LABEL) == 2
+    assert POOL_IN_USE.value(LABEL) == 2
+    assert POOL_WAITING.value(LABEL) == 0
+    assert POOL_WAIT_TIME.count(LABEL) == 2
+
+    stats.connection_checked_in(monitoring.ConnectionCheckedInEvent(ADDRESS, 1))
+    stats.connection_closed(
+        monitoring.ConnectionClosedEvent(
+            ADDRESS, 1, monitoring.ConnectionClosedReason.IDLE
+        )
+    )
+    assert POOL_IN_USE.value(LABEL) == 1
+    assert POOL_CONNECTIONS.value(LABEL) == 1
+    assert POOL_CONNECTIONS_CLOSED.value(LABEL, "idle") == 1
+
+    stats.connection_check_out_started(
+        monitoring.ConnectionCheckOutStartedEvent(ADDRESS)
+    )
+    stats.connection_check_out_failed(
+        monitoring.ConnectionCheckOutFailedEvent(
+            ADDRESS, monitoring.ConnectionCheckOutFailedReason.TIMEOUT
+        )
+    )
+    assert POOL_WAITING.value(LABEL) == 0
+    assert POOL_CHECKOUT_FAILURES.value(LABEL, "timeout") == 1
+    assert POOL_WAIT_TIME.count(LABEL) == 3
@@ -0,0 +1,115 @@
+from pymongo import ASCENDING, TEXT, MongoClient
+
+from server.indexes import (
+    CONFLICT,
+    CREATED,
+    DROPPED,
+    EXISTS,
+    UNDECLARED,
+    IndexSpec,
+    index_stats,
+    sync_indexes,
+)
+
+INDEXES = {
+    "boxes": [
+        IndexSpec("category_id_index", [("category", ASCENDING), ("_id", ASCENDING)]),
+        # only boxes in stock are indexed
+        IndexSpec(
+            "in_stock_index",
+            [("quantity", ASCENDING)],
+            partial_filter={"quantity": {"$gt": 0}},
+        ),
+        IndexSpec(
+            "name_description_text_index",
+            [("name", TEXT), ("description", TEXT)],
+            weights={"name": 10, "description": 2},
+        ),
+    ],
+    "events": [
+        IndexSpec(
+            "created_at_ttl_index", [("created_at", ASCENDING)], expire_after_seconds=60
+        ),
+    ],
+}
+
+
+def get_test_database():
+    client = MongoClient()
+    return client.boxes_indexes_test, client
+
+
+def test_sync_indexes():
+    db, client = get_test_database()
+    try:
+        report = sync_indexes(db, INDEXES)
+        assert report == {
+            "boxes": {
+                "category_id_index": CREATED,
+                "in_stock_index": CREATED,
+                "name_description_text_index": CREATED,
+            },
+            "events": {"created_at_ttl_index": CREATED},
+        }
+        info = db.events.index_information()
+        assert info["created_at_ttl_index"]["expireAfterSeconds"] == 60
+
+        # nothing to do the second time round
+        report = sync_indexes(db, INDEXES)
+        # text indexes are listed with _fts keys instead of the fields
+        assert report["boxes"] == {
+            "category_id_index": EXISTS,
+            "in_stock_index": EXISTS,
+            "name_description_text_index": EXISTS,
+        }
+        assert report["events"] == {"created_at_ttl_index": EXISTS}
+    finally:
+        client.drop_database(db)
+
+
+def test_sync_indexes_leaves_undeclared_until_dropped():
+    db, client = get_test_database()
+    try:
+        db.boxes.create_index("name", name="name_index")
+        # declared name with different keys
+        db.boxes.create_index("category", name="category_id_index")
+
+        report = sync_indexes(db, INDEXES)
+        assert report["boxes"] == {
+            "name_index": UNDECLARED,
+            "category_id_index": CONFLICT,
+            "in_stock_index": CREATED,
+            "name_description_text_index": CREATED,
+        }
+        assert "name_index" in db.boxes.index_information()
+
+        report = sync_indexes(db, INDEXES, drop=True)
+        assert report["boxes"] == {
+            "name_index": DROPPED,
+            "category_id_index": CREATED,
+            "in_stock_index": EXISTS,
+            "name_description_text_index": EXISTS,
+        }
+        info = db.boxes.index_information()
+        assert "name_index" not in info
+        assert info["category_id_index"]["key"] == [("category", 1), ("_id", 1)]
+    finally:
+        client.drop_database(db)
+
+
+def test_index_stats():
+    db, client = get_test_database()
+    try:
+        sync_indexes(db, INDEXES)
+        db.boxes.create_index("name", name="name_index")
+        db.boxes.insert_one({"_id": 1, "category": "TEST", "quantity": 1})
+        list(db.boxes.find({"category": "TEST"}).hint("category_id_index"))
+
+        stats = {stat["name"]: stat for stat in index_stats(db, INDEXES)["boxes"]}
+        assert stats["category_id_index"]["ops"] == 1
+        assert stats["category_id_index"]["declared"]
+        assert stats["in_stock_index"]["ops"] == 0
+        assert stats["_id_"]["declared"]
+        assert not stats["name_index"]["declared"]
+    finally:
+        client.drop_database(db)
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+
+import pytest
+from grpclib.testing import ChannelFor
+
+from server.db import Box, DatabaseServiceStub, RequestStatus
+from server.metrics import Counter, Gauge, Histogram, Registry
+from server.server import MetricsCodec, serve_metrics
+
+
+def test_render():
+    registry = Registry()
+    requests = registry.register(Counter("requests_total", "Requests", ["method"]))
+    in_flight = registry.register(Gauge("in_flight", "In flight"))
+    latency = registry.register(
+        Histogram("latency_seconds", "Latency", ["method"], buckets=[0.1, 1])
+    )
+    requests.inc("GetBox")
+    requests.inc("GetBox")
+    requests.inc('Say "hi"\n')
+    in_flight.inc()
+    in_flight.dec()
+    latency.observe(0.1, "GetBox")
+    latency.observe(0.5, "GetBox")
+    latency.observe(3, "GetBox")
+
+    assert requests.value("GetBox") == 2
+    assert latency.count("GetBox") == 3
+    assert registry.render() == (
+        "# HELP requests_total Requests\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{method="GetBox"} 2\n'
+        'requests_total{method="Say \\"hi\\"\\n"} 1\n'
+        "# HELP in_flight In flight\n"
+        "# TYPE in_flight gauge\n"
+        "in_flight 0\n"
+        "# HELP latency_seconds Latency\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{method="GetBox",le="0.1"} 1\n'
+        'latency_seconds_bucket{method="GetBox",le="1"} 2\n'
+        'latency_seconds_bucket{method="GetBox",le="+Inf"} 3\n'
+        'latency_seconds_sum{method="GetBox"} 3.6\n'
+        'latency_seconds_count{method="GetBox"} 3\n'
+    )
+
+
+
+def test_updates_from_threads():
+    registry = Registry()
+    requests = registry.register(Counter("requests_total", "Requests", ["method"]))
+    latency = registry.register(Histogram("latency_seconds", "Latency", ["method"]))
+
+    def update(method):
+        for _ in range(2000):
+            requests.inc(method)
+            latency.observe(0.01, method)
+
+    threads = [
+        threading.Thread(target=update, args=(f"Method{n % 4}",)) for n in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    # new label values show up while rendering
+    while any(thread.is_alive() for thread in threads):
+        registry.render()
+    for thread in threads:
+        thread.join()
+    assert requests.value("Method0") == 4000
+    assert latency.count("Method3") == 4000
+
+
+async def fetch(port: int, path: str):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    response = (await reader.read()).decode()
+    writer.close()
+    head, _, body = response.partition("\r\n\r\n")
+    return head.split("\r\n")[0], body
+
+
+def samples(body: str) -> dict:
+    return dict(
+        line.rsplit(" ", 1) for line in body.splitlines() if not line.startswith("#")
+    )
+
+
+@pytest.mark.asyncio
+async def test_rpc_metrics(box_service):
+    metrics_server = await serve_metrics("127.0.0.1", 0)
+    port = metrics_server.sockets[0].getsockname()[1]
+    try:
+        status_line, body = await fetch(port, "/metrics")
+        assert status_line == "HTTP/1.1 200 OK"
+        before = samples(body)
+
+        async with ChannelFor([box_service], codec=MetricsCodec()) as channel:
+            stub = DatabaseServiceStub(channel)
+            response = await stub.create_box(box=Box(name="Box1", id=1, price=10))
+            assert response.status == RequestStatus.OK
+            response = await stub.get_box(id=1)
+            assert response.status == RequestStatus.OK
+            response = await stub.get_box(id=999999)
+            assert response.status == RequestStatus.ERROR
+            response = await stub.get_boxes()
+            assert len(response.box) == 1
+
+        status_line, body = await fetch(port, "/metrics")
+        after = samples(body)
+
+        def delta(sample):
+            return float(after.get(sample, 0)) - float(before.get(sample, 0))
+
+        assert delta('boxes_rpc_requests_total{method="GetBox"}') == 2
+        assert delta('boxes_rpc_responses_total{method="GetBox",status="OK"}') == 1
+        assert delta('boxes_rpc_responses_total{method="GetBox",status="ERROR"}') == 1
+        assert after['boxes_rpc_in_flight{method="GetBox"}'] == "0"
+        for name in ("latency_seconds", "mongo_seconds", "encode_seconds"):
+            assert delta(f'boxes_rpc_{name}_count{{method="GetBoxes"}}') == 1
+        assert delta('boxes_rpc_mongo_seconds_sum{method="CreateBox"}') > 0
+        # the boxes of the list responses are encoded before the codec sees them
+        assert delta('boxes_rpc_encode_seconds_sum{method="GetBoxes"}') > 0
+        assert delta('boxes_rpc_response_bytes_count{method="GetBoxes"}') == 1
+        assert delta('boxes_rpc_response_bytes_sum{method="GetBoxes"}') > 10
+
+        status_line, _ = await fetch(port, "/other")
+        assert status_line == "HTTP/1.1 404 Not Found"
+    finally:
+        metrics_server.close()
+        await metrics_server.wait_closed()
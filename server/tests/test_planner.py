@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import pytest
+from pymongo import ASCENDING
+
+from server.db import QuerySort
+from server.indexes import INDEXES
+from server.planner import InvalidQuery, plan_query
+
+START = datetime(2022, 7, 1)
+END = datetime(2022, 7, 8)
+
+
+def test_plan_single_category_time_range():
+    plan = plan_query(["TEST"], start_time=START, end_time=END)
+
+    assert plan.filter == {
+        "category": "TEST",
+        "created_at": {"$gte": START, "$lte": END},
+    }
+    # the range is sorted on, so it is bounded by the index
+    assert plan.keys == ["created_at", "_id"]
+    assert plan.hint == [
+        ("category", ASCENDING),
+        ("created_at", ASCENDING),
+        ("_id", ASCENDING),
+    ]
+
+
+def test_plan_several_categories_price_range():
+    plan = plan_query(["B", "A", "B"], min_price=10)
+
+    assert plan.filter == {"category": {"$in": ["A", "B"]}, "price": {"$gte": 10}}
+    assert plan.keys == ["price", "_id"]
+
+
+def test_plan_explicit_sort():
+    plan = plan_query(start_time=START, max_price=100, sort=QuerySort.SORT_BY_PRICE)
+
+    assert plan.filter == {
+        "created_at": {"$gte": START},
+        "price": {"$lte": 100},
+    }
+    assert plan.keys == ["price", "_id"]
+    assert plan.hint == [("price", ASCENDING), ("_id", ASCENDING)]
+
+
+def test_plan_no_filters():
+    plan = plan_query()
+
+    assert plan.filter == {}
+    assert plan.keys == ["_id"]
+    assert plan.hint == [("_id", ASCENDING)]
+
+
+def test_every_plan_has_an_index():
+    indexes = [spec.keys for spec in INDEXES["boxes"]] + [[("_id", ASCENDING)]]
+    for categories in ([], ["A"], ["A", "B"]):
+        for sort in QuerySort:
+            plan = plan_query(categories, START, END, 0, 100, sort)
+            assert plan.hint in indexes
+
+
+def test_plan_invalid_ranges():
+    with pytest.raises(InvalidQuery):
+        plan_query(start_time=END, end_time=START)
+    with pytest.raises(InvalidQuery):
+        plan_query(min_price=10, max_price=5)
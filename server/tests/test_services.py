@@ -1,33 +1,28 @@
 import asyncio
+import os
+import time
 import pytest
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from betterproto.lib.google.protobuf import FieldMask
+from grpclib.testing import ChannelFor
 from pymongo import MongoClient
+from pymongo.read_preferences import Primary, SecondaryPreferred
 
 from server.server import DatabaseService
-from server.db import Box, RequestStatus
+from server.db import (
+    Box,
+    CreateBoxRequest,
+    DatabaseServiceStub,
+    HistogramBucket,
+    QuerySort,
+    RequestStatus,
+)
 from server.db_manager import get_database
-
-
-def get_test_database():
-    # Create a MongoClient connection using default localhost:27017
-    client = MongoClient()
-    # Create the database and return it
-    boxes_db = client.boxes
-    boxes_indexes_dict = boxes_db.boxes.index_information()
-    if "category_index" not in boxes_indexes_dict:
-        boxes_db.boxes.create_index("category", name="category_index")
-
-    if "created_at_index" not in boxes_indexes_dict:
-        boxes_db.boxes.create_index("created_at", name="created_at_index")
-    return boxes_db, client
-
-
-@pytest.fixture
-def box_service():
-    boxes_db, mongo_client = get_test_database()
-    service = DatabaseService(boxes_db=boxes_db)
-    yield service
-    mongo_client.drop_database(boxes_db)
+from server.async_db import get_executor
+from server.cache import LRUCache
+from server.summary import rebuild_buckets, rebuild_summaries
+from server.tests.conftest import get_test_database
 
 
 @pytest.mark.asyncio
@@ -241,3 +236,1116 @@ async def test_get_boxes_in_time_range(box_service):
     assert response.status == RequestStatus.OK
     response = await box_service.delete_box(id=box4.id)
     assert response.status == RequestStatus.OK
+
+
+class SlowCollection:
+    # Stands in for a Mongo collection whose every lookup takes `delay` secs
+    name = "boxes"
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.lookups = 0
+
+    def find_one(self, filter, projection=None):
+        self.lookups += 1
+        time.sleep(self.delay)
+        return {"_id": filter["_id"], "name": f"Box{filter['_id']}"}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_overlap():
+    delay = 0.2
+    lookups = 10
+    service = DatabaseService(
+        boxes_db=SimpleNamespace(boxes=SlowCollection(delay)),
+        executor=get_executor(max_workers=lookups),
+    )
+
+    started = time.perf_counter()
+    responses = await asyncio.gather(
+        *(service.get_box(id=i) for i in range(lookups))
+    )
+    elapsed = time.perf_counter() - started
+
+    assert [response.box.id for response in responses] == list(range(lookups))
+    # all lookups run side by side instead of one after another
+    assert elapsed < delay * 3
+    service.executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_stream_boxes_in_category(box_service):
+    box_service.stream_chunk_size = 2
+
+    # when there is no boxes in DB the stream is empty
+    chunks = [
+        chunk
+        async for chunk in box_service.stream_boxes_in_category(
+            category="TEST_CATEGORY_1"
+        )
+    ]
+    assert chunks == []
+
+    # create some boxes first
+    for id in range(1, 6):
+        response = await box_service.create_box(
+            box=Box(name=f'Box{id}', id=id, category="TEST_CATEGORY_1")
+        )
+        assert response.status == RequestStatus.OK
+    response = await box_service.create_box(box=Box(name='Box6', id=6))
+    assert response.status == RequestStatus.OK
+
+    chunks = [
+        chunk
+        async for chunk in box_service.stream_boxes_in_category(
+            category="TEST_CATEGORY_1"
+        )
+    ]
+    assert [len(chunk.box) for chunk in chunks] == [2, 2, 1]
+    assert all(chunk.status == RequestStatus.OK for chunk in chunks)
+    assert sorted(box.id for chunk in chunks for box in chunk.box) == [1, 2, 3, 4, 5]
+
+    chunks = [chunk async for chunk in box_service.stream_boxes()]
+    assert sum(len(chunk.box) for chunk in chunks) == 6
+
+    #clean up
+    for id in range(1, 7):
+        response = await box_service.delete_box(id=id)
+        assert response.status == RequestStatus.OK
+
+
+@pytest.mark.asyncio
+async def test_get_boxes_pagination(box_service):
+    # create some boxes first
+    for id in range(1, 6):
+        response = await box_service.create_box(
+            box=Box(name=f'Box{id}', id=id, category="TEST_CATEGORY_1")
+        )
+        assert response.status == RequestStatus.OK
+
+    # walk forward through the pages
+    response = await box_service.get_boxes_in_category(
+        category="TEST_CATEGORY_1", page_size=2
+    )
+    assert response.status == RequestStatus.OK
+    assert [box.id for box in response.box] == [1, 2]
+    assert response.prev_page_token == ""
+
+    response = await box_service.get_boxes_in_category(
+        category="TEST_CATEGORY_1", page_size=2, page_token=response.next_page_token
+    )
+    assert [box.id for box in response.box] == [3, 4]
+
+    response = await box_service.get_boxes_in_category(
+        category="TEST_CATEGORY_1", page_size=2, page_token=response.next_page_token
+    )
+    assert [box.id for box in response.box] == [5]
+    assert response.next_page_token == ""
+
+    # and back again
+    response = await box_service.get_boxes_in_category(
+        category="TEST_CATEGORY_1", page_size=2, page_token=response.prev_page_token
+    )
+    assert [box.id for box in response.box] == [3, 4]
+
+    response = await box_service.get_boxes_in_category(
+        category="TEST_CATEGORY_1", page_size=2, page_token=response.prev_page_token
+    )
+    assert [box.id for box in response.box] == [1, 2]
+    assert response.prev_page_token == ""
+
+    # time range pages are ordered by created_at
+    end_time = datetime.utcnow()
+    start_time = end_time - timedelta(days=1)
+    ids = []
+    page_token = ""
+    while True:
+        response = await box_service.get_boxes_in_time_range(
+            start_time=start_time, end_time=end_time, page_size=2, page_token=page_token
+        )
+        assert response.status == RequestStatus.OK
+        ids += [box.id for box in response.box]
+        page_token = response.next_page_token
+        if not page_token:
+            break
+    assert ids == [1, 2, 3, 4, 5]
+
+    # a broken token is an error
+    response = await box_service.get_boxes(page_size=2, page_token="not a token")
+    assert response.status == RequestStatus.ERROR
+
+    #clean up
+    for id in range(1, 6):
+        response = await box_service.delete_box(id=id)
+        assert response.status == RequestStatus.OK
+
+
+@pytest.mark.asyncio
+async def test_get_boxes_field_mask(box_service):
+    # create some boxes first
+    for id in range(1, 4):
+        response = await box_service.create_box(
+            box=Box(
+                name=f'Box{id}',
+                id=id,
+                price=10,
+                description="A long description",
+                category="TEST_CATEGORY_1",
+            )
+        )
+        assert response.status == RequestStatus.OK
+
+    response = await box_service.get_box(
+        id=1, field_mask=FieldMask(paths=["name", "price"])
+    )
+    assert response.status == RequestStatus.OK
+    assert response.box.name == "Box1"
+    assert response.box.price == 10
+    # fields outside of the mask are left unset
+    assert response.box.id == 0
+    assert response.box.description == ""
+    assert response.box.created_at is None
+
+    # the mask still works together with paging
+    response = await box_service.get_boxes_in_category(
+        category="TEST_CATEGORY_1",
+        page_size=2,
+        field_mask=FieldMask(paths=["id", "name"]),
+    )
+    assert response.status == RequestStatus.OK
+    assert [box.id for box in response.box] == [1, 2]
+    assert all(box.description == "" for box in response.box)
+    response = await box_service.get_boxes_in_category(
+        category="TEST_CATEGORY_1",
+        page_size=2,
+        page_token=response.next_page_token,
+        field_mask=FieldMask(paths=["name"]),
+    )
+    assert [box.name for box in response.box] == ["Box3"]
+    assert response.box[0].id == 0
+
+    # unknown fields are an error
+    response = await box_service.get_boxes(field_mask=FieldMask(paths=["colour"]))
+    assert response.status == RequestStatus.ERROR
+
+    #clean up
+    for id in range(1, 4):
+        response = await box_service.delete_box(id=id)
+        assert response.status == RequestStatus.OK
+
+
+@pytest.mark.asyncio
+async def test_get_box_cache(box_service):
+    box1 = Box(name='Box1', id=1, description="A long description")
+    response = await box_service.create_box(box=box1)
+    assert response.status == RequestStatus.OK
+
+    # the first read goes to the DB, the second one is a cache hit
+    response = await box_service.get_box(id=box1.id)
+    assert response.box.name == "Box1"
+    response = await box_service.get_box(
+        id=box1.id, field_mask=FieldMask(paths=["description"])
+    )
+    assert response.status == RequestStatus.OK
+    assert response.box.name == ""
+    assert response.box.description == "A long description"
+    assert box_service.box_cache.hits == 1
+    assert box_service.box_cache.misses == 1
+
+    # writes are seen right away
+    box1.name = "Box1 new"
+    response = await box_service.update_box(box=box1)
+    assert response.status == RequestStatus.OK
+    response = await box_service.get_box(id=box1.id)
+    assert response.box.name == "Box1 new"
+
+    response = await box_service.delete_box(id=box1.id)
+    assert response.status == RequestStatus.OK
+    response = await box_service.get_box(id=box1.id)
+    assert response.status == RequestStatus.ERROR
+    assert box_service.box_cache.stats()["size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_batch_get_boxes(box_service):
+    # create some boxes first
+    for id in range(1, 4):
+        response = await box_service.create_box(box=Box(name=f'Box{id}', id=id))
+        assert response.status == RequestStatus.OK
+
+    # warm the cache for one of them
+    response = await box_service.get_box(id=2)
+    assert response.status == RequestStatus.OK
+
+    # results come back in request order, with a marker for the missing id
+    response = await box_service.batch_get_boxes(ids=[3, 9999999, 1, 2, 3])
+    assert response.status == RequestStatus.OK
+    assert [result.status for result in response.results] == [
+        RequestStatus.OK,
+        RequestStatus.ERROR,
+        RequestStatus.OK,
+        RequestStatus.OK,
+        RequestStatus.OK,
+    ]
+    assert [result.box.id for result in response.results if result.box] == [3, 1, 2, 3]
+    assert response.results[1].box is None
+
+    response = await box_service.batch_get_boxes(
+        ids=[1, 2], field_mask=FieldMask(paths=["name"])
+    )
+    assert [result.box.name for result in response.results] == ["Box1", "Box2"]
+    assert [result.box.id for result in response.results] == [0, 0]
+
+    response = await box_service.batch_get_boxes(ids=[])
+    assert response.status == RequestStatus.OK
+    assert response.results == []
+
+    #clean up
+    for id in range(1, 4):
+        response = await box_service.delete_box(id=id)
+        assert response.status == RequestStatus.OK
+
+
+@pytest.mark.asyncio
+async def test_bulk_create_boxes(box_service):
+    box_service.bulk_batch_size = 2
+    response = await box_service.create_box(box=Box(name='Box2', id=2))
+    assert response.status == RequestStatus.OK
+
+    async def requests(ids):
+        for id in ids:
+            yield CreateBoxRequest(box=Box(name=f'Box{id} new', id=id))
+
+    # duplicates are reported one by one and the rest still gets inserted
+    response = await box_service.bulk_create_boxes(
+        request_iterator=requests([1, 2, 3, 4, 4, 5])
+    )
+    assert response.status == RequestStatus.ERROR
+    assert response.inserted_count == 4
+    assert [(failure.index, failure.id) for failure in response.failures] == [
+        (1, 2),
+        (4, 4),
+    ]
+
+    response = await box_service.get_boxes()
+    assert sorted(box.id for box in response.box) == [1, 2, 3, 4, 5]
+    # the default created_at is set like in create_box
+    assert all(box.created_at for box in response.box)
+
+    response = await box_service.bulk_create_boxes(request_iterator=requests([6]))
+    assert response.status == RequestStatus.OK
+    assert response.inserted_count == 1
+
+    #clean up
+    for id in range(1, 7):
+        response = await box_service.delete_box(id=id)
+        assert response.status == RequestStatus.OK
+
+
+@pytest.mark.asyncio
+async def test_bulk_update_boxes(box_service):
+    # create some boxes first
+    for id in range(1, 5):
+        response = await box_service.create_box(
+            box=Box(name=f'Box{id}', id=id, price=10, category="TEST_CATEGORY_1")
+        )
+        assert response.status == RequestStatus.OK
+    response = await box_service.create_box(
+        box=Box(name='Box5', id=5, price=10, category="TEST_CATEGORY_2")
+    )
+    assert response.status == RequestStatus.OK
+    # cache one of them to see it is invalidated
+    response = await box_service.get_box(id=1)
+    assert response.box.price == 10
+
+    response = await box_service.bulk_update_boxes(
+        box=[
+            Box(name='Box1 new', id=1, price=20, category="TEST_CATEGORY_1"),
+            Box(name='Box2 new', id=2, price=20, category="TEST_CATEGORY_1"),
+            Box(name='Box999999', id=999999),
+        ]
+    )
+    assert response.status == RequestStatus.OK
+    assert response.matched_count == 2
+    assert response.modified_count == 2
+    response = await box_service.get_box(id=1)
+    assert response.box.name == "Box1 new"
+
+    # a box given twice is written once, the last one wins
+    response = await box_service.bulk_update_boxes(
+        box=[
+            Box(name='Box3 old', id=3, price=15, category="TEST_CATEGORY_1"),
+            Box(name='Box3 new', id=3, price=25, category="TEST_CATEGORY_1"),
+        ]
+    )
+    assert response.status == RequestStatus.OK
+    assert response.matched_count == 1
+    response = await box_service.get_box(id=3)
+    assert response.box.name == "Box3 new"
+    response = await box_service.get_category_summary(categories=["TEST_CATEGORY_1"])
+    assert summary_rows(response) == [("TEST_CATEGORY_1", 4, 0, 75)]
+
+    # only the masked fields are changed across the category
+    response = await box_service.update_boxes_in_category(
+        category="TEST_CATEGORY_1",
+        box=Box(price=30, quantity=5),
+        field_mask=FieldMask(paths=["price"]),
+    )
+    assert response.status == RequestStatus.OK
+    assert response.matched_count == 4
+    assert response.modified_count == 4
+    response = await box_service.get_boxes_in_category(category="TEST_CATEGORY_1")
+    assert {box.price for box in response.box} == {30}
+    assert {box.quantity for box in response.box} == {0}
+    response = await box_service.get_box(id=1)
+    assert response.box.price == 30
+    response = await box_service.get_box(id=5)
+    assert response.box.price == 10
+
+    # a category update needs a mask without the id
+    response = await box_service.update_boxes_in_category(
+        category="TEST_CATEGORY_1", box=Box(price=40), field_mask=FieldMask()
+    )
+    assert response.status == RequestStatus.ERROR
+    response = await box_service.update_boxes_in_category(
+        category="TEST_CATEGORY_1",
+        box=Box(price=40),
+        field_mask=FieldMask(paths=["id", "price"]),
+    )
+    assert response.status == RequestStatus.ERROR
+
+    #clean up
+    response = await box_service.bulk_delete_boxes(ids=list(range(1, 6)))
+    assert response.status == RequestStatus.OK
+    assert response.deleted_count == 5
+
+
+@pytest.mark.asyncio
+async def test_bulk_writes_racing_box_writes(box_service, monkeypatch):
+    # Single box writes landing right before a bulk write's own write to the
+    # same box are counted once in the summaries
+    for id in range(1, 5):
+        response = await box_service.create_box(
+            box=Box(
+                name=f"Box{id}", id=id, price=10, quantity=1, category="TEST_CATEGORY_1"
+            )
+        )
+        assert response.status == RequestStatus.OK
+
+    boxes = box_service.boxes
+    find_one_and_update = boxes.find_one_and_update
+    find_one_and_delete = boxes.find_one_and_delete
+    races = {
+        ("update", 1): lambda: box_service.delete_box(id=1),
+        ("update", 2): lambda: box_service.update_box(
+            box=Box(name="Box2", id=2, price=10, quantity=1, category="TEST_CATEGORY_2")
+        ),
+        ("delete", 3): lambda: box_service.update_box(
+            box=Box(name="Box3", id=3, price=5, quantity=1, category="TEST_CATEGORY_2")
+        ),
+        ("delete", 4): lambda: box_service.delete_box(id=4),
+    }
+
+    async def racing_update(filter, *args, **kwargs):
+        race = races.pop(("update", filter["_id"]), None)
+        if race is not None:
+            await race()
+        return await find_one_and_update(filter, *args, **kwargs)
+
+    async def racing_delete(filter, *args, **kwargs):
+        race = races.pop(("delete", filter["_id"]), None)
+        if race is not None:
+            await race()
+        return await find_one_and_delete(filter, *args, **kwargs)
+
+    monkeypatch.setattr(boxes, "find_one_and_update", racing_update)
+    monkeypatch.setattr(boxes, "find_one_and_delete", racing_delete)
+
+    response = await box_service.bulk_update_boxes(
+        box=[
+            Box(
+                name=f"Box{id}", id=id, price=20, quantity=1, category="TEST_CATEGORY_1"
+            )
+            for id in (1, 2, 3)
+        ]
+    )
+    assert response.matched_count == 2
+    response = await box_service.get_category_summary()
+    assert summary_rows(response) == [("TEST_CATEGORY_1", 3, 3, 50)]
+
+    response = await box_service.bulk_delete_boxes(ids=[2, 3, 4])
+    assert response.deleted_count == 2
+    response = await box_service.get_category_summary()
+    assert summary_rows(response) == []
+    assert rebuild_summaries(box_service.boxes_db) == 0
+
+
+@pytest.mark.asyncio
+async def test_wide_writes_racing_box_writes(box_service, monkeypatch):
+    # Boxes written after a category write read its ids are neither written
+    # nor counted by it
+    def make_box(id, category="TEST_CATEGORY_1"):
+        return Box(name=f"Box{id}", id=id, price=10, quantity=1, category=category)
+
+    for id in range(1, 4):
+        response = await box_service.create_box(box=make_box(id))
+        assert response.status == RequestStatus.OK
+
+    boxes = box_service.boxes
+    find = boxes.find
+    races = []
+
+    async def racing_find(*args, **kwargs):
+        documents = await find(*args, **kwargs)
+        while races:
+            await races.pop(0)()
+        return documents
+
+    monkeypatch.setattr(boxes, "find", racing_find)
+
+    async def summaries():
+        rows = summary_rows(await box_service.get_category_summary())
+        # the maintained summaries agree with a rebuild
+        box_service.boxes_db.category_summaries.drop()
+        rebuild_summaries(box_service.boxes_db)
+        assert summary_rows(await box_service.get_category_summary()) == rows
+        return rows
+
+    races += [
+        lambda: box_service.create_box(box=make_box(4)),
+        lambda: box_service.update_box(box=make_box(2, "TEST_CATEGORY_2")),
+    ]
+    response = await box_service.update_boxes_in_category(
+        category="TEST_CATEGORY_1",
+        box=Box(price=30),
+        field_mask=FieldMask(paths=["price"]),
+    )
+    assert response.matched_count == 2
+    assert await summaries() == [
+        ("TEST_CATEGORY_1", 3, 3, 70),
+        ("TEST_CATEGORY_2", 1, 1, 10),
+    ]
+
+    races += [lambda: box_service.create_box(box=make_box(5))]
+    response = await box_service.delete_boxes_in_category(category="TEST_CATEGORY_1")
+    assert response.deleted_count == 3
+    assert await summaries() == [
+        ("TEST_CATEGORY_1", 1, 1, 10),
+        ("TEST_CATEGORY_2", 1, 1, 10),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_bulk_delete_boxes(box_service):
+    # Mongo keeps milliseconds only, leave some room around the range
+    start_time = datetime.utcnow() - timedelta(seconds=1)
+    # create some boxes first
+    for id in range(1, 7):
+        response = await box_service.create_box(
+            box=Box(name=f'Box{id}', id=id, category=f"TEST_CATEGORY_{id % 2}")
+        )
+        assert response.status == RequestStatus.OK
+    end_time = datetime.utcnow() + timedelta(seconds=1)
+
+    response = await box_service.bulk_delete_boxes(ids=[1, 2, 2, 999999])
+    assert response.status == RequestStatus.OK
+    assert response.deleted_count == 2
+
+    response = await box_service.delete_boxes_in_category(category="TEST_CATEGORY_0")
+    assert response.status == RequestStatus.OK
+    assert response.deleted_count == 2
+    response = await box_service.get_box(id=4)
+    assert response.status == RequestStatus.ERROR
+
+    response = await box_service.delete_boxes_in_category(category="TEST_CATEGORY_0")
+    assert response.status == RequestStatus.ERROR
+    assert response.deleted_count == 0
+
+    response = await box_service.delete_boxes_in_time_range(
+        start_time=start_time, end_time=end_time
+    )
+    assert response.status == RequestStatus.OK
+    assert response.deleted_count == 2
+
+    response = await box_service.get_boxes()
+    assert response.box == []
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_lookups_coalesce():
+    collection = SlowCollection(0.2)
+    service = DatabaseService(
+        boxes_db=SimpleNamespace(boxes=collection), box_cache=LRUCache(maxsize=0)
+    )
+
+    responses = await asyncio.gather(
+        *(service.get_box(id=id) for id in [1] * 10 + [2] * 5)
+    )
+
+    assert [response.box.id for response in responses] == [1] * 10 + [2] * 5
+    # one query per distinct id, everybody else waited for it
+    assert collection.lookups == 2
+    assert service.flights.stats() == {"in_flight": 0, "calls": 15, "coalesced": 13}
+
+    # a later call runs its own query again
+    await service.get_box(id=1)
+    assert collection.lookups == 3
+    service.executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_rpc_list_responses_match_direct_calls(box_service):
+    # Over gRPC the list RPCs encode their boxes straight from raw BSON,
+    # the bytes on the wire have to be the same as for the Box objects
+    created_at = datetime.now(timezone.utc).replace(microsecond=0)
+    for id in range(1, 6):
+        response = await box_service.create_box(
+            box=Box(
+                name=f"Box{id}",
+                id=id,
+                price=id * 10,
+                description="A long description",
+                category=f"TEST_CATEGORY_{id % 2}",
+                quantity=id,
+                created_at=created_at + timedelta(seconds=id),
+            )
+        )
+        assert response.status == RequestStatus.OK
+    start_time = created_at
+    end_time = created_at + timedelta(seconds=10)
+    field_mask = FieldMask(paths=["id", "created_at"])
+
+    async with ChannelFor([box_service]) as channel:
+        stub = DatabaseServiceStub(channel)
+        for method, kwargs in [
+            ("get_boxes", {}),
+            ("get_boxes", {"page_size": 2}),
+            ("get_boxes_in_category", {"category": "TEST_CATEGORY_1"}),
+            (
+                "get_boxes_in_category",
+                {"category": "TEST_CATEGORY_1", "page_size": 2},
+            ),
+            (
+                "get_boxes_in_time_range",
+                {"start_time": start_time, "end_time": end_time},
+            ),
+            (
+                "get_boxes_in_time_range",
+                {
+                    "start_time": start_time,
+                    "end_time": end_time,
+                    "page_size": 3,
+                    "field_mask": field_mask,
+                },
+            ),
+            (
+                "query_boxes",
+                {"categories": ["TEST_CATEGORY_1"], "min_price": 20},
+            ),
+        ]:
+            response = await getattr(stub, method)(**kwargs)
+            expected = await getattr(box_service, method)(**kwargs)
+            assert bytes(response) == bytes(expected)
+            assert len(response.box) == len(expected.box) > 0
+
+        chunks = [
+            chunk
+            async for chunk in stub.stream_boxes_in_time_range(
+                start_time=start_time,
+                end_time=end_time,
+                page_size=2,
+                field_mask=field_mask,
+            )
+        ]
+        expected = [
+            chunk
+            async for chunk in box_service.stream_boxes_in_time_range(
+                start_time=start_time,
+                end_time=end_time,
+                page_size=2,
+                field_mask=field_mask,
+            )
+        ]
+        assert [bytes(chunk) for chunk in chunks] == [
+            bytes(chunk) for chunk in expected
+        ]
+        assert [len(chunk.box) for chunk in chunks] == [2, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_query_boxes(box_service):
+    created_at = datetime.utcnow().replace(microsecond=0)
+    for id in range(1, 9):
+        response = await box_service.create_box(
+            box=Box(
+                name=f"Box{id}",
+                id=id,
+                # prices go down as ids go up
+                price=100 - id * 10,
+                category=f"TEST_CATEGORY_{id % 2}",
+                created_at=created_at + timedelta(days=id),
+            )
+        )
+        assert response.status == RequestStatus.OK
+
+    # category and time range combined, ordered by created_at
+    response = await box_service.query_boxes(
+        categories=["TEST_CATEGORY_1"],
+        start_time=created_at + timedelta(days=2),
+        end_time=created_at + timedelta(days=7),
+    )
+    assert response.status == RequestStatus.OK
+    assert [box.id for box in response.box] == [3, 5, 7]
+
+    # several categories and a price range, ordered by price and paged
+    response = await box_service.query_boxes(
+        categories=["TEST_CATEGORY_0", "TEST_CATEGORY_1"],
+        min_price=30,
+        max_price=80,
+        page_size=4,
+    )
+    assert [box.price for box in response.box] == [30, 40, 50, 60]
+    response = await box_service.query_boxes(
+        categories=["TEST_CATEGORY_0", "TEST_CATEGORY_1"],
+        min_price=30,
+        max_price=80,
+        page_size=4,
+        page_token=response.next_page_token,
+    )
+    assert [box.price for box in response.box] == [70, 80]
+    assert response.next_page_token == ""
+
+    # an explicit sort wins over the ranged field
+    response = await box_service.query_boxes(
+        start_time=created_at + timedelta(days=5),
+        max_price=40,
+        sort=QuerySort.SORT_BY_ID,
+        field_mask=FieldMask(paths=["id"]),
+    )
+    assert [box.id for box in response.box] == [6, 7, 8]
+
+    # inverted ranges are an error
+    response = await box_service.query_boxes(min_price=50, max_price=10)
+    assert response.status == RequestStatus.ERROR
+
+
+@pytest.mark.asyncio
+async def test_category_stats(box_service):
+    # no boxes, no categories
+    response = await box_service.list_categories()
+    assert response.status == RequestStatus.OK
+    assert response.categories == []
+
+    for id, (category, price, quantity) in enumerate(
+        [
+            ("TEST_CATEGORY_1", 10, 1),
+            ("TEST_CATEGORY_1", 30, 2),
+            ("TEST_CATEGORY_2", 5, 7),
+        ],
+        start=1,
+    ):
+        response = await box_service.create_box(
+            box=Box(
+                name=f"Box{id}",
+                id=id,
+                price=price,
+                quantity=quantity,
+                category=category,
+            )
+        )
+        assert response.status == RequestStatus.OK
+
+    response = await box_service.list_categories()
+    assert [
+        (category.category, category.count) for category in response.categories
+    ] == [("TEST_CATEGORY_1", 2), ("TEST_CATEGORY_2", 1)]
+
+    response = await box_service.get_category_stats()
+    assert response.status == RequestStatus.OK
+    stats = response.stats[0]
+    assert stats.category == "TEST_CATEGORY_1"
+    assert stats.count == 2
+    assert stats.total_quantity == 3
+    assert (stats.min_price, stats.max_price, stats.avg_price) == (10, 30, 20.0)
+    assert [stats.category for stats in response.stats] == [
+        "TEST_CATEGORY_1",
+        "TEST_CATEGORY_2",
+    ]
+
+    # requested categories without boxes are reported empty
+    response = await box_service.get_category_stats(
+        categories=["TEST_CATEGORY_2", "TEST_CATEGORY_3"]
+    )
+    assert [(stats.category, stats.count) for stats in response.stats] == [
+        ("TEST_CATEGORY_2", 1),
+        ("TEST_CATEGORY_3", 0),
+    ]
+    assert response.stats[0].total_quantity == 7
+
+
+def summary_rows(response):
+    return [
+        (summary.category, summary.count, summary.total_quantity, summary.total_price)
+        for summary in response.summaries
+    ]
+
+
+@pytest.mark.asyncio
+async def test_category_summary(box_service):
+    response = await box_service.get_category_summary()
+    assert response.status == RequestStatus.OK
+    assert response.summaries == []
+
+    for id, (category, price, quantity) in enumerate(
+        [
+            ("TEST_CATEGORY_1", 10, 1),
+            ("TEST_CATEGORY_1", 30, 2),
+            ("TEST_CATEGORY_2", 5, 7),
+        ],
+        start=1,
+    ):
+        response = await box_service.create_box(
+            box=Box(
+                name=f"Box{id}",
+                id=id,
+                price=price,
+                quantity=quantity,
+                category=category,
+            )
+        )
+        assert response.status == RequestStatus.OK
+    # a duplicate isn't counted
+    response = await box_service.create_box(
+        box=Box(name="Box1", id=1, price=99, category="TEST_CATEGORY_1")
+    )
+    assert response.status == RequestStatus.ERROR
+
+    response = await box_service.get_category_summary()
+    assert summary_rows(response) == [
+        ("TEST_CATEGORY_1", 2, 3, 40),
+        ("TEST_CATEGORY_2", 1, 7, 5),
+    ]
+
+    # moving a box to another category moves its totals along
+    response = await box_service.update_box(
+        box=Box(name="Box2", id=2, price=50, quantity=4, category="TEST_CATEGORY_2")
+    )
+    assert response.status == RequestStatus.OK
+    response = await box_service.get_category_summary(
+        categories=["TEST_CATEGORY_2", "TEST_CATEGORY_1", "TEST_CATEGORY_3"]
+    )
+    assert summary_rows(response) == [
+        ("TEST_CATEGORY_1", 1, 1, 10),
+        ("TEST_CATEGORY_2", 2, 11, 55),
+        ("TEST_CATEGORY_3", 0, 0, 0),
+    ]
+
+    # unchanged and missing boxes leave the totals alone
+    response = await box_service.update_box(
+        box=Box(name="Box2", id=2, price=50, quantity=4, category="TEST_CATEGORY_2")
+    )
+    assert response.status == RequestStatus.ERROR
+    response = await box_service.update_box(box=Box(name="Box999999", id=999999))
+    assert response.status == RequestStatus.ERROR
+
+    response = await box_service.delete_box(id=1)
+    assert response.status == RequestStatus.OK
+    response = await box_service.get_category_summary()
+    assert summary_rows(response) == [("TEST_CATEGORY_2", 2, 11, 55)]
+
+    async def requests(ids):
+        for id in ids:
+            yield CreateBoxRequest(
+                box=Box(name=f"Box{id}", id=id, price=1, category="TEST_CATEGORY_3")
+            )
+
+    response = await box_service.bulk_create_boxes(
+        request_iterator=requests([2, 4, 5, 6])
+    )
+    assert response.inserted_count == 3
+    response = await box_service.bulk_update_boxes(
+        box=[
+            Box(name="Box3", id=3, price=5, quantity=7, category="TEST_CATEGORY_3"),
+            Box(name="Box4", id=4, price=2, category="TEST_CATEGORY_3"),
+        ]
+    )
+    assert response.matched_count == 2
+    response = await box_service.bulk_delete_boxes(ids=[5, 5, 999999])
+    assert response.deleted_count == 1
+    response = await box_service.get_category_summary()
+    assert summary_rows(response) == [
+        ("TEST_CATEGORY_2", 1, 4, 50),
+        ("TEST_CATEGORY_3", 3, 7, 8),
+    ]
+
+    # category wide writes move the totals of the boxes they match
+    response = await box_service.update_boxes_in_category(
+        category="TEST_CATEGORY_3",
+        box=Box(category="TEST_CATEGORY_2"),
+        field_mask=FieldMask(paths=["category"]),
+    )
+    assert response.modified_count == 3
+    response = await box_service.get_category_summary()
+    assert summary_rows(response) == [("TEST_CATEGORY_2", 4, 11, 58)]
+    response = await box_service.update_boxes_in_category(
+        category="TEST_CATEGORY_2",
+        box=Box(price=3),
+        field_mask=FieldMask(paths=["price"]),
+    )
+    assert response.matched_count == 4
+    response = await box_service.get_category_summary()
+    assert summary_rows(response) == [("TEST_CATEGORY_2", 4, 11, 12)]
+
+    # the rebuild agrees with the maintained summaries
+    expected = summary_rows(await box_service.get_category_summary())
+    box_service.boxes_db.category_summaries.drop()
+    assert rebuild_summaries(box_service.boxes_db) == 1
+    assert summary_rows(await box_service.get_category_summary()) == expected
+
+    response = await box_service.delete_boxes_in_category(category="TEST_CATEGORY_2")
+    assert response.deleted_count == 4
+    response = await box_service.get_category_summary()
+    assert response.summaries == []
+
+
+def histogram_rows(response):
+    return [
+        (bucket.start_time.strftime("%Y-%m-%d %H:%M"), bucket.count)
+        for bucket in response.buckets
+    ]
+
+
+@pytest.mark.asyncio
+async def test_creation_histogram(box_service):
+    day = datetime(2022, 7, 1, tzinfo=timezone.utc)
+    boxes = [
+        (1, "TEST_CATEGORY_1", day + timedelta(hours=1, minutes=5, seconds=1)),
+        (2, "TEST_CATEGORY_1", day + timedelta(hours=1, minutes=5, seconds=59)),
+        (3, "TEST_CATEGORY_2", day + timedelta(hours=1, minutes=30)),
+        (4, "TEST_CATEGORY_1", day + timedelta(hours=3)),
+        (5, "TEST_CATEGORY_2", day + timedelta(days=2, hours=12)),
+    ]
+    for id, category, created_at in boxes[:3]:
+        response = await box_service.create_box(
+            box=Box(name=f"Box{id}", id=id, category=category, created_at=created_at)
+        )
+        assert response.status == RequestStatus.OK
+
+    async def requests():
+        for id, category, created_at in boxes[3:]:
+            yield CreateBoxRequest(
+                box=Box(
+                    name=f"Box{id}", id=id, category=category, created_at=created_at
+                )
+            )
+
+    response = await box_service.bulk_create_boxes(request_iterator=requests())
+    assert response.inserted_count == 2
+
+    async def histogram(bucket, category="", start=day, end=day + timedelta(days=7)):
+        response = await box_service.get_creation_histogram(
+            start_time=start, end_time=end, bucket=bucket, category=category
+        )
+        assert response.status == RequestStatus.OK
+        return histogram_rows(response)
+
+    assert await histogram(HistogramBucket.BUCKET_DAY) == [
+        ("2022-07-01 00:00", 4),
+        ("2022-07-03 00:00", 1),
+    ]
+    assert await histogram(HistogramBucket.BUCKET_HOUR, "TEST_CATEGORY_1") == [
+        ("2022-07-01 01:00", 2),
+        ("2022-07-01 03:00", 1),
+    ]
+    assert await histogram(HistogramBucket.BUCKET_MINUTE) == [
+        ("2022-07-01 01:05", 2),
+        ("2022-07-01 01:30", 1),
+        ("2022-07-01 03:00", 1),
+        ("2022-07-03 12:00", 1),
+    ]
+    # buckets starting before the range count when they overlap it
+    assert await histogram(
+        HistogramBucket.BUCKET_HOUR,
+        start=day + timedelta(hours=1, minutes=20),
+        end=day + timedelta(hours=2),
+    ) == [("2022-07-01 01:00", 3)]
+
+    # moving and deleting boxes moves their counts along
+    response = await box_service.update_box(
+        box=Box(name="Box2", id=2, category="TEST_CATEGORY_2", created_at=boxes[1][2])
+    )
+    assert response.status == RequestStatus.OK
+    response = await box_service.delete_box(id=4)
+    assert response.status == RequestStatus.OK
+    assert await histogram(HistogramBucket.BUCKET_HOUR, "TEST_CATEGORY_1") == [
+        ("2022-07-01 01:00", 1)
+    ]
+    assert await histogram(HistogramBucket.BUCKET_HOUR, "TEST_CATEGORY_2") == [
+        ("2022-07-01 01:00", 2),
+        ("2022-07-03 12:00", 1),
+    ]
+
+    # time range writes move the buckets along, which agree with a rebuild
+    response = await box_service.delete_boxes_in_time_range(
+        start_time=day + timedelta(days=2), end_time=day + timedelta(days=3)
+    )
+    assert response.deleted_count == 1
+    expected = await histogram(HistogramBucket.BUCKET_MINUTE)
+    assert expected == [("2022-07-01 01:05", 2), ("2022-07-01 01:30", 1)]
+    box_service.boxes_db.creation_buckets.drop()
+    # by category: 3 minutes, 2 hours and 2 days
+    assert rebuild_buckets(box_service.boxes_db) == 7
+    assert await histogram(HistogramBucket.BUCKET_MINUTE) == expected
+    # rebuilding over the buckets replaces them and drops stale ones
+    box_service.boxes_db.creation_buckets.insert_one(
+        {
+            "unit": "day",
+            "category": "TEST_CATEGORY_1",
+            "start": datetime(2022, 7, 5),
+            "count": 3,
+        }
+    )
+    assert rebuild_buckets(box_service.boxes_db, ["TEST_CATEGORY_1"]) == 3
+    assert await histogram(HistogramBucket.BUCKET_DAY) == [("2022-07-01 00:00", 3)]
+
+    response = await box_service.update_boxes_in_category(
+        category="TEST_CATEGORY_2",
+        box=Box(created_at=day + timedelta(hours=5)),
+        field_mask=FieldMask(paths=["created_at"]),
+    )
+    assert response.modified_count == 2
+    assert await histogram(HistogramBucket.BUCKET_MINUTE) == [
+        ("2022-07-01 01:05", 1),
+        ("2022-07-01 05:00", 2),
+    ]
+
+    response = await box_service.get_creation_histogram(
+        start_time=day + timedelta(days=1),
+        end_time=day,
+        bucket=HistogramBucket.BUCKET_DAY,
+        category="",
+    )
+    assert response.status == RequestStatus.ERROR
+
+
+@pytest.mark.asyncio
+async def test_search_boxes(box_service):
+    for id, name, description, category in [
+        (1, "Red shoe box", "Sturdy cardboard", "TEST_CATEGORY_1"),
+        (2, "Moving box", "Holds red wine glasses", "TEST_CATEGORY_1"),
+        (3, "Wine crate", "Wooden, for six bottles", "TEST_CATEGORY_2"),
+        (4, "Red gift box", "Wrapped", "TEST_CATEGORY_2"),
+    ]:
+        response = await box_service.create_box(
+            box=Box(
+                name=name,
+                id=id,
+                description=description,
+                category=category,
+            )
+        )
+        assert response.status == RequestStatus.OK
+
+    async def search(query, category="", limit=0, field_mask=None):
+        response = await box_service.search_boxes(
+            query=query, category=category, limit=limit, field_mask=field_mask
+        )
+        assert response.status == RequestStatus.OK
+        return response.results
+
+    # matches in the name rank above the ones in the description
+    results = await search("red")
+    assert [result.box.id for result in results] == [1, 4, 2]
+    assert results[0].score > results[2].score > 0
+    assert results[0].box.description == "Sturdy cardboard"
+
+    results = await search("wine", category="TEST_CATEGORY_1")
+    assert [result.box.id for result in results] == [2]
+    results = await search("red", limit=1, field_mask=FieldMask(paths=["name"]))
+    assert [result.box.name for result in results] == ["Red shoe box"]
+    assert results[0].box.id == 0
+    assert await search("velvet") == []
+
+    response = await box_service.search_boxes(query=" ", category="", limit=0)
+    assert response.status == RequestStatus.ERROR
+
+
+@pytest.mark.asyncio
+async def test_reads_are_routed_by_read_preference():
+    boxes_db, mongo_client = get_test_database()
+    read_preference = SecondaryPreferred(max_staleness=90)
+    service = DatabaseService(boxes_db=boxes_db, read_preference=read_preference)
+    try:
+        assert service.boxes.collection.read_preference == Primary()
+        assert service.reads.collection.read_preference == read_preference
+        assert service.raw_boxes.collection.read_preference == read_preference
+        # a lagging secondary would fill the box cache with stale boxes
+        assert service.box_cache.maxsize == 0
+
+        response = await service.create_box(box=Box(name="Box1", id=1))
+        assert response.status == RequestStatus.OK
+        response = await service.get_box(id=1)
+        assert response.box.name == "Box1"
+        response = await service.get_boxes()
+        assert [box.id for box in response.box] == [1]
+    finally:
+        mongo_client.drop_database(boxes_db)
+
+
+def test_box_cache_with_read_preference():
+    boxes_db, mongo_client = get_test_database()
+    try:
+        service = DatabaseService(boxes_db=boxes_db, read_preference=Primary())
+        assert service.box_cache.maxsize > 0
+        # secondaries are only read once they caught up with this process
+        service = DatabaseService(
+            boxes_db=boxes_db,
+            read_preference=SecondaryPreferred(max_staleness=90),
+            read_your_writes=True,
+        )
+        assert service.box_cache.maxsize > 0
+        # a cache given explicitly is used as it is
+        box_cache = LRUCache(maxsize=10)
+        service = DatabaseService(
+            boxes_db=boxes_db,
+            box_cache=box_cache,
+            read_preference=SecondaryPreferred(max_staleness=90),
+        )
+        assert service.box_cache is box_cache
+    finally:
+        mongo_client.drop_database(boxes_db)
+
+
+# e.g. mongodb://localhost:27021,localhost:27022,localhost:27023/?replicaSet=rs0,
+# see server/replica_set.sh
+REPLICA_SET_URI = os.environ.get("TEST_REPLICA_SET_URI")
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not REPLICA_SET_URI, reason="needs TEST_REPLICA_SET_URI")
+async def test_read_your_writes_on_secondaries():
+    mongo_client = MongoClient(REPLICA_SET_URI)
+    boxes_db = mongo_client.boxes_read_your_writes
+    service = DatabaseService(
+        boxes_db=boxes_db,
+        box_cache=LRUCache(maxsize=0),
+        read_preference=SecondaryPreferred(max_staleness=90),
+        read_your_writes=True,
+    )
+    try:
+        # every read right after a write sees it, although it goes to
+        # a secondary which may not have replicated it yet
+        for id in range(1, 51):
+            response = await service.create_box(box=Box(name=f"Box{id}", id=id))
+            assert response.status == RequestStatus.OK
+            response = await service.get_box(id=id)
+            assert response.status == RequestStatus.OK
+            response = await service.update_box(
+                box=Box(name=f"Box{id} new", id=id, price=id)
+            )
+            assert response.status == RequestStatus.OK
+            response = await service.get_boxes_in_category(category="")
+            assert len(response.box) == id
+            assert response.box[-1].price == id
+    finally:
+        mongo_client.drop_database(boxes_db)
@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+
+from server.singleflight import (
+    SINGLEFLIGHT_CALLS,
+    SINGLEFLIGHT_COALESCED,
+    SingleFlight,
+)
+
+
+@pytest.mark.asyncio
+async def test_errors_are_shared():
+    flights = SingleFlight()
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise ValueError("Box not found")
+
+    before = SINGLEFLIGHT_CALLS.value(), SINGLEFLIGHT_COALESCED.value()
+    results = await asyncio.gather(
+        flights.do("key", failing), flights.do("key", failing), return_exceptions=True
+    )
+    assert calls == 1
+    assert SINGLEFLIGHT_CALLS.value() - before[0] == 2
+    assert SINGLEFLIGHT_COALESCED.value() - before[1] == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(flights) == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_flight():
+    flights = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "Box1"
+
+    first = asyncio.ensure_future(flights.do("key", slow))
+    second = asyncio.ensure_future(flights.do("key", slow))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    assert await second == "Box1"
+    assert flights.coalesced == 1
+
+
+@pytest.mark.asyncio
+async def test_forget_all_starts_new_flight():
+    flights = SingleFlight()
+    calls = 0
+
+    async def counted():
+        nonlocal calls
+        calls += 1
+        call = calls
+        await asyncio.sleep(0.01)
+        return call
+
+    first = asyncio.ensure_future(flights.do("key", counted))
+    await asyncio.sleep(0)
+    # e.g. a write happened, later readers must not join the earlier read
+    flights.forget_all()
+    second = asyncio.ensure_future(flights.do("key", counted))
+
+    assert await first == 1
+    assert await second == 2
+    assert flights.coalesced == 0
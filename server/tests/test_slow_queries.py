@@ -0,0 +1,151 @@
+import logging
+
+from server.slow_queries import SlowQueryRecorder, query_shape, summarize_explain
+
+INDEX_EXPLAIN = {
+    "queryPlanner": {
+        "winningPlan": {
+            "stage": "LIMIT",
+            "inputStage": {
+                "stage": "FETCH",
+                "inputStage": {
+                    "stage": "IXSCAN",
+                    "indexName": "category_id_index",
+                    "keyPattern": {"category": 1, "_id": 1},
+                },
+            },
+        }
+    },
+    "executionStats": {
+        "nReturned": 10,
+        "executionTimeMillis": 3,
+        "totalKeysExamined": 10,
+        "totalDocsExamined": 10,
+    },
+}
+# Mongo 5+ with the slot based engine
+SCAN_EXPLAIN = {
+    "queryPlanner": {
+        "winningPlan": {
+            "queryPlan": {
+                "stage": "SORT",
+                "inputStage": {"stage": "COLLSCAN", "direction": "forward"},
+            },
+            "slotBasedPlan": {"slots": "..."},
+        }
+    },
+    "executionStats": {
+        "nReturned": 10,
+        "executionTimeMillis": 250,
+        "totalKeysExamined": 0,
+        "totalDocsExamined": 100000,
+    },
+}
+OR_EXPLAIN = {
+    "queryPlanner": {
+        "winningPlan": {
+            "stage": "FETCH",
+            "inputStage": {
+                "stage": "OR",
+                "inputStages": [
+                    {"stage": "IXSCAN", "indexName": "price_id_index"},
+                    {"stage": "IXSCAN", "indexName": "created_at_id_index"},
+                ],
+            },
+        }
+    }
+}
+
+
+def test_summarize_explain():
+    assert summarize_explain(INDEX_EXPLAIN) == {
+        "plan": "LIMIT > FETCH > IXSCAN",
+        "indexes": ["category_id_index"],
+        "collection_scan": False,
+        "keys_examined": 10,
+        "docs_examined": 10,
+        "returned": 10,
+        "millis": 3,
+    }
+
+    summary = summarize_explain(SCAN_EXPLAIN)
+    assert summary["plan"] == "SORT > COLLSCAN"
+    assert summary["collection_scan"]
+    assert summary["docs_examined"] == 100000
+
+    summary = summarize_explain(OR_EXPLAIN)
+    assert summary["plan"] == "FETCH > OR > IXSCAN > IXSCAN"
+    assert summary["indexes"] == ["price_id_index", "created_at_id_index"]
+    assert summary["keys_examined"] is None
+
+
+def test_query_shape():
+    assert query_shape(
+        {"category": "A", "created_at": {"$gte": 1, "$lte": 2}, "_id": {"$in": [1, 2]}}
+    ) == {"category": 1, "created_at": {"$gte": 1, "$lte": 1}, "_id": {"$in": 1}}
+    assert query_shape({"$or": [{"a": 1}, {"b": {"$gt": 2}}]}) == {
+        "$or": [{"a": 1}, {"b": {"$gt": 1}}]
+    }
+
+
+def test_slow_query_recorder(caplog):
+    explains = []
+
+    def explain():
+        explains.append(1)
+        return SCAN_EXPLAIN
+
+    recorder = SlowQueryRecorder(threshold_ms=100, explain_rate=1, explain_interval=60)
+    recorder.record("boxes", "find", 0.05, 10, {"category": "A"}, explain=explain)
+    assert recorder.slowest() == []
+    assert explains == []
+
+    caplog.set_level(logging.WARNING)
+    for category, seconds in [("A", 0.2), ("B", 0.3)]:
+        recorder.record(
+            "boxes",
+            "find",
+            seconds,
+            10,
+            {"category": category},
+            {"sort": [("_id", 1)], "limit": 10, "hint": None},
+            explain=explain,
+        )
+    # the same shape is explained once per interval
+    assert explains == [1]
+    slowest = recorder.slowest()
+    assert [entry["millis"] for entry in slowest] == [300.0, 200.0]
+    assert slowest[1]["filter"] == "{'category': 'A'}"
+    assert slowest[1]["options"] == {"sort": [("_id", 1)], "limit": 10}
+    assert slowest[1]["explain"]["collection_scan"]
+    assert slowest[0]["explain"] is None
+    assert "Slow query: collection=boxes, operation=find, millis=200.0" in caplog.text
+    assert "plan=SORT > COLLSCAN" in caplog.text
+
+    # another shape gets its own explain, and a disabled recorder logs nothing
+    recorder.record("boxes", "find", 0.2, 0, {"price": {"$gte": 1}}, explain=explain)
+    assert explains == [1, 1]
+    recorder = SlowQueryRecorder(threshold_ms=0)
+    recorder.record("boxes", "find", 10, 0, {}, explain=explain)
+    assert recorder.slowest() == []
+
+
+def test_slow_query_explain_sampling():
+    explains = []
+    recorder = SlowQueryRecorder(threshold_ms=1, explain_rate=0, explain_interval=0)
+    for _ in range(10):
+        recorder.record(
+            "boxes", "find", 1, 0, {}, explain=lambda: explains.append(1) or {}
+        )
+    assert explains == []
+    assert len(recorder.slowest(count=5)) == 5
+
+
+def test_slow_query_explain_errors_are_logged(caplog):
+    def explain():
+        raise NotImplementedError("explain")
+
+    recorder = SlowQueryRecorder(threshold_ms=1, explain_rate=1, explain_interval=0)
+    recorder.record("boxes", "find", 1, 0, {}, explain=explain)
+    assert recorder.slowest()[0]["explain"] is None
+    assert "Slow query explain failed" in caplog.text
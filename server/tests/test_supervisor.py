@@ -0,0 +1,71 @@
+import signal
+import sys
+import threading
+import time
+
+from server.supervisor import Supervisor
+
+
+def exiting_worker(worker):
+    sys.exit(3)
+
+
+def sleeping_worker(worker):
+    time.sleep(60)
+
+
+class CountingSupervisor(Supervisor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.starts = []
+
+    def start_worker(self, worker):
+        self.starts.append(worker)
+        super().start_worker(worker)
+
+
+def test_crashed_workers_are_restarted():
+    supervisor = CountingSupervisor(
+        exiting_worker,
+        2,
+        shutdown_timeout=5,
+        restart_min_uptime=60,
+        restart_max_delay=0.2,
+    )
+    for worker in range(2):
+        supervisor.start_worker(worker)
+    for process in supervisor.processes.values():
+        process.join(10)
+        assert process.exitcode == 3
+
+    # died right after starting, so they come back after a pause
+    supervisor.check_workers()
+    assert sorted(supervisor.restarts) == [0, 1]
+    assert supervisor.delays == {0: 0.2, 1: 0.2}
+    assert supervisor.starts == [0, 1]
+    time.sleep(0.3)
+    supervisor.check_workers()
+    assert supervisor.restarts == {}
+    assert supervisor.starts == [0, 1, 0, 1]
+    supervisor.shutdown()
+
+
+def test_workers_are_stopped():
+    supervisor = CountingSupervisor(sleeping_worker, 2, shutdown_timeout=5)
+    previous_handlers = {
+        signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+    timer = threading.Timer(2, supervisor.stop, args=(signal.SIGTERM,))
+    timer.start()
+    try:
+        supervisor.run()
+    finally:
+        timer.cancel()
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    assert supervisor.starts == [0, 1]
+    assert [process.exitcode for process in supervisor.processes.values()] == [
+        -signal.SIGTERM,
+        -signal.SIGTERM,
+    ]
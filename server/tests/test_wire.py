@@ -0,0 +1,88 @@
+import time
+from datetime import datetime
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+from server.codec import documents_to_boxes
+from server.db import GetBoxesResponse, RequestStatus
+from server.wire import EncodedBoxesResponse, encode_boxes
+
+DOCUMENTS = [
+    {
+        "_id": 1,
+        "name": "Box1",
+        "price": 10,
+        "description": "A long description",
+        "category": "TEST_CATEGORY_1",
+        "quantity": 3,
+        "created_at": datetime(2022, 7, 1, 12, 30, 15, 123000),
+    },
+    # defaults, negative numbers, unicode and int64 values
+    {"_id": 2, "name": "", "price": -5, "quantity": 2**40, "category": "ÜNÏ 📦"},
+    # unset and pre-epoch timestamps
+    {"_id": 3, "created_at": None},
+    {"_id": 4, "created_at": datetime(1969, 12, 31, 23, 59, 58, 500000)},
+    # fields which are not part of a Box are skipped
+    {"_id": 5, "name": "Box5", "legacy": {"tags": ["a", "b"]}, "weight": 1.5},
+    # types the wire encoder doesn't translate fall back to the codec
+    {"_id": 6, "name": "Box6", "price": True},
+]
+
+
+def raw_documents():
+    return [RawBSONDocument(bson.encode(document)) for document in DOCUMENTS]
+
+
+def expected_bytes(paths=None, **kwargs):
+    # The documents as pymongo decodes them, sent the usual way
+    documents = [bson.decode(bson.encode(document)) for document in DOCUMENTS]
+    return bytes(GetBoxesResponse(box=documents_to_boxes(documents, paths), **kwargs))
+
+
+def test_encode_boxes_matches_codec():
+    encoded = EncodedBoxesResponse(encode_boxes(raw_documents()))
+
+    assert bytes(encoded) == expected_bytes()
+
+
+def test_encode_boxes_matches_codec_in_other_timezones(monkeypatch):
+    # pymongo's naive datetimes are UTC whatever the host's timezone
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    try:
+        encoded = EncodedBoxesResponse(encode_boxes(raw_documents()))
+        assert bytes(encoded) == expected_bytes()
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_encode_boxes_with_field_mask():
+    paths = ["id", "created_at"]
+    encoded = EncodedBoxesResponse(encode_boxes(raw_documents(), paths))
+
+    assert bytes(encoded) == expected_bytes(paths)
+
+
+def test_encoded_response_fields():
+    encoded = EncodedBoxesResponse(
+        encode_boxes(raw_documents()),
+        status=RequestStatus.ERROR,
+        next_page_token="next",
+        prev_page_token="prev",
+    )
+
+    assert bytes(encoded) == expected_bytes(
+        status=RequestStatus.ERROR, next_page_token="next", prev_page_token="prev"
+    )
+    response = GetBoxesResponse().parse(bytes(encoded))
+    assert [box.id for box in response.box] == [1, 2, 3, 4, 5, 6]
+    assert response.box[1].category == "ÜNÏ 📦"
+    assert response.next_page_token == "next"
+
+
+def test_encode_no_boxes():
+    encoded = EncodedBoxesResponse(encode_boxes([]), status=RequestStatus.OK)
+
+    assert bytes(encoded) == bytes(GetBoxesResponse(status=RequestStatus.OK))
@@ -0,0 +1,197 @@
+import struct
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import betterproto
+from betterproto import encode_varint
+from bson import decode as decode_bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+from codec import DOCUMENT_FIELDS, decode_table, document_to_box
+from db import Box, GetBoxesResponse
+
+# Collections read with these options hand out undecoded documents
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+_INT32 = struct.Struct("<i")
+_INT64 = struct.Struct("<q")
+
+# BSON element types, https://bsonspec.org/spec.html
+_STRING = 0x02
+_DATETIME = 0x09
+_NULL = 0x0A
+_BSON_INT32 = 0x10
+_BSON_INT64 = 0x12
+# Sizes of the values which are not length prefixed
+_FIXED_SIZES = {
+    0x01: 8,
+    0x06: 0,
+    0x07: 12,
+    0x08: 1,
+    0x09: 8,
+    0x0A: 0,
+    0x10: 4,
+    0x11: 8,
+    0x12: 8,
+    0x13: 16,
+    0x7F: 0,
+    0xFF: 0,
+}
+
+# Protobuf wire types
+_VARINT = 0
+_LENGTH_DELIMITED = 2
+
+# GetBoxesResponse.box is field 1
+_BOX_TAG = bytes([1 << 3 | _LENGTH_DELIMITED])
+# google.protobuf.Timestamp seconds and nanos
+_SECONDS_TAG = bytes([1 << 3 | _VARINT])
+_NANOS_TAG = bytes([2 << 3 | _VARINT])
+
+_WIRE_TYPES = {
+    betterproto.TYPE_STRING: _LENGTH_DELIMITED,
+    betterproto.TYPE_INT32: _VARINT,
+    betterproto.TYPE_MESSAGE: _LENGTH_DELIMITED,
+}
+# Box field -> (field number, proto type, tag)
+_BOX_FIELDS = {
+    field: (
+        meta.number,
+        meta.proto_type,
+        bytes([meta.number << 3 | _WIRE_TYPES[meta.proto_type]]),
+    )
+    for field, meta in Box()._betterproto.meta_by_field_name.items()
+}
+# Fields are written in field number order, like betterproto does
+_SLOTS = max(number for number, _, _ in _BOX_FIELDS.values()) + 1
+
+
+def encode_fields(
+    paths: Optional[Sequence[str]] = None,
+) -> Dict[bytes, Tuple[int, str, bytes]]:
+    # BSON key -> how to write it, paths come from a field mask. Document
+    # fields outside of it, e.g. sort keys read for page tokens, are skipped
+    return {
+        DOCUMENT_FIELDS[field].encode(): _BOX_FIELDS[field]
+        for field in paths or DOCUMENT_FIELDS
+    }
+
+
+def _element_end(raw: bytes, kind: int, position: int) -> int:
+    size = _FIXED_SIZES.get(kind)
+    if size is not None:
+        return position + size
+    if kind in (0x02, 0x0D, 0x0E):
+        return position + 4 + _INT32.unpack_from(raw, position)[0]
+    if kind in (0x03, 0x04, 0x0F):
+        return position + _INT32.unpack_from(raw, position)[0]
+    if kind == 0x05:
+        return position + 5 + _INT32.unpack_from(raw, position)[0]
+    if kind == 0x0B:
+        return raw.index(b"\x00", raw.index(b"\x00", position) + 1) + 1
+    if kind == 0x0C:
+        return position + 16 + _INT32.unpack_from(raw, position)[0]
+    raise ValueError(f"Unknown BSON element type {kind:#x}")
+
+
+def _encode_timestamp(millis: int) -> bytes:
+    # Same as betterproto's int(datetime.timestamp()) on the UTC datetimes
+    # document_to_box makes of pymongo's, the seconds are truncated towards
+    # zero
+    seconds = millis // 1000 if millis >= 0 else -(-millis // 1000)
+    nanos = millis % 1000 * 1000000
+    message = b""
+    if seconds:
+        message += _SECONDS_TAG + encode_varint(seconds)
+    if nanos:
+        message += _NANOS_TAG + encode_varint(nanos)
+    return encode_varint(len(message)) + message
+
+
+def encode_box(
+    raw: bytes, fields: Dict[bytes, Tuple[int, str, bytes]]
+) -> Optional[bytes]:
+    # Walks the BSON document and writes the protobuf encoding of the Box,
+    # without decoding it first. Returns None if a field holds a type the
+    # walk doesn't translate
+    values = [b""] * _SLOTS
+    position = 4
+    end = len(raw) - 1
+    while position < end:
+        kind = raw[position]
+        name_end = raw.index(b"\x00", position + 1)
+        field = fields.get(raw[position + 1 : name_end])
+        position = name_end + 1
+        if field is None:
+            position = _element_end(raw, kind, position)
+            continue
+
+        number, proto_type, tag = field
+        if proto_type == betterproto.TYPE_STRING:
+            if kind != _STRING:
+                return None
+            size = _INT32.unpack_from(raw, position)[0]
+            # BSON strings are UTF-8 already and end with a NUL byte
+            if size > 1:
+                values[number] = (
+                    tag
+                    + encode_varint(size - 1)
+                    + raw[position + 4 : position + 3 + size]
+                )
+            position += 4 + size
+        elif proto_type == betterproto.TYPE_INT32:
+            if kind == _BSON_INT32:
+                value = _INT32.unpack_from(raw, position)[0]
+                position += 4
+            elif kind == _BSON_INT64:
+                value = _INT64.unpack_from(raw, position)[0]
+                position += 8
+            else:
+                return None
+            if value:
+                values[number] = tag + encode_varint(value)
+        elif kind == _DATETIME:
+            millis = _INT64.unpack_from(raw, position)[0]
+            # betterproto leaves out the epoch as the default value
+            if millis:
+                values[number] = tag + _encode_timestamp(millis)
+            position += 8
+        elif kind != _NULL:
+            return None
+    return b"".join(values)
+
+
+def encode_boxes(
+    documents: Iterable[RawBSONDocument], paths: Optional[Sequence[str]] = None
+) -> bytearray:
+    # The repeated GetBoxesResponse.box field, written straight from the
+    # raw documents into one buffer
+    fields = encode_fields(paths)
+    table = decode_table(paths)
+    output = bytearray()
+    for document in documents:
+        raw = document.raw
+        box = encode_box(raw, fields)
+        if box is None:
+            box = bytes(document_to_box(decode_bson(raw), table=table))
+        output += _BOX_TAG
+        output += encode_varint(len(box))
+        output += box
+    return output
+
+
+class EncodedBoxesResponse(GetBoxesResponse):
+    # A GetBoxesResponse whose boxes are already wire encoded, so it is only
+    # good for sending. Fields of a message may come in any order on the
+    # wire, the boxes simply go before the rest of the response
+    def __init__(self, encoded_boxes: bytes = b"", **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.encoded_boxes = encoded_boxes
+
+    def __bytes__(self) -> bytes:
+        return bytes(self.encoded_boxes) + super().__bytes__()
+
+
+# betterproto resolves the field types in the module of the message class,
+# which is db and not this one, so the subclass shares the parent's metadata
+EncodedBoxesResponse._betterproto_meta = GetBoxesResponse()._betterproto